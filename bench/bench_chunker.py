@@ -0,0 +1,126 @@
+# bench/bench_chunker.py
+"""
+切分方式对比：按空行（旧）vs 按结构 + token 窗口（新）
+每种切分在临时目录里各建一个向量库，比较 chunk 数、长度分布、切分/建库耗时和命中率：
+  python bench/bench_chunker.py
+  python bench/bench_chunker.py --tokens 160 --overlap 24 --json bench_chunker.json
+
+命中率用 bench_retrieval.py 里的手写问题：top_k 内（且距离不超过 max_distance）
+有 chunk 含关键字即算命中；另外统计超过向量模型输入上限、会被截断的 chunk 数。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from bench_retrieval import HAND_QUERIES  # noqa: E402
+
+# all-MiniLM-L6-v2 的输入上限（wordpiece）
+MODEL_MAX_TOKENS = 256
+
+
+def chunk_corpus(chunker, files: list[Path]) -> tuple[list[str], float]:
+    t0 = time.perf_counter()
+    texts: list[str] = []
+    for fp in files:
+        texts.extend(c.text for c in chunker.chunk(fp.read_text(encoding="utf-8", errors="ignore")))
+    return texts, (time.perf_counter() - t0) * 1000
+
+
+def wordpieces(model, texts: list[str]) -> list[int]:
+    tok = model.tokenizer
+    return [len(tok(t, add_special_tokens=True)["input_ids"]) for t in texts]
+
+
+def run_chunker(name: str, chunker, files: list[Path], doc_dir: Path, embedder, model,
+                top_k: int, max_distance: float, tmp: Path) -> dict:
+    from rag_ingest import Ingestor
+    from rag_store import ChromaStore, open_collection
+
+    texts, chunk_ms = chunk_corpus(chunker, files)
+    lengths = wordpieces(model, texts)
+
+    db_path = tmp / name
+    collection = open_collection(db_path, "bench", embedding_function=embedder)
+    ingestor = Ingestor(doc_dir=doc_dir, db_path=db_path, collection_name="bench",
+                        store=ChromaStore(collection), embed_fn=embedder, chunker=chunker)
+    t0 = time.perf_counter()
+    ingestor.run(full=True)
+    build_s = time.perf_counter() - t0
+
+    hits = 0
+    for q, must in HAND_QUERIES:
+        res = collection.query(query_texts=[q], n_results=top_k, include=["documents", "distances"])
+        docs = [d for d, dist in zip(res["documents"][0], res["distances"][0]) if dist <= max_distance]
+        hits += any(must.lower() in d.lower() for d in docs)
+
+    return {
+        "chunker": chunker.signature,
+        "chunks": len(texts),
+        "tokens_mean": round(statistics.fmean(lengths), 1) if lengths else 0,
+        "tokens_max": max(lengths, default=0),
+        "truncated": sum(n > MODEL_MAX_TOKENS for n in lengths),
+        "chunk_ms": round(chunk_ms, 2),
+        "build_s": round(build_s, 2),
+        "hit_rate": round(hits / len(HAND_QUERIES), 3),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--tokens", type=int, default=None, help="structured chunk size (default: RAG_CHUNK_TOKENS)")
+    ap.add_argument("--overlap", type=int, default=None, help="structured overlap (default: RAG_CHUNK_OVERLAP)")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    args = ap.parse_args()
+
+    from chromadb.utils import embedding_functions
+
+    from rag_chunker import BlankLineChunker, StructuredChunker, CHUNK_OVERLAP, CHUNK_TOKENS
+    from rag_ingest import DOC_DIR, EMBED_MODEL, list_doc_files
+
+    files = list_doc_files(DOC_DIR)
+    if not files:
+        print(f"no docs in {DOC_DIR}")
+        return 1
+    top_k = int(os.getenv("RAG_TOP_K", "5"))
+    max_distance = float(os.getenv("RAG_MAX_DISTANCE", "0.70"))
+
+    embedder = embedding_functions.SentenceTransformerEmbeddingFunction(model_name=EMBED_MODEL)
+    from sentence_transformers import SentenceTransformer
+    model = SentenceTransformer(EMBED_MODEL, device="cpu")
+    # 预热
+    embedder(["warm up"])
+
+    chunkers = [
+        ("blank_line", BlankLineChunker()),
+        ("structured", StructuredChunker(
+            max_tokens=args.tokens if args.tokens is not None else CHUNK_TOKENS,
+            overlap_tokens=args.overlap if args.overlap is not None else CHUNK_OVERLAP,
+        )),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [run_chunker(name, c, files, DOC_DIR, embedder, model, top_k, max_distance, Path(tmp))
+                   for name, c in chunkers]
+
+    cols = ["chunker", "chunks", "tokens_mean", "tokens_max", "truncated", "chunk_ms", "build_s", "hit_rate"]
+    print(" | ".join(cols))
+    for r in results:
+        print(" | ".join(str(r[c]) for c in cols))
+
+    if args.json:
+        out = {"docs": len(files), "top_k": top_k, "max_distance": max_distance, "results": results}
+        Path(args.json).write_text(json.dumps(out, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
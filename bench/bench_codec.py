@@ -0,0 +1,188 @@
+# bench/bench_codec.py
+"""
+流式 TTS 输出格式对比：pcm / mulaw / adpcm
+1) 离线编码（不起服务）：每种格式的码率、压缩比、信噪比，以及编码 CPU——
+   - live：一次一帧（现场合成时 Piper 边出边编）
+   - batch：整句一次（缓存命中，或合成比播放快、攒下好几帧）
+   CPU 折算成“每路流占一个核的百分比”（编码耗时 / 音频时长）
+2) 端到端（bench_e2e 的本地替身：假 LLM + 假 Piper + 被测服务）：
+   每种格式并发请求 /tts/stream 和 /agent/tts/stream，测首块延迟 p50/p95、每路码率，
+   以及被测服务进程每路流消耗的 CPU（/proc 里的 utime+stime，仅 Linux）
+
+  python bench/bench_codec.py
+  python bench/bench_codec.py --offline-only
+  python bench/bench_codec.py --concurrency 16 --requests 64 --json bench_codec.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+import httpx
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "server"))
+sys.path.insert(0, str(HERE))
+
+from audio_codec import FORMATS, FrameEncoder, get_codec, snr_db  # noqa: E402
+from bench_e2e import QUESTIONS, SENTENCES, VOICE, LocalStack, metric, one_http  # noqa: E402
+
+
+def speechlike(seconds: float, sample_rate: int = 16000, seed: int = 0) -> bytes:
+    # 基频缓慢变化的谐波 + 音节包络 + 噪声，动态范围接近 TTS 语音
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sample_rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    env = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 0.6
+    sig = 9000 * env * voice / 3 + rng.normal(0, 150, len(t))
+    return np.clip(sig, -32768, 32767).astype("<i2").tobytes()
+
+
+def offline(seconds: float) -> list[dict]:
+    pcm = speechlike(seconds)
+    audio_s = len(pcm) / 32000
+    rows: list[dict] = []
+    for name in FORMATS:
+        codec = get_codec(name)
+        fb = codec.pcm_frame_bytes
+
+        enc = FrameEncoder(codec)
+        t = time.process_time()
+        live = [c for off in range(0, len(pcm), fb) for c in enc.feed(pcm[off:off + fb])] + list(enc.flush())
+        live_cpu = time.process_time() - t
+
+        enc = FrameEncoder(codec)
+        t = time.process_time()
+        batch = list(enc.feed(pcm)) + list(enc.flush())
+        batch_cpu = time.process_time() - t
+
+        data = b"".join(live)
+        assert data == b"".join(batch), name
+        rows.append({
+            "format": name,
+            "kbit_s": round(codec.bytes_per_s * 8 / 1000, 1),
+            "ratio": round(len(pcm) / len(data), 2),
+            "snr_db": snr_db(pcm, codec.decode(data)),
+            "live_us_per_frame": round(live_cpu / len(live) * 1e6, 1),
+            "live_cpu_pct": round(100 * live_cpu / audio_s, 3),
+            "batch_cpu_pct": round(100 * batch_cpu / audio_s, 3),
+        })
+    return rows
+
+
+def _cpu_s(pid: int) -> Optional[float]:
+    # /proc/<pid>/stat 的 utime + stime（时钟滴答）
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+async def run_format(base_url: str, path: str, fmt: str, n: int, concurrency: int, pid: Optional[int]) -> dict:
+    pool = SENTENCES if path == "/tts/stream" else QUESTIONS
+    payloads = [{"text": f"{pool[i % len(pool)]} {i}", "voice": VOICE, "format": fmt} for i in range(n)]
+    codec = get_codec(fmt)
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    cpu0 = _cpu_s(pid) if pid else None
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(300.0)) as client:
+        async def worker(p: dict) -> dict:
+            async with sem:
+                return await one_http(client, path, p)
+
+        t0 = time.perf_counter()
+        records = await asyncio.gather(*(worker(p) for p in payloads))
+        wall = time.perf_counter() - t0
+    cpu1 = _cpu_s(pid) if pid else None
+
+    ok = [r for r in records if r["ok"]]
+    nbytes = sum(r.get("bytes", 0) for r in ok)
+    audio_s = nbytes / codec.bytes_per_s
+    out = {
+        "endpoint": path,
+        "format": fmt,
+        "ok": len(ok),
+        "requests": n,
+        "first_chunk_ms": metric(records, "first_audio_ms"),
+        "bytes_per_stream": round(nbytes / len(ok)) if ok else None,
+        "kbit_s_per_stream": round(nbytes * 8 / 1000 / audio_s, 1) if audio_s else None,
+        "wall_s": round(wall, 2),
+    }
+    if cpu0 is not None and cpu1 is not None and ok:
+        out["server_cpu_ms_per_stream"] = round(1000 * (cpu1 - cpu0) / len(ok), 1)
+        out["server_cpu_pct_per_audio_s"] = round(100 * (cpu1 - cpu0) / audio_s, 2) if audio_s else None
+    return out
+
+
+async def online(base_url: str, args, pid: Optional[int]) -> list[dict]:
+    rows: list[dict] = []
+    for path in ("/tts/stream", "/agent/tts/stream"):
+        for fmt in args.formats:
+            print(f"[bench] {path} {fmt}: {args.requests} requests, concurrency {args.concurrency} ...")
+            rows.append(await run_format(base_url, path, fmt, args.requests, args.concurrency, pid))
+    return rows
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="TTS stream audio format benchmark")
+    ap.add_argument("--formats", default=",".join(FORMATS),
+                    type=lambda s: [x.strip() for x in s.split(",") if x.strip()])
+    ap.add_argument("--seconds", type=float, default=30.0, help="offline: seconds of audio to encode")
+    ap.add_argument("--offline-only", action="store_true")
+    ap.add_argument("--url", help="benchmark a running server instead of the local stand-ins (no server CPU)")
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=32)
+    # 本地替身参数（同 bench_e2e）
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--llm-port", type=int, default=11435)
+    ap.add_argument("--piper-rtf", type=float, default=0.1)
+    ap.add_argument("--ttft-ms", type=float, default=300.0)
+    ap.add_argument("--tokens-per-s", type=float, default=40.0)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    args = ap.parse_args()
+
+    report: dict = {"offline": offline(args.seconds)}
+    cols = ["format", "kbit_s", "ratio", "snr_db", "live_us_per_frame", "live_cpu_pct", "batch_cpu_pct"]
+    print(" | ".join(cols))
+    for r in report["offline"]:
+        print(" | ".join(str(r[c]) for c in cols))
+
+    if not args.offline_only:
+        if args.url:
+            report["online"] = asyncio.run(online(args.url.rstrip("/"), args, None))
+        else:
+            stack_args = SimpleNamespace(port=args.port, llm_port=args.llm_port, agent="openai",
+                                         ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, tokens=args.tokens,
+                                         piper_rtf=args.piper_rtf, piper_load_s=0.5, vosk_model=None,
+                                         scenarios=["tts_stream", "agent_tts_stream"], verbose=args.verbose)
+            with LocalStack(stack_args) as stack:
+                report["online"] = asyncio.run(online(stack.base_url, args, stack.procs[-1].pid))
+        cols = ["endpoint", "format", "ok", "first_chunk_ms", "kbit_s_per_stream", "bytes_per_stream",
+                "server_cpu_ms_per_stream", "server_cpu_pct_per_audio_s"]
+        print()
+        print(" | ".join(cols))
+        for r in report["online"]:
+            fc = r["first_chunk_ms"]
+            r_show = dict(r, first_chunk_ms=f"{fc['p50']}/{fc['p95']}" if fc.get("n") else "-")
+            print(" | ".join(str(r_show.get(c, "-")) for c in cols))
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
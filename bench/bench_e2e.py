@@ -0,0 +1,474 @@
+# bench/bench_e2e.py
+"""
+端到端压测：在本机用假的上游把整条语音链路跑起来，测延迟和容量，结果存 JSON 便于前后对比。
+
+默认自己拉起三样东西（不需要 OpenAI Key、Ollama 和 Piper）：
+- bench/stub_llm.py    假 LLM（OpenAI / Ollama 接口，首 token 延迟和生成速度可配）
+- bench/fake_piper.py  假 Piper（确定的正弦波 PCM，实时率可配）
+- server/main.py       被测服务（uvicorn 子进程，TTS 缓存关闭）
+
+场景（并发 --concurrency，每个场景 --requests 个请求）：
+- agent_reply       POST /agent/reply
+- tts_stream        POST /tts/stream
+- agent_tts_stream  POST /agent/tts/stream
+- ws_asr            按实时速度回放 WAV 到 /ws/asr（需要 --wav 和 Vosk 模型）
+
+指标：TTFB（收到响应头）、首音频时间（收到第一块 PCM）、总耗时的 p50/p95/p99，吞吐（请求/秒、音频秒/秒），
+ASR 的最终结果延迟（最后一帧发出到拿到最终结果）和解码实时率（服务端解码耗时 / 音频时长）。
+
+  python bench/bench_e2e.py
+  python bench/bench_e2e.py --concurrency 16 --requests 64 --json e2e_before.json
+  python bench/bench_e2e.py --scenarios ws_asr --wav sample_16k.wav --asr-sessions 8
+  python bench/bench_e2e.py --url http://127.0.0.1:8080 --scenarios tts_stream   # 压已经在跑的服务
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+from pathlib import Path
+from typing import Optional
+
+import httpx
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVER_DIR = ROOT / "server"
+BENCH_DIR = Path(__file__).resolve().parent
+
+SCENARIOS = ("agent_reply", "tts_stream", "agent_tts_stream", "ws_asr")
+VOICE = "en_US-amy-medium.onnx"
+PCM_BYTES_PER_S = 16000 * 2
+
+QUESTIONS = [
+    "What wood is the Seated Guanyin carved from",
+    "Which dynasty is the Seated Guanyin from",
+    "Who is the small figure in the headdress",
+    "When was the sculpture covered with gold",
+    "What did the conservators find under the grime",
+]
+SENTENCES = [
+    "Welcome to the museum, the Seated Guanyin is in the next gallery.",
+    "This sculpture was carved from paulownia wood during the Song dynasty.",
+    "Please do not touch the objects on display.",
+    "The gift shop is open until five in the afternoon.",
+]
+
+
+# 统计
+
+def pct(values: list[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    s = sorted(values)
+    return round(s[min(len(s) - 1, max(0, int(round(q / 100.0 * len(s))) - 1))], 1)
+
+
+def summarize(values: list[float]) -> dict:
+    return {"n": len(values), "p50": pct(values, 50), "p95": pct(values, 95), "p99": pct(values, 99),
+            "mean": round(sum(values) / len(values), 1) if values else None}
+
+
+def metric(records: list[dict], key: str) -> dict:
+    return summarize([r[key] for r in records if r.get("ok") and r.get(key) is not None])
+
+
+# 本地替身
+
+def make_fake_piper_dir(root: Path) -> Path:
+    # 假 Piper 包一层启动脚本，和真 Piper 一样放在模型目录里
+    if os.name == "nt":
+        exe = root / "piper.cmd"
+        exe.write_text(f'@"{sys.executable}" "{BENCH_DIR / "fake_piper.py"}" %*\r\n', encoding="utf-8")
+    else:
+        exe = root / "piper"
+        exe.write_text(f'#!/bin/sh\nexec "{sys.executable}" "{BENCH_DIR / "fake_piper.py"}" "$@"\n', encoding="utf-8")
+        exe.chmod(exe.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    (root / VOICE).write_bytes(b"")
+    (root / (VOICE + ".json")).write_text(json.dumps({"audio": {"sample_rate": 16000}}), encoding="utf-8")
+    return exe
+
+
+def wait_http(url: str, proc: subprocess.Popen, timeout_s: float, what: str) -> float:
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout_s:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{what} exited with code {proc.returncode}")
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return time.monotonic() - t0
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{what} not ready after {timeout_s:.0f}s: {url}")
+
+
+def wait_ready(base_url: str, need: tuple[str, ...], timeout_s: float) -> float:
+    # /health 只说明在监听；这里等压测要用的组件加载完（/ready 里的 agent / piper / vosk）
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < timeout_s:
+        comps = httpx.get(f"{base_url}/ready", timeout=5.0).json()["components"]
+        failed = {n: comps[n]["error"] for n in need if comps.get(n, {}).get("state") == "failed"}
+        if failed:
+            raise RuntimeError(f"server components failed: {failed}")
+        if all(comps.get(n, {}).get("state") in ("ready", "lazy") for n in need):
+            return time.monotonic() - t0
+        time.sleep(0.1)
+    raise RuntimeError(f"server components not ready after {timeout_s:.0f}s: {need}")
+
+
+class LocalStack:
+    """拉起假 LLM + 被测服务（配假 Piper），退出时全部关掉"""
+
+    def __init__(self, args):
+        self.args = args
+        self.procs: list[subprocess.Popen] = []
+        self.tmp = tempfile.TemporaryDirectory(prefix="bench_e2e_")
+        self.base_url = f"http://127.0.0.1:{args.port}"
+        self.listen_s: Optional[float] = None
+        self.ready_s: Optional[float] = None
+
+    def __enter__(self) -> "LocalStack":
+        a = self.args
+        llm_url = f"http://127.0.0.1:{a.llm_port}"
+        stub = subprocess.Popen([sys.executable, str(BENCH_DIR / "stub_llm.py"), "--port", str(a.llm_port),
+                                 "--ttft-ms", str(a.ttft_ms), "--tokens-per-s", str(a.tokens_per_s),
+                                 "--tokens", str(a.tokens),
+                                 "--prefill-ms-per-token", str(getattr(a, "prefill_ms_per_token", 0.0)),
+                                 "--kv-slots", str(getattr(a, "kv_slots", 4))])
+        self.procs.append(stub)
+        wait_http(f"{llm_url}/stats", stub, 30, "stub LLM")
+
+        piper_dir = Path(self.tmp.name)
+        exe = make_fake_piper_dir(piper_dir)
+        env = os.environ.copy()
+        env.update({
+            "AGENT_KIND": a.agent,
+            "OPENAI_API_KEY": "stub",
+            "OPENAI_BASE_URL": f"{llm_url}/v1",
+            "OLLAMA_URL": f"{llm_url}/api/generate",
+            "PIPER_DIR": str(piper_dir),
+            "PIPER_EXE": str(exe),
+            "FAKE_PIPER_RTF": str(a.piper_rtf),
+            "FAKE_PIPER_LOAD_S": str(a.piper_load_s),
+            # 关掉 TTS 缓存，每次都真合成
+            "TTS_CACHE": "0",
+        })
+        if a.vosk_model:
+            env["VOSK_MODEL_DIR"] = str(Path(a.vosk_model).resolve())
+        server = subprocess.Popen(self.server_command(),
+                                  cwd=str(SERVER_DIR), env=env,
+                                  stdout=None if a.verbose else subprocess.DEVNULL,
+                                  stderr=None if a.verbose else subprocess.DEVNULL)
+        self.procs.append(server)
+        self.listen_s = wait_http(f"{self.base_url}/health", server, 120, "server")
+        need = ("agent", "piper") + (("vosk",) if "ws_asr" in a.scenarios and a.wav else ())
+        self.ready_s = self.listen_s + wait_ready(self.base_url, need, 300)
+        return self
+
+    def server_command(self) -> list[str]:
+        # 被测服务的启动命令（在 server/ 下执行）；bench_workers.py 换成多进程的启动方式
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+                "--port", str(self.args.port), "--log-level", "warning"]
+
+    def __exit__(self, *exc) -> None:
+        for p in reversed(self.procs):
+            if p.poll() is None:
+                p.terminate()
+                try:
+                    p.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    p.kill()
+        self.tmp.cleanup()
+
+
+# HTTP 场景
+
+def scenario_payloads(name: str, n: int, same_text: bool) -> tuple[str, list[dict]]:
+    # 默认每个请求文本都不同，避免被合并/缓存；--same-text 用来测合并
+    def text(pool: list[str], i: int) -> str:
+        return pool[0] if same_text else f"{pool[i % len(pool)]} {i}"
+
+    if name == "agent_reply":
+        return "/agent/reply", [{"text": text(QUESTIONS, i)} for i in range(n)]
+    if name == "tts_stream":
+        return "/tts/stream", [{"text": text(SENTENCES, i), "voice": VOICE} for i in range(n)]
+    return "/agent/tts/stream", [{"text": text(QUESTIONS, i), "voice": VOICE} for i in range(n)]
+
+
+async def one_http(client: httpx.AsyncClient, path: str, payload: dict) -> dict:
+    rec: dict = {"ok": False}
+    t0 = time.perf_counter()
+    try:
+        async with client.stream("POST", path, json=payload) as resp:
+            rec["status"] = resp.status_code
+            rec["ttfb_ms"] = 1000 * (time.perf_counter() - t0)
+            nbytes = 0
+            async for chunk in resp.aiter_bytes():
+                if chunk and nbytes == 0:
+                    rec["first_audio_ms"] = 1000 * (time.perf_counter() - t0)
+                nbytes += len(chunk)
+            rec["bytes"] = nbytes
+        rec["total_ms"] = 1000 * (time.perf_counter() - t0)
+        rec["ok"] = resp.status_code == 200
+        if not rec["ok"]:
+            rec["error"] = f"HTTP {resp.status_code}"
+    except Exception as e:
+        rec["error"] = repr(e)
+    return rec
+
+
+async def run_http(base_url: str, name: str, concurrency: int, n: int, same_text: bool) -> dict:
+    path, payloads = scenario_payloads(name, n, same_text)
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(300.0)) as client:
+        async def worker(p: dict) -> dict:
+            async with sem:
+                return await one_http(client, path, p)
+
+        t0 = time.perf_counter()
+        records = await asyncio.gather(*(worker(p) for p in payloads))
+        wall = time.perf_counter() - t0
+
+    ok = [r for r in records if r["ok"]]
+    out = {
+        "endpoint": path,
+        "requests": n,
+        "ok": len(ok),
+        "errors": sorted({r.get("error", "") for r in records if not r["ok"]}),
+        "wall_s": round(wall, 3),
+        "throughput_rps": round(len(ok) / wall, 2) if wall > 0 else None,
+        "ttfb_ms": metric(records, "ttfb_ms"),
+        "total_ms": metric(records, "total_ms"),
+    }
+    if name != "agent_reply":
+        # 流式接口：bytes 都是 16kHz s16le
+        audio_s = sum(r.get("bytes", 0) for r in ok) / PCM_BYTES_PER_S
+        out["first_audio_ms"] = metric(records, "first_audio_ms")
+        out["audio_s"] = round(audio_s, 2)
+        out["audio_s_per_s"] = round(audio_s / wall, 2) if wall > 0 else None
+    return out
+
+
+# ASR 场景
+
+def load_wav_16k(path: str) -> bytes:
+    with wave.open(path, "rb") as wf:
+        if wf.getsampwidth() != 2:
+            raise ValueError(f"{path}: need 16-bit PCM WAV")
+        sr, ch = wf.getframerate(), wf.getnchannels()
+        x = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+    x = x.reshape(-1, ch).mean(axis=1) if ch > 1 else x.astype(np.float64)
+    if sr != 16000:
+        # 线性插值重采样，压测够用
+        n = int(len(x) * 16000 / sr)
+        x = np.interp(np.linspace(0, len(x) - 1, n), np.arange(len(x)), x)
+    return np.clip(x, -32768, 32767).astype(np.int16).tobytes()
+
+
+async def replay_session(ws_url: str, pcm: bytes, frame_ms: int) -> dict:
+    import websockets
+
+    rec: dict = {"ok": False, "partials": 0, "finals": 0}
+    frame = PCM_BYTES_PER_S * frame_ms // 1000
+    try:
+        async with websockets.connect(ws_url, max_size=None) as ws:
+            t0 = time.perf_counter()
+            await ws.send(json.dumps({"type": "start", "sampleRate": 16000}))
+            while json.loads(await ws.recv()).get("type") != "ack":
+                pass
+            rec["ack_ms"] = 1000 * (time.perf_counter() - t0)
+
+            fence = asyncio.get_running_loop().create_future()
+            last_sent = [0.0]
+
+            async def reader() -> None:
+                async for raw in ws:
+                    data = json.loads(raw)
+                    now = time.perf_counter()
+                    if data.get("type") == "partial":
+                        rec["partials"] += 1
+                        rec.setdefault("first_partial_ms", 1000 * (now - t_audio))
+                    elif data.get("type") == "final":
+                        rec["finals"] += 1
+                        if last_sent[0]:
+                            rec["final_ms"] = 1000 * (now - last_sent[0])
+                    elif data.get("type") == "ack" and not fence.done():
+                        fence.set_result(now)
+                        return
+
+            t_audio = time.perf_counter()
+            task = asyncio.create_task(reader())
+            # 按实时速度发帧（和麦克风一样每 frame_ms 一帧）
+            for i, off in enumerate(range(0, len(pcm), frame)):
+                delay = t_audio + i * frame_ms / 1000.0 - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await ws.send(pcm[off:off + frame])
+            last_sent[0] = time.perf_counter()
+            await ws.send(json.dumps({"type": "stop"}))
+            # stop 之后再发一次 start：服务端按顺序处理，收到这个 ack 时 stop 的最终结果一定已经发出
+            await ws.send(json.dumps({"type": "start", "sampleRate": 16000}))
+            await asyncio.wait_for(fence, timeout=30)
+            await task
+            rec["stop_ms"] = 1000 * (fence.result() - last_sent[0])
+            rec["ok"] = True
+    except Exception as e:
+        rec["error"] = repr(e)
+    return rec
+
+
+async def run_asr(base_url: str, wav: str, sessions: int, frame_ms: int) -> dict:
+    pcm = load_wav_16k(wav)
+    audio_s = len(pcm) / PCM_BYTES_PER_S
+    ws_url = base_url.replace("http", "ws", 1) + "/ws/asr"
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=10.0) as client:
+        before = (await client.get("/asr/workers")).json()
+        t0 = time.perf_counter()
+        records = await asyncio.gather(*(replay_session(ws_url, pcm, frame_ms) for _ in range(sessions)))
+        wall = time.perf_counter() - t0
+        after = (await client.get("/asr/workers")).json()
+
+    busy = sum(s["busy_s"] for s in after["shards"]) - sum(s["busy_s"] for s in before["shards"])
+    frames_in = sum(s["frames_in"] for s in after["shards"]) - sum(s["frames_in"] for s in before["shards"])
+    decoded = (sum(s["frames_decoded"] for s in after["shards"])
+               - sum(s["frames_decoded"] for s in before["shards"]))
+    ok = [r for r in records if r["ok"]]
+    return {
+        "endpoint": "/ws/asr",
+        "sessions": sessions,
+        "ok": len(ok),
+        "errors": sorted({r.get("error", "") for r in records if not r["ok"]}),
+        "audio_s_per_session": round(audio_s, 2),
+        "wall_s": round(wall, 3),
+        "ack_ms": metric(records, "ack_ms"),
+        "first_partial_ms": metric(records, "first_partial_ms"),
+        "final_ms": metric(records, "final_ms"),
+        "stop_ms": metric(records, "stop_ms"),
+        # 服务端解码耗时 / 送入的音频时长：< 1 才跟得上实时，越小能撑的会话越多
+        "decode_rtf": round(busy / (audio_s * len(ok)), 4) if ok and audio_s > 0 else None,
+        "decoded_frame_ratio": round(decoded / frames_in, 3) if frames_in else None,
+        "throughput_audio_s_per_s": round(audio_s * len(ok) / wall, 2) if wall > 0 else None,
+    }
+
+
+# 主流程
+
+def git_rev() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=str(ROOT), capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def fmt(m: Optional[dict]) -> str:
+    if not m or not m.get("n"):
+        return "-"
+    return f"{m['p50']}/{m['p95']}/{m['p99']}"
+
+
+def print_table(results: dict) -> None:
+    print()
+    if any(name != "ws_asr" for name in results):
+        print(f"{'scenario':<18} {'ok':>7} {'rps':>7} {'ttfb p50/95/99 ms':>22} {'first audio ms':>22} "
+              f"{'total ms':>22} {'audio x':>8}")
+    for name, r in results.items():
+        if name == "ws_asr":
+            continue
+        print(f"{name:<18} {r['ok']:>3}/{r['requests']:<3} {r['throughput_rps'] or '-':>7} "
+              f"{fmt(r['ttfb_ms']):>22} {fmt(r.get('first_audio_ms')):>22} {fmt(r['total_ms']):>22} "
+              f"{r.get('audio_s_per_s') or '-':>8}")
+    r = results.get("ws_asr")
+    if r:
+        print(f"\nws_asr: {r['ok']}/{r['sessions']} sessions x {r['audio_s_per_session']}s audio, "
+              f"ack {fmt(r['ack_ms'])} ms, first partial {fmt(r['first_partial_ms'])} ms, "
+              f"final {fmt(r['final_ms'])} ms, decode RTF {r['decode_rtf']}, "
+              f"decoded frames {r['decoded_frame_ratio']}")
+    for name, r in results.items():
+        if r.get("errors"):
+            print(f"[{name}] errors: {r['errors'][:3]}")
+
+
+async def run_all(base_url: str, args) -> dict:
+    results: dict = {}
+    for name in args.scenarios:
+        if name == "ws_asr":
+            if not args.wav:
+                print("[bench] ws_asr skipped (no --wav)")
+                continue
+            print(f"[bench] ws_asr: {args.asr_sessions} sessions ...")
+            results[name] = await run_asr(base_url, args.wav, args.asr_sessions, args.frame_ms)
+        else:
+            print(f"[bench] {name}: {args.requests} requests, concurrency {args.concurrency} ...")
+            results[name] = await run_http(base_url, name, args.concurrency, args.requests, args.same_text)
+    return results
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="end-to-end latency / capacity benchmark")
+    ap.add_argument("--url", help="压已经在跑的服务（不拉起替身）")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS),
+                    type=lambda s: [x.strip() for x in s.split(",") if x.strip()])
+    ap.add_argument("--concurrency", type=int, default=8)
+    ap.add_argument("--requests", type=int, default=32, help="每个 HTTP 场景的请求数")
+    ap.add_argument("--same-text", action="store_true", help="所有请求用同一文本（测合并）")
+    ap.add_argument("--wav", help="ws_asr 回放的 WAV（16-bit，任意采样率/声道）")
+    ap.add_argument("--asr-sessions", type=int, default=None, help="并发 ASR 会话数，默认同 --concurrency")
+    ap.add_argument("--frame-ms", type=int, default=20)
+    ap.add_argument("--vosk-model", help="VOSK_MODEL_DIR")
+    # 本地替身参数
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--llm-port", type=int, default=11435)
+    ap.add_argument("--agent", default="openai", choices=["openai", "rag_ollama"])
+    ap.add_argument("--ttft-ms", type=float, default=300.0)
+    ap.add_argument("--tokens-per-s", type=float, default=40.0)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--prefill-ms-per-token", type=float, default=0.0,
+                    help="假 LLM 每个没命中 KV 缓存的 prompt token 的耗时（Ollama 接口）")
+    ap.add_argument("--piper-rtf", type=float, default=0.1)
+    ap.add_argument("--piper-load-s", type=float, default=0.5)
+    ap.add_argument("--verbose", action="store_true", help="显示被测服务的日志")
+    ap.add_argument("--json", help="结果写到这个文件")
+    args = ap.parse_args()
+    args.asr_sessions = args.asr_sessions or args.concurrency
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        ap.error(f"unknown scenarios: {unknown}")
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git": git_rev(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("json", "verbose")},
+    }
+    if args.url:
+        report["results"] = asyncio.run(run_all(args.url.rstrip("/"), args))
+    else:
+        with LocalStack(args) as stack:
+            report["server_listen_s"] = round(stack.listen_s, 2)
+            report["server_ready_s"] = round(stack.ready_s, 2)
+            print(f"[bench] server listening in {stack.listen_s:.2f}s, ready in {stack.ready_s:.2f}s")
+            report["results"] = asyncio.run(run_all(stack.base_url, args))
+
+    print_table(report["results"])
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nsaved -> {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+# bench/bench_embed.py
+"""
+向量化后端对比：sentence_transformers（PyTorch）vs onnx（int8 量化）
+每个后端在单独的子进程里跑（常驻内存互不干扰），比较：
+- 加载耗时、常驻内存（峰值 RSS）
+- 单条查询向量化延迟 p50/p95（检索时每个问题一次）
+- 入库吞吐（chunk/s，按 RAG_EMBED_BATCH 分批）
+- 和第一个后端相比的检索重叠：同一批问题 top_k 结果的交集比例，以及同一 chunk 向量的余弦相似度
+
+  python server/rag_embed.py --export        # 先导出 onnx 模型
+  python bench/bench_embed.py
+  python bench/bench_embed.py --threads 4 --backends onnx,sentence_transformers --json bench_embed.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "server"))
+sys.path.insert(0, str(HERE))
+
+from bench_retrieval import HAND_QUERIES  # noqa: E402
+
+
+def _rss_mb() -> float:
+    # 峰值常驻内存；Linux 上 ru_maxrss 单位是 KB，macOS 是字节
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))] if xs else 0.0
+
+
+def load_corpus() -> list[str]:
+    from rag_chunker import get_chunker
+    from rag_ingest import DOC_DIR, list_doc_files
+
+    chunker = get_chunker()
+    texts: list[str] = []
+    for fp in list_doc_files(DOC_DIR):
+        texts.extend(c.text for c in chunker.chunk(fp.read_text(encoding="utf-8", errors="ignore")))
+    return texts
+
+
+def queries() -> list[str]:
+    return [q for q, _ in HAND_QUERIES]
+
+
+def child(backend: str, out_dir: Path, repeat: int, batch_size: int) -> int:
+    """子进程：只加载一个后端，结果写到 out_dir/<backend>.json / .npy"""
+    from rag_embed import RAG_EMBED_MODEL, get_embedder
+
+    rss_base = _rss_mb()
+    texts = load_corpus()
+    qs = queries()
+
+    embedder = get_embedder(RAG_EMBED_MODEL, backend)
+    t0 = time.perf_counter()
+    embedder.encode(["warm up"])
+    load_s = time.perf_counter() - t0
+
+    lat: list[float] = []
+    q_vecs = None
+    for _ in range(max(1, repeat)):
+        vecs = []
+        for q in qs:
+            t = time.perf_counter()
+            vecs.append(embedder.encode([q])[0])
+            lat.append((time.perf_counter() - t) * 1000)
+        q_vecs = vecs
+
+    t = time.perf_counter()
+    doc_vecs = embedder.encode(texts, batch_size=batch_size)
+    ingest_s = time.perf_counter() - t
+
+    np.save(out_dir / f"{backend}.docs.npy", np.asarray(doc_vecs, dtype=np.float32))
+    np.save(out_dir / f"{backend}.queries.npy", np.asarray(q_vecs, dtype=np.float32))
+    stats = {
+        "backend": backend,
+        "signature": embedder.signature,
+        "load_s": round(load_s, 2),
+        "query_p50_ms": round(_pct(lat, 50), 2),
+        "query_p95_ms": round(_pct(lat, 95), 2),
+        "ingest_chunks": len(texts),
+        "ingest_per_s": round(len(texts) / ingest_s, 1) if ingest_s > 0 else 0.0,
+        "rss_base_mb": rss_base,
+        "rss_peak_mb": _rss_mb(),
+    }
+    (out_dir / f"{backend}.json").write_text(json.dumps(stats), encoding="utf-8")
+    return 0
+
+
+def top_k(q: np.ndarray, docs: np.ndarray, k: int) -> list[list[int]]:
+    # 和 Chroma 默认一样按 L2 距离排序
+    d = (q * q).sum(1)[:, None] - 2 * q @ docs.T + (docs * docs).sum(1)[None, :]
+    return [list(np.argsort(row)[:k]) for row in d]
+
+
+def compare(ref: str, other: str, out_dir: Path, k: int) -> dict:
+    rd, od = (np.load(out_dir / f"{b}.docs.npy") for b in (ref, other))
+    rq, oq = (np.load(out_dir / f"{b}.queries.npy") for b in (ref, other))
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(top_k(rq, rd, k), top_k(oq, od, k))]
+    top1 = [a[0] == b[0] for a, b in zip(top_k(rq, rd, 1), top_k(oq, od, 1))]
+
+    def unit(x: np.ndarray) -> np.ndarray:
+        return x / np.clip(np.linalg.norm(x, axis=1, keepdims=True), 1e-12, None)
+
+    cos = (unit(rd) * unit(od)).sum(1)
+    return {
+        "topk_overlap": round(statistics.fmean(overlap), 3),
+        "top1_agree": round(sum(top1) / len(top1), 3),
+        "cosine_mean": round(float(cos.mean()), 4),
+        "cosine_min": round(float(cos.min()), 4),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--backends", default="sentence_transformers,onnx",
+                    help="comma separated; the first one is the reference for overlap")
+    ap.add_argument("--threads", type=int, default=None, help="RAG_EMBED_THREADS for every backend")
+    ap.add_argument("--repeat", type=int, default=5, help="passes over the hand queries for latency")
+    ap.add_argument("--batch-size", type=int, default=int(os.getenv("RAG_EMBED_BATCH", "64")))
+    ap.add_argument("--top-k", type=int, default=int(os.getenv("RAG_TOP_K", "5")))
+    ap.add_argument("--json", default=None, help="write results to this file")
+    ap.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--out", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        return child(args.child, Path(args.out), args.repeat, args.batch_size)
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    env = dict(os.environ)
+    if args.threads is not None:
+        env["RAG_EMBED_THREADS"] = str(args.threads)
+
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory() as tmp:
+        ok: list[str] = []
+        for b in backends:
+            cmd = [sys.executable, __file__, "--child", b, "--out", tmp,
+                   "--repeat", str(args.repeat), "--batch-size", str(args.batch_size)]
+            proc = subprocess.run(cmd, env=env)
+            if proc.returncode != 0 or not (Path(tmp) / f"{b}.json").exists():
+                print(f"[BENCH] {b} failed (exit {proc.returncode})")
+                continue
+            ok.append(b)
+            results.append(json.loads((Path(tmp) / f"{b}.json").read_text(encoding="utf-8")))
+        for r in results:
+            if ok and r["backend"] != ok[0]:
+                r.update(compare(ok[0], r["backend"], Path(tmp), args.top_k))
+
+    if not results:
+        return 1
+    cols = ["backend", "load_s", "query_p50_ms", "query_p95_ms", "ingest_per_s", "rss_peak_mb",
+            "topk_overlap", "top1_agree", "cosine_mean"]
+    print(" | ".join(cols))
+    for r in results:
+        print(" | ".join(str(r.get(c, "-")) for c in cols))
+
+    if args.json:
+        out = {"threads": args.threads, "batch_size": args.batch_size, "top_k": args.top_k,
+               "queries": len(HAND_QUERIES), "results": results}
+        Path(args.json).write_text(json.dumps(out, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,157 @@
+# bench/bench_piper_io.py
+"""
+Piper 管道读写方式对比：asyncio（事件循环直接读管道）vs thread（专用线程池阻塞读）
+在进程内直接用 PiperTTS + 假 Piper（bench/fake_piper.py），N 路流同时合成（默认 50），每种方式一个子进程：
+- 服务进程每路流的 CPU：进程 CPU 时间（不含 Piper 子进程）/ 音频秒数
+- 调度抖动：另起一个每 5ms 醒一次的定时协程，统计实际醒来比预定晚了多少（p50/p99/max）
+- 首块延迟 p50/p95、线程数峰值
+
+  python bench/bench_piper_io.py
+  python bench/bench_piper_io.py --streams 50 --sentences 3 --piper-rtf 1.0 --piper-chunk-ms 20 --json piper_io.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "server"))
+sys.path.insert(0, str(HERE))
+
+from bench_e2e import SENTENCES, VOICE, make_fake_piper_dir  # noqa: E402
+
+MODES = ("asyncio", "thread")
+TICK_S = 0.005
+
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))], 2) if xs else 0.0
+
+
+async def _child(streams: int, sentences: int, out: Path) -> None:
+    from tts_piper import PiperTTS, PIPER_EXE, PIPER_VOICES_DIR
+
+    tts = PiperTTS(PIPER_EXE, voices_dir=PIPER_VOICES_DIR)
+    await tts.start()  # 预热 PIPER_POOL_MIN 个进程，拉起进程的耗时不算在内
+
+    lags: list[float] = []
+    stop = asyncio.Event()
+    peak_threads = threading.active_count()
+
+    async def ticker() -> None:
+        nonlocal peak_threads
+        loop = asyncio.get_running_loop()
+        due = loop.time() + TICK_S
+        while not stop.is_set():
+            await asyncio.sleep(max(0.0, due - loop.time()))
+            now = loop.time()
+            lags.append((now - due) * 1000)
+            peak_threads = max(peak_threads, threading.active_count())
+            due = max(due + TICK_S, now)
+
+    async def one(i: int) -> tuple[float, int]:
+        t0 = time.perf_counter()
+        first = None
+        nbytes = 0
+        for j in range(sentences):
+            text = f"{SENTENCES[(i + j) % len(SENTENCES)]} {i}"
+            gen = await tts.stream_s16le(text=text, model_path=VOICE, sample_rate=16000, chunk_ms=20)
+            async for c in gen:
+                if first is None:
+                    first = (time.perf_counter() - t0) * 1000
+                nbytes += len(c)
+        return first or 0.0, nbytes
+
+    tick = asyncio.create_task(ticker())
+    await asyncio.sleep(0.2)
+    lags.clear()
+    cpu0, wall0 = time.process_time(), time.perf_counter()
+    results = await asyncio.gather(*(one(i) for i in range(streams)))
+    cpu, wall = time.process_time() - cpu0, time.perf_counter() - wall0
+    stop.set()
+    await tick
+    await tts.close()
+
+    audio_s = sum(n for _, n in results) / 32000
+    out.write_text(json.dumps({
+        "io": tts.pool.stats()["io"],
+        "streams": streams,
+        "wall_s": round(wall, 2),
+        "audio_s": round(audio_s, 1),
+        "cpu_s": round(cpu, 3),
+        "cpu_ms_per_stream": round(1000 * cpu / streams, 1),
+        "cpu_ms_per_audio_s": round(1000 * cpu / audio_s, 2) if audio_s else None,
+        "lag_p50_ms": _pct(lags, 50),
+        "lag_p99_ms": _pct(lags, 99),
+        "lag_max_ms": round(max(lags), 2) if lags else 0.0,
+        "first_chunk_p50_ms": _pct([f for f, _ in results], 50),
+        "first_chunk_p95_ms": _pct([f for f, _ in results], 95),
+        "threads_peak": peak_threads,
+    }), encoding="utf-8")
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="Piper pipe I/O benchmark")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--streams", type=int, default=50)
+    ap.add_argument("--sentences", type=int, default=2, help="sentences per stream, spoken back to back")
+    ap.add_argument("--piper-rtf", type=float, default=1.0, help="fake Piper real-time factor")
+    ap.add_argument("--piper-chunk-ms", type=int, default=20, help="fake Piper write size (real Piper writes whole sentences)")
+    ap.add_argument("--read-bytes", type=int, default=None, help="PIPER_READ_BYTES")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    ap.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        asyncio.run(_child(args.streams, args.sentences, Path(args.child)))
+        return 0
+
+    results: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix="bench_piper_io_") as tmp:
+        exe = make_fake_piper_dir(Path(tmp))
+        for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+            env = dict(os.environ)
+            env.update({
+                "PIPER_IO": mode,
+                "PIPER_DIR": tmp,
+                "PIPER_EXE": str(exe),
+                "PIPER_POOL_MIN": str(args.streams),
+                "PIPER_POOL_MAX_PER_VOICE": str(args.streams),
+                "PIPER_POOL_MAX_TOTAL": str(args.streams),
+                "TTS_CACHE": "0",
+                "FAKE_PIPER_RTF": str(args.piper_rtf),
+                "FAKE_PIPER_LOAD_S": "0",
+                "FAKE_PIPER_CHUNK_MS": str(args.piper_chunk_ms),
+            })
+            if args.read_bytes:
+                env["PIPER_READ_BYTES"] = str(args.read_bytes)
+            out = Path(tmp) / f"{mode}.json"
+            print(f"[bench] {mode}: {args.streams} streams x {args.sentences} sentences ...", flush=True)
+            proc = subprocess.run([sys.executable, __file__, "--child", str(out), "--streams", str(args.streams),
+                                   "--sentences", str(args.sentences)], env=env)
+            if proc.returncode != 0 or not out.exists():
+                print(f"[BENCH] {mode} failed (exit {proc.returncode})")
+                continue
+            results.append(json.loads(out.read_text(encoding="utf-8")))
+
+    cols = ["io", "streams", "audio_s", "cpu_ms_per_stream", "cpu_ms_per_audio_s",
+            "lag_p50_ms", "lag_p99_ms", "lag_max_ms", "first_chunk_p50_ms", "first_chunk_p95_ms", "threads_peak"]
+    print(" | ".join(cols))
+    for r in results:
+        print(" | ".join(str(r.get(c, "-")) for c in cols))
+    if args.json:
+        Path(args.json).write_text(json.dumps({"config": vars(args), "results": results}, indent=2), encoding="utf-8")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,141 @@
+# bench/bench_retrieval.py
+"""
+检索对比：纯向量 vs 混合（BM25 + 向量 RRF）vs 混合 + 词法快速路径
+在 server 目录的 .env 配置下运行（需要先 python rag_ingest.py 建好索引）：
+  python bench/bench_retrieval.py
+  python bench/bench_retrieval.py --probes 200 --json bench_retrieval.json
+
+召回率两部分：
+- 手写问题：答案所在 chunk 里必须出现的关键字
+- 自动探针：随机抽 chunk，取其中一句话的一部分当问题，看该 chunk 是否在 top_k 里
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import random
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "server"))
+
+# (问题, 正确 chunk 中应出现的关键字)
+HAND_QUERIES = [
+    ("What is the reference number of the Seated Guanyin?", "1923.921"),
+    ("What wood is the Seated Guanyin carved from?", "Paulownia"),
+    ("Which dynasty is the Seated Guanyin from?", "Song dynasty"),
+    ("When was the sculpture covered with gold?", "Ming dynasty"),
+    ("Who is Guanyin?", "Bodhisattva of Compassion"),
+    ("Who is the small figure in Guanyin's headdress?", "Amituo"),
+    ("What does Guanyin of the Southern Sea refer to?", "Southern Sea"),
+    ("How big is the Seated Guanyin?", "158.0 x 97.8"),
+    ("Which collection does the statue come from?", "Buckingham"),
+    ("What did the conservators find under the grime?", "grime"),
+]
+
+_SENT = re.compile(r"(?<=[.!?])\s+")
+
+
+def make_probes(adapter, n: int, seed: int) -> list[tuple[str, str]]:
+    rng = random.Random(seed)
+    docs = adapter.ingestor.bm25.docs
+    items = [(cid, text) for cid, (text, _) in docs.items() if len(text) >= 120]
+    rng.shuffle(items)
+    probes: list[tuple[str, str]] = []
+    for cid, text in items:
+        sents = [s for s in _SENT.split(text) if len(s.split()) >= 8]
+        if not sents:
+            continue
+        words = rng.choice(sents).split()
+        # 取句子中间一段，丢掉一部分词，避免和原文完全相同
+        start = rng.randrange(0, max(1, len(words) - 8))
+        frag = [w for w in words[start:start + 12] if rng.random() > 0.25]
+        probes.append((" ".join(frag), cid))
+        if len(probes) >= n:
+            break
+    return probes
+
+
+def run_mode(adapter, name: str, hybrid: bool, fast: bool, hand, probes, repeat: int) -> dict:
+    adapter.hybrid = hybrid
+    adapter.lexical_fast = fast
+    lat: list[float] = []
+    hand_hits = 0
+    probe_hits = 0
+    fast_count = 0
+
+    for _ in range(repeat):
+        for q, must in hand:
+            adapter.cache.embeddings.clear()
+            t0 = time.perf_counter()
+            vec, hits = adapter._search_uncached(q)
+            lat.append((time.perf_counter() - t0) * 1000)
+            fast_count += vec is None
+            hand_hits += any(must.lower() in doc.lower() for _, doc, _, _ in hits)
+        for q, cid in probes:
+            adapter.cache.embeddings.clear()
+            t0 = time.perf_counter()
+            vec, hits = adapter._search_uncached(q)
+            lat.append((time.perf_counter() - t0) * 1000)
+            fast_count += vec is None
+            probe_hits += any(h[0] == cid for h in hits)
+
+    lat.sort()
+    total = len(lat)
+    return {
+        "mode": name,
+        "queries": total,
+        "p50_ms": round(statistics.median(lat), 2),
+        "p95_ms": round(lat[min(total - 1, int(total * 0.95))], 2),
+        "mean_ms": round(statistics.fmean(lat), 2),
+        "hand_recall": round(hand_hits / (len(hand) * repeat), 3) if hand else None,
+        "probe_recall": round(probe_hits / (len(probes) * repeat), 3) if probes else None,
+        "lexical_fast_ratio": round(fast_count / total, 3),
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--probes", type=int, default=100)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--json", default=None, help="write results to this file")
+    args = ap.parse_args()
+
+    from rag_main_code import RagOllamaAdapter
+    adapter = RagOllamaAdapter()
+    if not len(adapter.ingestor.bm25):
+        print("BM25 index is empty; run `python rag_ingest.py` in server/ first")
+        return 1
+
+    probes = make_probes(adapter, args.probes, args.seed)
+    # 预热：加载模型、建立连接
+    adapter._search_uncached("warm up")
+
+    results = [
+        run_mode(adapter, "dense", False, False, HAND_QUERIES, probes, args.repeat),
+        run_mode(adapter, "hybrid", True, False, HAND_QUERIES, probes, args.repeat),
+        run_mode(adapter, "hybrid+fast", True, True, HAND_QUERIES, probes, args.repeat),
+    ]
+    cols = ["mode", "queries", "p50_ms", "p95_ms", "mean_ms", "hand_recall", "probe_recall", "lexical_fast_ratio"]
+    print(" | ".join(cols))
+    for r in results:
+        print(" | ".join(str(r[c]) for c in cols))
+
+    if args.json:
+        out = {
+            "chunks": len(adapter.ingestor.bm25),
+            "top_k": adapter.top_k,
+            "max_distance": adapter.max_distance,
+            "probes": len(probes),
+            "results": results,
+        }
+        Path(args.json).write_text(json.dumps(out, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
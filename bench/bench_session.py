@@ -0,0 +1,180 @@
+# bench/bench_session.py
+"""
+多轮会话对比：同样的几段连续追问，stateless（每轮独立）vs session（带 session_id，续接 Ollama 的 context）
+默认用 bench_e2e 的本地替身，Agent 为 rag_ollama（需要向量模型：RAG_EMBED_MODEL 指向本地模型目录，
+或者能从 Hugging Face 下载）；假 LLM 模拟 KV 缓存，prefill 耗时和没命中缓存的 prompt token 数成正比。
+每种方式起一套新的服务（KV 缓存、指标都从零开始），--conversations 段对话并发，一轮一轮往下问：
+- 每轮的 prompt 实际计算 token 数和 prompt eval 耗时（/metrics 里 evaluated / llm_prompt_eval 的增量均值）
+- 每轮 /agent/reply 延迟 p50
+- 跑完后服务进程 RSS、会话数和续接 context 占用（/agent/sessions）
+
+  python bench/bench_session.py
+  RAG_EMBED_MODEL=/path/to/all-MiniLM-L6-v2 python bench/bench_session.py --conversations 8 --turns 5 --json session.json
+  python bench/bench_session.py --url http://127.0.0.1:8080 --modes session   # 压已经在跑的服务（真 Ollama）
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+
+import httpx
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+
+from bench_e2e import LocalStack, pct  # noqa: E402
+
+MODES = ("stateless", "session")
+
+# 每段对话：一个开头的问题 + 依赖上文的追问
+SCRIPTS = [
+    ["Tell me about the Seated Guanyin.",
+     "What kind of wood was it carved from?",
+     "When was it covered with gold?",
+     "Who is the small figure in its headdress?",
+     "What did the conservators find under the surface?",
+     "Why did they repaint it?"],
+    ["What does Guanyin represent?",
+     "How is that shown in this sculpture?",
+     "Which dynasty made it?",
+     "Was it always painted like this?",
+     "How do you know?",
+     "Where was it found?"],
+]
+
+_SAMPLE = re.compile(r'^(\w+)\{([^}]*)\}\s+(\S+)$')
+
+
+def scrape(text: str) -> dict[str, float]:
+    # 只取这里要用的几条：prompt eval 耗时、实际计算的 token 数
+    out: dict[str, float] = {}
+    for line in text.splitlines():
+        m = _SAMPLE.match(line)
+        if not m:
+            continue
+        name, labels, value = m.groups()
+        if (name.startswith("museum_stage_seconds_") and 'stage="llm_prompt_eval"' in labels) or \
+                (name.startswith("museum_prompt_tokens_") and 'which="evaluated"' in labels):
+            if name.endswith(("_sum", "_count")):
+                out[name] = float(value)
+    return out
+
+
+def _rss_mb(pid: Optional[int]) -> Optional[float]:
+    if not pid:
+        return None
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+async def run_mode(base_url: str, mode: str, conversations: int, turns: int, pid: Optional[int]) -> dict:
+    run_id = f"{mode}-{int(time.time())}"
+    rows: list[dict] = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=httpx.Timeout(300.0)) as client:
+        async def ask(i: int, t: int) -> Optional[float]:
+            script = SCRIPTS[i % len(SCRIPTS)]
+            # 对话之间问题不同，避免被单飞合并
+            payload = {"text": f"{script[t % len(script)]} ({i})"}
+            if mode == "session":
+                payload["session_id"] = f"{run_id}-{i}"
+            t0 = time.perf_counter()
+            resp = await client.post("/agent/reply", json=payload)
+            if resp.status_code != 200 or resp.json().get("reply", "").startswith("[agent error]"):
+                print(f"[BENCH] {mode} conversation {i} turn {t + 1}: {resp.status_code} {resp.text[:200]}")
+                return None
+            return 1000 * (time.perf_counter() - t0)
+
+        for t in range(turns):
+            before = scrape((await client.get("/metrics")).text)
+            latencies = await asyncio.gather(*(ask(i, t) for i in range(conversations)))
+            after = scrape((await client.get("/metrics")).text)
+
+            def delta(name: str) -> float:
+                return after.get(name, 0.0) - before.get(name, 0.0)
+
+            n_eval = delta("museum_stage_seconds_count")
+            n_tok = delta("museum_prompt_tokens_count")
+            ok = [x for x in latencies if x is not None]
+            rows.append({
+                "turn": t + 1,
+                "ok": len(ok),
+                "prompt_eval_tokens": round(delta("museum_prompt_tokens_sum") / n_tok, 1) if n_tok else None,
+                "prompt_eval_ms": round(1000 * delta("museum_stage_seconds_sum") / n_eval, 1) if n_eval else None,
+                "latency_p50_ms": pct(ok, 50),
+            })
+        sessions = await client.get("/agent/sessions")
+    return {
+        "mode": mode,
+        "turns": rows,
+        "server_rss_mb": _rss_mb(pid),
+        "sessions": sessions.json() if sessions.status_code == 200 else None,
+    }
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="multi-turn session benchmark")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--conversations", type=int, default=8, help="concurrent conversations")
+    ap.add_argument("--turns", type=int, default=5)
+    ap.add_argument("--url", help="benchmark a running server instead of the local stand-ins")
+    # 本地替身参数（同 bench_e2e）；prefill 按 8B 模型在单卡上的量级
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--llm-port", type=int, default=11435)
+    ap.add_argument("--ttft-ms", type=float, default=30.0)
+    ap.add_argument("--prefill-ms-per-token", type=float, default=0.5)
+    ap.add_argument("--kv-slots", type=int, default=4, help="fake LLM KV cache slots (OLLAMA_NUM_PARALLEL)")
+    ap.add_argument("--tokens-per-s", type=float, default=200.0)
+    ap.add_argument("--tokens", type=int, default=60)
+    ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    args = ap.parse_args()
+
+    results: list[dict] = []
+    for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+        print(f"[bench] {mode}: {args.conversations} conversations x {args.turns} turns ...", flush=True)
+        if args.url:
+            results.append(asyncio.run(run_mode(args.url.rstrip("/"), mode, args.conversations, args.turns, None)))
+            continue
+        with tempfile.TemporaryDirectory(prefix="bench_session_") as tmp:
+            # 每种方式一套新的索引和服务；答案缓存关掉，每轮都真的问 LLM
+            os.environ.update({"RAG_DB_PATH": tmp, "RAG_INDEX_ON_START": "1", "RAG_ANSWER_CACHE": "0"})
+            stack_args = SimpleNamespace(port=args.port, llm_port=args.llm_port, agent="rag_ollama",
+                                         ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, tokens=args.tokens,
+                                         prefill_ms_per_token=args.prefill_ms_per_token, kv_slots=args.kv_slots,
+                                         piper_rtf=0.1, piper_load_s=0.0, vosk_model=None,
+                                         scenarios=["agent_reply"], verbose=args.verbose)
+            with LocalStack(stack_args) as stack:
+                results.append(asyncio.run(run_mode(stack.base_url, mode, args.conversations, args.turns,
+                                                    stack.procs[-1].pid)))
+
+    cols = ["turn", "ok", "prompt_eval_tokens", "prompt_eval_ms", "latency_p50_ms"]
+    for r in results:
+        print(f"\n{r['mode']}  (server RSS {r['server_rss_mb']} MB)")
+        print(" | ".join(cols))
+        for row in r["turns"]:
+            print(" | ".join(str(row.get(c, "-")) for c in cols))
+        if r["sessions"]:
+            s = r["sessions"]
+            print(f"sessions {s['sessions']}, turns kept {s['turns']}, "
+                  f"context {s['context_tokens']} tokens ({s['context_bytes'] / 1024:.0f} KiB)")
+    if args.json:
+        Path(args.json).write_text(json.dumps({"config": vars(args), "results": results}, indent=2), encoding="utf-8")
+    return 0 if results else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,180 @@
+# bench/bench_store.py
+"""
+向量库后端对比：chroma vs numpy（float32 / float16），语料规模逐级增大
+用合成向量（随机单位向量；查询取某条向量加噪声，模拟“问题和某段落相近”），每个规模：
+- 在临时目录里建库（写入耗时）
+- 子进程里冷启动打开（打开耗时、查询后常驻内存的增量，含导入 chromadb，和服务启动时一样）
+- 单条查询延迟 p50/p95，和精确结果相比的 recall@k（chroma 是 HNSW 近似检索）
+
+--partition-size N：语料按每 N 条一个展区分区（元数据 exhibit），查询只在问题所属的分区里找，
+看全馆语料变大时单台导览机的查询延迟和内存是否保持不变；recall 对照分区内的精确结果。
+
+  python bench/bench_store.py
+  python bench/bench_store.py --sizes 1000,5000,20000,50000 --dim 384 --json bench_store.json
+  python bench/bench_store.py --sizes 2000,10000,50000 --partition-size 1000
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "server"))
+
+BACKENDS = ("chroma", "numpy-float32", "numpy-float16")
+
+
+def _rss_mb() -> float:
+    # 当前常驻内存；Linux 上 ru_maxrss 会从父进程继承（exec 后不清零），所以优先读 /proc
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _pct(xs: list[float], p: float) -> float:
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(round(p / 100 * (len(xs) - 1))))] if xs else 0.0
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+def make_data(n: int, dim: int, n_queries: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    docs = _unit(rng.standard_normal((n, dim)).astype(np.float32))
+    picks = rng.integers(0, n, n_queries)
+    queries = _unit(docs[picks] + 0.08 * rng.standard_normal((n_queries, dim)).astype(np.float32))
+    return docs, queries, picks
+
+
+def _exhibit(i: int, partition_size: int) -> str:
+    return f"gallery/{i // partition_size}" if partition_size > 0 else ""
+
+
+def _open(backend: str, db: Path):
+    from rag_store import ChromaStore, NumpyStore
+    if backend == "chroma":
+        return ChromaStore.open(db, "bench_store")
+    return NumpyStore(db, "bench_store", backend.split("-", 1)[1])
+
+
+def build(backend: str, db: Path, docs: np.ndarray, partition_size: int = 0) -> float:
+    store = _open(backend, db)
+    ids = [f"doc::{i}" for i in range(len(docs))]
+    t0 = time.perf_counter()
+    for off in range(0, len(docs), 1000):
+        sl = slice(off, off + 1000)
+        rows = range(off, off + len(ids[sl]))
+        store.upsert(ids[sl], [f"chunk {i}" for i in rows],
+                     [{"source": "synthetic", "chunk": i, "exhibit": _exhibit(i, partition_size)} for i in rows],
+                     docs[sl])
+    store.flush()
+    return time.perf_counter() - t0
+
+
+def child(backend: str, db: Path, queries_path: Path, k: int, out: Path, partition_size: int = 0) -> int:
+    """子进程：冷启动打开库并查询，结果写到 out"""
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    store = _open(backend, db)
+    store.count()
+    open_s = time.perf_counter() - t0
+    queries = np.load(queries_path)
+    picks = np.load(queries_path.with_name("picks.npy"))
+    scopes = [[_exhibit(int(p), partition_size)] if partition_size > 0 else None for p in picks]
+
+    store.query(queries[0], k, exhibits=scopes[0])  # 第一次查询（Chroma 要把索引读进内存）
+    lat: list[float] = []
+    got: list[list[int]] = []
+    for q, scope in zip(queries, scopes):
+        t = time.perf_counter()
+        hits = store.query(q, k, exhibits=scope)
+        lat.append((time.perf_counter() - t) * 1000)
+        got.append([int(h[0].split("::")[1]) for h in hits])
+    out.write_text(json.dumps({
+        "open_s": round(open_s, 3),
+        "query_p50_ms": round(_pct(lat, 50), 3),
+        "query_p95_ms": round(_pct(lat, 95), 3),
+        "rss_mb": round(_rss_mb() - rss0, 1),
+        "ids": got,
+    }), encoding="utf-8")
+    return 0
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="1000,2000,5000,10000,20000")
+    ap.add_argument("--dim", type=int, default=384, help="all-MiniLM-L6-v2 is 384")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--top-k", type=int, default=5)
+    ap.add_argument("--backends", default=",".join(BACKENDS))
+    ap.add_argument("--partition-size", type=int, default=0,
+                    help="chunks per exhibit partition; queries search only their own partition (0: no partitions)")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    ap.add_argument("--child", nargs=4, default=None, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        backend, db, qpath, out = args.child
+        return child(backend, Path(db), Path(qpath), args.top_k, Path(out), args.partition_size)
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    results: list[dict] = []
+    cols = ["backend", "chunks", "build_s", "open_s", "query_p50_ms", "query_p95_ms", "rss_mb", "recall"]
+    print(" | ".join(cols))
+    for n in (int(x) for x in args.sizes.split(",") if x.strip()):
+        docs, queries, picks = make_data(n, args.dim, args.queries)
+        scores = queries @ docs.T
+        if args.partition_size > 0:
+            # 精确结果也只在问题所属分区里算
+            part = np.arange(n) // args.partition_size
+            scores = np.where(part[None, :] == (picks // args.partition_size)[:, None], scores, -np.inf)
+        exact = np.argsort(-scores, axis=1)[:, :args.top_k]
+        with tempfile.TemporaryDirectory() as tmp:
+            qpath = Path(tmp) / "queries.npy"
+            np.save(qpath, queries)
+            np.save(Path(tmp) / "picks.npy", picks)
+            for backend in backends:
+                db = Path(tmp) / backend
+                build_s = build(backend, db, docs, args.partition_size)
+                out = Path(tmp) / f"{backend}.json"
+                proc = subprocess.run([sys.executable, __file__, "--top-k", str(args.top_k),
+                                       "--partition-size", str(args.partition_size),
+                                       "--child", backend, str(db), str(qpath), str(out)])
+                if proc.returncode != 0 or not out.exists():
+                    print(f"[BENCH] {backend} @ {n} failed (exit {proc.returncode})")
+                    continue
+                r = json.loads(out.read_text(encoding="utf-8"))
+                got = r.pop("ids")
+                recall = np.mean([len(set(g) & set(e)) / args.top_k for g, e in zip(got, exact.tolist())])
+                r.update({"backend": backend, "chunks": n, "build_s": round(build_s, 2),
+                          "recall": round(float(recall), 3)})
+                results.append(r)
+                print(" | ".join(str(r[c]) for c in cols), flush=True)
+
+    if args.json:
+        out = {"dim": args.dim, "queries": args.queries, "top_k": args.top_k,
+               "partition_size": args.partition_size, "results": results}
+        Path(args.json).write_text(json.dumps(out, indent=2), encoding="utf-8")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
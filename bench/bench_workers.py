@@ -0,0 +1,260 @@
+# bench/bench_workers.py
+"""
+多进程部署对比：每请求吞吐（请求/秒）和内存（RSS / PSS），worker 数 1、2、4、8。
+- shared：python serve.py --workers N --shared，模型都在一个共享 host 进程里，worker 通过本机 IPC 调用
+- copies：uvicorn main:app --workers N，每个 worker 各自加载一份向量模型、向量库、Piper 进程池
+默认用 bench_e2e 的本地替身（假 LLM、假 Piper），Agent 为 rag_ollama（需要向量模型：RAG_EMBED_MODEL 指向本地
+模型目录，或者能从 Hugging Face 下载）；知识库先离线入库一次，所有服务共用，启动时不再入库。
+压测端是 --clients 个独立进程（单个 Python 进程发不出几百 QPS），同时开始。
+
+内存按进程树统计：服务进程（supervisor、worker、host）的 RSS / PSS 之和，Piper 子进程单独列（真 Piper 每个进程
+带一份语音模型，~60-100 MB）。PSS 读 /proc/<pid>/smaps_rollup，只在 Linux 上有。
+
+  python bench/bench_workers.py
+  RAG_EMBED_MODEL=/path/to/all-MiniLM-L6-v2 python bench/bench_workers.py --workers 1,2,4,8 --json workers.json
+  python bench/bench_workers.py --modes shared --scenarios tts_stream --requests 400 --concurrency 64
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+import httpx
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE))
+
+from bench_e2e import SERVER_DIR, LocalStack, metric, one_http, scenario_payloads  # noqa: E402
+
+MODES = ("copies", "shared")
+SCENARIOS = ("agent_reply", "tts_stream")
+
+
+class WorkersStack(LocalStack):
+    def __init__(self, args, mode: str, workers: int):
+        super().__init__(args)
+        self.mode = mode
+        self.workers = workers
+
+    def server_command(self) -> list[str]:
+        a = self.args
+        if self.mode == "shared":
+            return [sys.executable, "serve.py", "--workers", str(self.workers), "--shared",
+                    "--port", str(a.port), "--log-level", "warning"]
+        return [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(a.port),
+                "--workers", str(self.workers), "--log-level", "warning"]
+
+
+# 进程树和内存
+
+def _children() -> dict[int, list[int]]:
+    out: dict[int, list[int]] = {}
+    for d in Path("/proc").iterdir():
+        if not d.name.isdigit():
+            continue
+        try:
+            # comm 可能带空格和括号，从最后一个 ")" 之后取
+            ppid = int((d / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        out.setdefault(ppid, []).append(int(d.name))
+    return out
+
+
+def _tree(root: int) -> list[int]:
+    children = _children()
+    pids, todo = [], [root]
+    while todo:
+        pid = todo.pop()
+        pids.append(pid)
+        todo.extend(children.get(pid, ()))
+    return pids
+
+
+def _rollup(pid: int) -> dict[str, int]:
+    out: dict[str, int] = {}
+    try:
+        for line in Path(f"/proc/{pid}/smaps_rollup").read_text().splitlines():
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss"):
+                out[key] = int(rest.split()[0])
+    except (OSError, ValueError):
+        pass
+    return out
+
+
+def memory(root: int) -> dict:
+    server = {"processes": 0, "Rss": 0, "Pss": 0}
+    piper = {"processes": 0, "Rss": 0, "Pss": 0}
+    for pid in _tree(root):
+        try:
+            cmd = Path(f"/proc/{pid}/cmdline").read_bytes().replace(b"\0", b" ").decode(errors="replace")
+        except OSError:
+            continue
+        if "fake_piper" in cmd or "piper" in cmd.split(" ")[0]:
+            bucket = piper
+        elif "python" in cmd:
+            bucket = server
+        else:
+            # 启动脚本的 sh 等
+            continue
+        bucket["processes"] += 1
+        for k, v in _rollup(pid).items():
+            bucket[k] += v
+    return {
+        "server_processes": server["processes"],
+        "server_rss_mb": round(server["Rss"] / 1024, 1),
+        "server_pss_mb": round(server["Pss"] / 1024, 1),
+        "piper_processes": piper["processes"],
+        "piper_rss_mb": round(piper["Rss"] / 1024, 1),
+    }
+
+
+# 压测端（子进程）
+
+async def _load(base_url: str, scenario: str, concurrency: int, n: int, offset: int, start_at: float) -> list[dict]:
+    path, payloads = scenario_payloads(scenario, offset + n, False)
+    payloads = payloads[offset:]
+    sem = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=httpx.Timeout(300.0)) as client:
+        async def worker(p: dict) -> dict:
+            async with sem:
+                rec = await one_http(client, path, p)
+                rec["done_at"] = time.time()
+                return rec
+
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        return await asyncio.gather(*(worker(p) for p in payloads))
+
+
+def run_scenario(base_url: str, scenario: str, args) -> dict:
+    # 各压测进程约好同一时刻开始，吞吐按最后一个请求完成的时刻算
+    start_at = time.time() + 2.0
+    per = args.requests // args.clients
+    outs, procs = [], []
+    with tempfile.TemporaryDirectory(prefix="bench_workers_load_") as tmp:
+        for i in range(args.clients):
+            out = Path(tmp) / f"{i}.json"
+            outs.append(out)
+            procs.append(subprocess.Popen([
+                sys.executable, __file__, "--load", str(out), "--url", base_url, "--scenarios", scenario,
+                "--concurrency", str(max(1, args.concurrency // args.clients)), "--requests", str(per),
+                "--offset", str(i * per), "--start-at", str(start_at)]))
+        records: list[dict] = []
+        for p, out in zip(procs, outs):
+            p.wait()
+            if out.exists():
+                records.extend(json.loads(out.read_text(encoding="utf-8")))
+    ok = [r for r in records if r["ok"]]
+    wall = max((r["done_at"] for r in records), default=start_at) - start_at
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": sorted({r.get("error", "") or str(r.get("status")) for r in records if not r["ok"]})[:3],
+        "rps": round(len(ok) / wall, 1) if wall > 0 else None,
+        "total_ms": metric(records, "total_ms"),
+    }
+
+
+def wait_all_workers(base_url: str, workers: int, timeout_s: float = 300.0) -> None:
+    # copies 模式下 /ready 落到哪个 worker 不确定：连续多次都就绪才算全部加载完
+    t0, streak = time.monotonic(), 0
+    while streak < 4 * workers:
+        if time.monotonic() - t0 > timeout_s:
+            raise RuntimeError("workers not ready")
+        ok = httpx.get(f"{base_url}/ready", timeout=5.0).status_code == 200
+        streak = streak + 1 if ok else 0
+        if not ok:
+            time.sleep(0.2)
+
+
+def run_config(args, mode: str, workers: int) -> dict:
+    stack_args = SimpleNamespace(port=args.port, llm_port=args.llm_port, agent="rag_ollama",
+                                 ttft_ms=args.ttft_ms, tokens_per_s=args.tokens_per_s, tokens=args.tokens,
+                                 kv_slots=args.concurrency, piper_rtf=args.piper_rtf, piper_load_s=0.0,
+                                 vosk_model=None, scenarios=args.scenarios, verbose=args.verbose)
+    with WorkersStack(stack_args, mode, workers) as stack:
+        wait_all_workers(stack.base_url, workers)
+        pid = stack.procs[-1].pid
+        row: dict = {"mode": mode, "workers": workers, "ready_s": round(stack.ready_s, 1), "idle": memory(pid)}
+        for scenario in args.scenarios:
+            print(f"[bench] {mode} x{workers}: {scenario}, {args.requests} requests, "
+                  f"concurrency {args.concurrency} ...", flush=True)
+            row[scenario] = run_scenario(stack.base_url, scenario, args)
+        row["loaded"] = memory(pid)
+    return row
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="multi-worker throughput / memory benchmark")
+    ap.add_argument("--modes", default=",".join(MODES))
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--scenarios", default=",".join(SCENARIOS),
+                    type=lambda s: [x.strip() for x in s.split(",") if x.strip()])
+    ap.add_argument("--requests", type=int, default=256, help="requests per scenario")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--clients", type=int, default=2, help="load generator processes")
+    # 本地替身参数：上游尽量快，测的是服务本身的开销
+    ap.add_argument("--port", type=int, default=8090)
+    ap.add_argument("--llm-port", type=int, default=11435)
+    ap.add_argument("--ttft-ms", type=float, default=20.0)
+    ap.add_argument("--tokens-per-s", type=float, default=1000.0)
+    ap.add_argument("--tokens", type=int, default=40)
+    ap.add_argument("--piper-rtf", type=float, default=0.02)
+    ap.add_argument("--piper-procs", type=int, default=8, help="Piper processes per pool (PIPER_POOL_*)")
+    ap.add_argument("--verbose", action="store_true")
+    ap.add_argument("--json", default=None, help="write results to this file")
+    # 压测子进程
+    ap.add_argument("--load", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--url", default=None, help=argparse.SUPPRESS)
+    ap.add_argument("--offset", type=int, default=0, help=argparse.SUPPRESS)
+    ap.add_argument("--start-at", type=float, default=0.0, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.load:
+        records = asyncio.run(_load(args.url, args.scenarios[0], args.concurrency, args.requests,
+                                    args.offset, args.start_at))
+        Path(args.load).write_text(json.dumps(records), encoding="utf-8")
+        return 0
+
+    rows: list[dict] = []
+    with tempfile.TemporaryDirectory(prefix="bench_workers_") as tmp:
+        os.environ.update({
+            "RAG_DB_PATH": tmp, "RAG_INDEX_ON_START": "0", "RAG_ANSWER_CACHE": "0",
+            "PIPER_POOL_MIN": str(args.piper_procs), "PIPER_POOL_MAX_PER_VOICE": str(args.piper_procs),
+            "PIPER_POOL_MAX_TOTAL": str(args.piper_procs), "FAKE_PIPER_CHUNK_MS": "20", "VOSK_PRELOAD": "0",
+        })
+        # 知识库只入库一次，各种部署方式共用（多个 worker 同时入库会抢同一把锁）
+        subprocess.run([sys.executable, "rag_ingest.py"], cwd=str(SERVER_DIR), check=True)
+        for mode in (m.strip() for m in args.modes.split(",") if m.strip()):
+            for n in (int(x) for x in args.workers.split(",") if x.strip()):
+                try:
+                    rows.append(run_config(args, mode, n))
+                except Exception as e:
+                    print(f"[BENCH] {mode} x{n} failed: {e!r}")
+
+    cols = ["mode", "workers"] + [f"{s} rps" for s in args.scenarios] + \
+        ["server procs", "RSS MB", "PSS MB", "piper procs", "piper RSS MB"]
+    print(" | ".join(cols))
+    for r in rows:
+        m = r["loaded"]
+        print(" | ".join(str(x) for x in [r["mode"], r["workers"]] + [r[s]["rps"] for s in args.scenarios] +
+                         [m["server_processes"], m["server_rss_mb"], m["server_pss_mb"],
+                          m["piper_processes"], m["piper_rss_mb"]]))
+    if args.json:
+        Path(args.json).write_text(json.dumps({"config": vars(args), "cpus": os.cpu_count(), "results": rows},
+                                              indent=2), encoding="utf-8")
+    return 0 if rows else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
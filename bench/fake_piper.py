@@ -0,0 +1,84 @@
+# bench/fake_piper.py
+"""
+假的 Piper 可执行文件，给压测用：命令行和 stdin/stdout/stderr 协议与
+`piper -m <model> --output-raw` 一致（stdin 每行一句，stdout 输出裸 s16le PCM，
+每句结束在 stderr 打印 "Real-time factor"），但不加载模型，按固定规则生成确定的正弦波：
+  时长 = 词数 * FAKE_PIPER_WORD_S * length_scale + sentence_silence
+  合成耗时 = 时长 * FAKE_PIPER_RTF，按 FAKE_PIPER_CHUNK_MS 分块逐步写出
+采样率读模型旁边的 .onnx.json，读不到按 22050。
+
+环境变量：
+  FAKE_PIPER_RTF=0.1          实时率（合成耗时 / 音频时长）
+  FAKE_PIPER_LOAD_S=0.5       启动时模拟加载模型的耗时
+  FAKE_PIPER_WORD_S=0.3       每个词的音频时长
+  FAKE_PIPER_CHUNK_MS=50      每次写出的音频时长
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+RTF = float(os.getenv("FAKE_PIPER_RTF", "0.1"))
+LOAD_S = float(os.getenv("FAKE_PIPER_LOAD_S", "0.5"))
+WORD_S = float(os.getenv("FAKE_PIPER_WORD_S", "0.3"))
+CHUNK_MS = int(os.getenv("FAKE_PIPER_CHUNK_MS", "50"))
+
+
+def sample_rate_of(model: str) -> int:
+    try:
+        with open(model + ".json", encoding="utf-8") as f:
+            return int(json.load(f)["audio"]["sample_rate"])
+    except Exception:
+        return 22050
+
+
+def tone(n: int, sr: int, offset: int) -> bytes:
+    # 440Hz、约 -12dBFS 的正弦波；offset 让分块之间相位连续
+    amp = 8000
+    w = 2 * math.pi * 440 / sr
+    return b"".join(int(amp * math.sin(w * (offset + i))).to_bytes(2, "little", signed=True) for i in range(n))
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-m", "--model", required=True)
+    ap.add_argument("--output-raw", "--output_raw", action="store_true")
+    ap.add_argument("--length_scale", type=float, default=1.0)
+    ap.add_argument("--sentence_silence", type=float, default=0.2)
+    args, _ = ap.parse_known_args()
+
+    sr = sample_rate_of(args.model)
+    time.sleep(LOAD_S)
+    out = sys.stdout.buffer
+    chunk = max(1, sr * CHUNK_MS // 1000)
+
+    for raw in sys.stdin.buffer:
+        line = raw.decode("utf-8", "replace").strip()
+        if not line:
+            continue
+        t0 = time.perf_counter()
+        audio_s = len(line.split()) * WORD_S * args.length_scale + args.sentence_silence
+        total = int(audio_s * sr)
+        written = 0
+        while written < total:
+            n = min(chunk, total - written)
+            out.write(tone(n, sr, written))
+            out.flush()
+            written += n
+            # 按实时率控制写出节奏
+            due = t0 + RTF * written / sr
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        infer = time.perf_counter() - t0
+        sys.stderr.write(f"[fake-piper] Real-time factor: {infer / audio_s:.3f} "
+                         f"(infer={infer:.3f} sec, audio={audio_s:.3f} sec)\n")
+        sys.stderr.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# bench/stub_llm.py
+"""
+假的 LLM 服务，给压测用：同时提供
+- Ollama  POST /api/generate（stream=true 为逐行 JSON，false 为整段）
+- OpenAI  POST /v1/chat/completions（stream=true 为 SSE）
+首 token 延迟和生成速度可配，回答内容确定（固定语料循环取词，按句号断句），不同运行之间可比。
+Ollama 接口模拟 KV 缓存：有 --kv-slots 个槽，每个槽记着上一次算过的 token 序列（按词切分），
+新请求（带 context 时接在 context 后面）挑公共前缀最长的空闲槽，只有前缀之后的 token 要算，
+每个多等 --prefill-ms-per-token；结束行返回 context / prompt_eval_count / prompt_eval_duration。
+
+  python bench/stub_llm.py --port 11435 --ttft-ms 300 --tokens-per-s 40 --tokens 60
+  python bench/stub_llm.py --ttft-ms 50 --prefill-ms-per-token 0.5 --kv-slots 4
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from typing import Optional
+
+from fastapi import FastAPI, Body
+from fastapi.responses import JSONResponse, StreamingResponse
+
+CORPUS = (
+    "The Seated Guanyin was carved from paulownia wood during the Song dynasty . "
+    "Its surface was later covered with gold and bright pigments in the Ming dynasty . "
+    "Guanyin is the Bodhisattva of Compassion and listens to the cries of the world . "
+    "The small figure in the headdress is Amituo , the Buddha of the Western Paradise . "
+    "Conservators found earlier layers of paint hidden under centuries of grime . "
+).split()
+
+
+class KVSlots:
+    """按词的假 tokenizer + 几个 KV 缓存槽（类似 llama.cpp 的并行槽，槽都占满时排队）"""
+
+    def __init__(self, n_slots: int):
+        self.vocab: dict[str, int] = {}
+        self.slots: list[list[int]] = [[] for _ in range(max(1, n_slots))]
+        self.busy = [False] * len(self.slots)
+        self.used = [0.0] * len(self.slots)
+        self._free: Optional[asyncio.Semaphore] = None
+
+    def encode(self, text: str) -> list[int]:
+        return [self.vocab.setdefault(w, len(self.vocab)) for w in re.findall(r"\S+|\n", text)]
+
+    @staticmethod
+    def _common(a: list[int], b: list[int]) -> int:
+        n = min(len(a), len(b))
+        i = 0
+        while i < n and a[i] == b[i]:
+            i += 1
+        return i
+
+    async def acquire(self, tokens: list[int]) -> tuple[int, int]:
+        # 返回 (槽, 已缓存的前缀长度)：空闲槽里公共前缀最长的，一样长时挑最久没用的
+        if self._free is None:
+            self._free = asyncio.Semaphore(len(self.slots))
+        await self._free.acquire()
+        free = [i for i in range(len(self.slots)) if not self.busy[i]]
+        slot = max(free, key=lambda i: (self._common(self.slots[i], tokens), -self.used[i]))
+        self.busy[slot] = True
+        return slot, self._common(self.slots[slot], tokens)
+
+    def release(self, slot: int, tokens: list[int]) -> None:
+        self.slots[slot] = tokens
+        self.busy[slot] = False
+        self.used[slot] = time.monotonic()
+        self._free.release()
+
+
+def make_app(ttft_ms: float, tokens_per_s: float, n_tokens: int,
+             prefill_ms_per_token: float = 0.0, kv_slots: int = 4) -> FastAPI:
+    app = FastAPI()
+    stats = {"requests": 0, "streams": 0, "in_flight": 0, "max_in_flight": 0,
+             "prompt_tokens": 0, "prompt_eval_tokens": 0}
+    kv = KVSlots(kv_slots)
+
+    def tokens(seed: str) -> list[str]:
+        # 以问题文本决定起始位置：同一个问题总得到同一个回答
+        start = sum(seed.encode("utf-8")) % len(CORPUS)
+        out = []
+        for i in range(n_tokens):
+            w = CORPUS[(start + i) % len(CORPUS)]
+            out.append(w if w in ".," else " " + w)
+        if out and out[-1] != " .":
+            out.append(" .")
+        return out
+
+    async def produce(seed: str, prefill_s: float = 0.0):
+        stats["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+        try:
+            await asyncio.sleep(ttft_ms / 1000.0 + prefill_s)
+            t0 = time.monotonic()
+            for i, tok in enumerate(tokens(seed)):
+                if tokens_per_s > 0:
+                    delay = t0 + i / tokens_per_s - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                yield tok
+        finally:
+            stats["in_flight"] -= 1
+
+    @app.post("/api/generate")
+    async def ollama_generate(payload: dict = Body(...)):
+        stats["requests"] += 1
+        prompt = payload.get("prompt") or ""
+        model = payload.get("model") or "stub"
+        if not prompt:
+            # 预热请求：只加载模型
+            return JSONResponse({"model": model, "response": "", "done": True})
+        tokens = list(payload.get("context") or []) + kv.encode(prompt)
+
+        async def generate():
+            # 排到空闲槽后算没缓存的部分，再逐个出 token；最后一项是结束行（带 context 和 prompt 统计）
+            slot, cached = await kv.acquire(tokens)
+            evaluated = len(tokens) - cached
+            prefill_s = evaluated * prefill_ms_per_token / 1000.0
+            stats["prompt_tokens"] += len(tokens)
+            stats["prompt_eval_tokens"] += evaluated
+            parts: list[str] = []
+            try:
+                async for tok in produce(prompt, prefill_s):
+                    parts.append(tok)
+                    yield {"model": model, "response": tok, "done": False}
+            finally:
+                # 客户端中途断开时槽里只留已经算过的部分
+                context = tokens + kv.encode("".join(parts))
+                kv.release(slot, context)
+            yield {"model": model, "response": "", "done": True, "context": context,
+                   "prompt_eval_count": evaluated, "prompt_eval_duration": int((ttft_ms / 1000.0 + prefill_s) * 1e9)}
+
+        if not payload.get("stream", True):
+            items = [x async for x in generate()]
+            text = "".join(x["response"] for x in items)
+            return JSONResponse({**items[-1], "response": text})
+
+        async def lines():
+            stats["streams"] += 1
+            async for item in generate():
+                yield json.dumps(item) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    @app.post("/v1/chat/completions")
+    async def openai_chat(payload: dict = Body(...)):
+        stats["requests"] += 1
+        messages = payload.get("messages") or []
+        seed = (messages[-1].get("content") if messages else "") or ""
+        model = payload.get("model") or "stub"
+        base = {"id": "chatcmpl-stub", "created": int(time.time()), "model": model}
+        if not payload.get("stream"):
+            text = "".join([t async for t in produce(seed)]).strip()
+            return JSONResponse({**base, "object": "chat.completion", "choices": [
+                {"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}]})
+
+        async def events():
+            stats["streams"] += 1
+            async for tok in produce(seed):
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": {"content": tok}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {**base, "object": "chat.completion.chunk",
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def main() -> None:
+    import uvicorn
+
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11435)
+    ap.add_argument("--ttft-ms", type=float, default=300.0, help="首 token 延迟（模拟 prefill）")
+    ap.add_argument("--tokens-per-s", type=float, default=40.0, help="生成速度，0 为不限速")
+    ap.add_argument("--tokens", type=int, default=60, help="每个回答的 token 数")
+    ap.add_argument("--prefill-ms-per-token", type=float, default=0.0,
+                    help="每个没命中 KV 缓存的 prompt token 多等的毫秒数（Ollama 接口）")
+    ap.add_argument("--kv-slots", type=int, default=4, help="KV 缓存槽数（类似 OLLAMA_NUM_PARALLEL）")
+    args = ap.parse_args()
+    uvicorn.run(make_app(args.ttft_ms, args.tokens_per_s, args.tokens, args.prefill_ms_per_token, args.kv_slots),
+                host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ const $btnRefresh = document.getElementById('btnRefresh');
 
 const $voice = document.getElementById('ttsVoice'); // TTS voice
 const $auto  = document.getElementById('autoAgent');     // 识别后自动 Agent→TTS
+const $duplex = document.getElementById('duplexMode');  // 全双工 /ws/converse
 
 function append(line) {
   $out.textContent += line + '\n';
@@ -47,23 +48,38 @@ async function listMics() {
   }
 }
 
+function isDuplex() { return !!($duplex && $duplex.checked); }
+
 function connectWS() {
-  ws = new WebSocket('ws://127.0.0.1:8080/ws/asr');
+  const duplex = isDuplex();
+  ws = new WebSocket(duplex ? 'ws://127.0.0.1:8080/ws/converse' : 'ws://127.0.0.1:8080/ws/asr');
   ws.binaryType = 'arraybuffer';
 
   ws.onopen = () => {
-    append('[ASR] ws open');
-    ws.send(JSON.stringify({ type: 'start', sampleRate: 16000 }));
+    append(`[ASR] ws open${duplex ? ' (全双工)' : ''}`);
+    const start = { type: 'start', sampleRate: 16000 };
+    if (duplex) start.voice = $voice?.value?.trim() || 'en_US-amy-medium.onnx';
+    if (duplex && window.TTS?.EXHIBIT) start.exhibit = window.TTS.EXHIBIT;
+    if (duplex && window.TTS?.FORMAT) start.format = window.TTS.FORMAT;
+    if (duplex && window.TTS?.sessionId) start.session_id = window.TTS.sessionId();
+    ws.send(JSON.stringify(start));
   };
 
   ws.onmessage = async (ev) => {
+    // 全双工：二进制帧是回答的音频（格式见 ack）
+    if (ev.data instanceof ArrayBuffer) {
+      window.TTS?.playPCMChunk?.(ev.data);
+      return;
+    }
     try {
       const data = JSON.parse(ev.data);
       if (data.type === 'ack') {
-        append(`[ack] sampleRate=${data.sampleRate}`);
+        append(`[ack] sampleRate=${data.sampleRate}${data.format ? ` format=${data.format}` : ''}`);
+        if (data.mediaType) await window.TTS?.setPlaybackFormat?.(data.mediaType);
       } else if (data.type === 'final') {
         const text = (data.text || '').trim();
         append(`[final] ${text}`);
+        if (duplex) return; // 服务端直接回答，不再单独请求
         const shouldAuto = ($auto ? $auto.checked : true);
         if (text && shouldAuto && !speaking) {
           speaking = true;
@@ -81,6 +97,16 @@ function connectWS() {
         }
       } else if (data.type === 'partial') {
         append(`[partial] ${data.text || ''}`);
+      } else if (data.type === 'reply_start') {
+        append(`[Agent] 回答 #${data.turn}`);
+      } else if (data.type === 'reply_text') {
+        append(`[Agent] ${data.text}`);
+      } else if (data.type === 'barge_in') {
+        // 访客开口了：清掉还没播完的音频
+        window.TTS?.stopStreamingPlayback?.();
+        append(`[Agent] 回答 #${data.turn} 已打断`);
+      } else if (data.type === 'error') {
+        append(`[Agent] 出错: ${data.detail}${data.retryAfter ? `（${data.retryAfter}s 后重试）` : ''}`);
       }
     } catch {
       // 非JSON忽略
@@ -103,7 +129,8 @@ async function startRecording() {
     audio: {
       deviceId: chosenId ? { exact: chosenId } : undefined,
       channelCount: 1,
-      echoCancellation: false,
+      // 全双工时扬声器在播报，需要回声消除，否则机器人会把自己的声音当成打断
+      echoCancellation: isDuplex(),
       noiseSuppression: false,
       autoGainControl: false
     }
@@ -5,6 +5,7 @@
   const $send = document.getElementById('chatSend');
   const $playTTS = document.getElementById('chatPlayTTS');
   const $log = document.getElementById('chatLog');
+  const $new = document.getElementById('chatNew');
 
   function timeStr() {
     const d = new Date();
@@ -40,10 +41,13 @@
     appendMsg('user', text);
 
     try {
+      const payload = { text: text };
+      if (window.TTS && window.TTS.EXHIBIT) payload.exhibit = window.TTS.EXHIBIT;
+      if (window.TTS && window.TTS.sessionId) payload.session_id = window.TTS.sessionId();
       const res = await fetch(CHAT_API, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ text: text })
+        body: JSON.stringify(payload)
       });
       const data = await res.json().catch(() => ({}));
       const reply = (data.reply != null ? data.reply : (res.ok ? '' : (data.detail || res.statusText))).trim() || '(无回复)';
@@ -64,7 +68,15 @@
     }
   }
 
+  // 新对话：换会话 id，之前的问答不再作为上文
+  async function newConversation() {
+    if (window.TTS && window.TTS.newSession) await window.TTS.newSession();
+    $log.innerHTML = '';
+    $input.focus();
+  }
+
   $send.addEventListener('click', sendQuestion);
+  if ($new) $new.addEventListener('click', newConversation);
   $input.addEventListener('keydown', function (e) {
     if (e.key === 'Enter' && !e.shiftKey) {
       e.preventDefault();
@@ -1,20 +1,137 @@
 // client/pcm-player.worklet.js
+// 解码也放在音频线程：主线程只转发网络收到的字节
+// 格式：pcm（s16le）/ mulaw（G.711 µ-law）/ adpcm（IMA-ADPCM，每块 4 字节头 + 4bit 码，块长见 Content-Type 的 block=）
+// 流的采样率（Content-Type 的 rate=，跟语音模型走）和 AudioContext 不同时线性插值重采样
+
+const MULAW = new Float32Array(256);
+for (let i = 0; i < 256; i++) {
+  const u = ~i & 0xff;
+  const e = (u >> 4) & 0x07, m = u & 0x0f;
+  const v = (((m << 3) + 0x84) << e) - 0x84;
+  MULAW[i] = ((u & 0x80) ? -v : v) / 32768;
+}
+
+const IMA_STEPS = [
+  7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+  50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+  337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+  2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+  12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767
+];
+const IMA_INDEX = [-1, -1, -1, -1, 2, 4, 6, 8];
+
+// 一次解码 n 个完整单元（pcm 2 字节、mulaw 1 字节、adpcm 一块），返回 Float32Array
+function decodePCM(bytes) {
+  const n = bytes.length >> 1;
+  const out = new Float32Array(n);
+  const dv = new DataView(bytes.buffer, bytes.byteOffset, n * 2);
+  for (let i = 0; i < n; i++) out[i] = dv.getInt16(i * 2, true) / 32768;
+  return out;
+}
+
+function decodeMulaw(bytes) {
+  const out = new Float32Array(bytes.length);
+  for (let i = 0; i < bytes.length; i++) out[i] = MULAW[bytes[i]];
+  return out;
+}
+
+function decodeAdpcm(bytes, block) {
+  const per = (block - 4) * 2;  // 块头里的首采样 + 每个半字节一个采样，最后半字节是补位
+  const blocks = Math.floor(bytes.length / block);
+  const out = new Float32Array(blocks * per);
+  let o = 0;
+  for (let b = 0; b < blocks; b++) {
+    const base = b * block;
+    let pred = (bytes[base] | (bytes[base + 1] << 8)) << 16 >> 16;
+    let idx = Math.min(88, bytes[base + 2]);
+    out[o++] = pred / 32768;
+    for (let i = 1; i < per; i++) {
+      const byte = bytes[base + 4 + ((i - 1) >> 1)];
+      const code = ((i - 1) & 1) ? (byte >> 4) : (byte & 0x0f);
+      const step = IMA_STEPS[idx];
+      let diff = step >> 3;
+      if (code & 4) diff += step;
+      if (code & 2) diff += step >> 1;
+      if (code & 1) diff += step >> 2;
+      pred += (code & 8) ? -diff : diff;
+      if (pred > 32767) pred = 32767; else if (pred < -32768) pred = -32768;
+      idx += IMA_INDEX[code & 7];
+      if (idx < 0) idx = 0; else if (idx > 88) idx = 88;
+      out[o++] = pred / 32768;
+    }
+  }
+  return out;
+}
+
 class PCMPlayerProcessor extends AudioWorkletProcessor {
   constructor() {
     super();
     this.queue = [];
     this.readIndex = 0;
+    this.format = 'pcm';
+    this.block = 2;
+    this.rest = new Uint8Array(0);  // 上一次收到的不完整单元（网络分包不按块对齐）
+    this.rate = sampleRate;         // 流的采样率
+    this.resetResampler();
     this.port.onmessage = (e) => {
       const { type, data } = e.data || {};
       if (type === 'chunk' && data) {
         this.queue.push(data);
+      } else if (type === 'bytes' && data) {
+        this.pushBytes(new Uint8Array(data));
+      } else if (type === 'format') {
+        this.format = e.data.format || 'pcm';
+        this.block = this.format === 'adpcm' ? (e.data.block || 164) : (this.format === 'mulaw' ? 1 : 2);
+        this.rate = e.data.rate || sampleRate;
+        this.rest = new Uint8Array(0);
+        this.resetResampler();
       } else if (type === 'flush') {
         this.queue.length = 0;
         this.readIndex = 0;
+        this.rest = new Uint8Array(0);
+        this.resetResampler();
       }
     };
   }
 
+  pushBytes(bytes) {
+    if (this.rest.length) {
+      const joined = new Uint8Array(this.rest.length + bytes.length);
+      joined.set(this.rest, 0);
+      joined.set(bytes, this.rest.length);
+      bytes = joined;
+    }
+    const n = bytes.length - bytes.length % this.block;
+    this.rest = bytes.slice(n);
+    if (!n) return;
+    const whole = bytes.subarray(0, n);
+    const f32 = this.format === 'adpcm' ? decodeAdpcm(whole, this.block)
+      : this.format === 'mulaw' ? decodeMulaw(whole) : decodePCM(whole);
+    this.queue.push(this.resample(f32));
+  }
+
+  resetResampler() {
+    this.pos = 1;    // 下一个输出采样在 [上一批最后一个采样, 本批...] 里的位置
+    this.prev = 0;
+  }
+
+  resample(x) {
+    if (this.rate === sampleRate || !x.length) return x;
+    // 位置 0 是上一批的最后一个采样，位置 k 是本批的 x[k-1]；插值要用到 floor(p)+1，所以 p < x.length
+    const step = this.rate / sampleRate;
+    const out = new Float32Array(Math.max(0, Math.ceil((x.length - this.pos) / step)) + 1);
+    let p = this.pos, n = 0;
+    while (p < x.length) {
+      const i = Math.floor(p), f = p - i;
+      const a = i === 0 ? this.prev : x[i - 1];
+      out[n++] = a + (x[i] - a) * f;
+      p += step;
+    }
+    this.pos = p - x.length;
+    this.prev = x[x.length - 1];
+    return out.subarray(0, n);
+  }
+
   process(_, outputs) {
     const out = outputs[0][0]; // mono
     let off = 0, need = out.length;
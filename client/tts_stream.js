@@ -3,6 +3,29 @@
   const TTS_BASE = 'http://127.0.0.1:8080';   // 如需改端口/域名，只改这里
   const ENDPOINT_TTS   = `${TTS_BASE}/tts/stream`;
   const ENDPOINT_AGENT = `${TTS_BASE}/agent/tts/stream`;
+  // 导览机所在展区：页面地址带 ?exhibit=asia/guanyin 时，问答只检索这个展区的资料
+  const EXHIBIT = new URLSearchParams(location.search).get('exhibit') || '';
+  // 流式音频格式：pcm（256 kbit/s）/ mulaw（128）/ adpcm（约 66），页面地址可用 ?format= 覆盖；解码在 worklet 里做
+  const FORMAT = new URLSearchParams(location.search).get('format') || 'adpcm';
+  // 多轮会话 id：同一页面里的文字、语音提问共用，服务端据此接着上文回答；newSession() 换一个（下一位访客）
+  let SESSION_ID = newSessionId();
+
+  function newSessionId() {
+    return (crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+  }
+
+  function sessionId() { return SESSION_ID; }
+
+  async function newSession() {
+    const old = SESSION_ID;
+    SESSION_ID = newSessionId();
+    try {
+      await fetch(`${TTS_BASE}/agent/sessions/${encodeURIComponent(old)}`, { method: 'DELETE' });
+    } catch (e) {
+      console.warn('end session failed', e);  // 服务端会按空闲超时自己清掉
+    }
+    return SESSION_ID;
+  }
 
   const audioCtx = new (window.AudioContext || window.webkitAudioContext)({ sampleRate: 16000 });
   let playerNode = null;
@@ -20,10 +43,13 @@
     }
   }
 
-  function int16ToFloat32(int16) {
-    const out = new Float32Array(int16.length);
-    for (let i = 0; i < int16.length; i++) out[i] = Math.max(-1, Math.min(1, int16[i] / 32768));
-    return out;
+  // 按响应的 Content-Type 告诉播放器怎么解码（服务端可能没按请求的格式返回）；rate= 是语音模型的采样率，worklet 里重采样
+  function setStreamFormat(contentType) {
+    const ct = (contentType || '').toLowerCase();
+    const block = Number((/block=(\d+)/.exec(ct) || [])[1]) || 0;
+    const rate = Number((/rate=(\d+)/.exec(ct) || [])[1]) || 0;
+    const format = ct.includes('ima-adpcm') ? 'adpcm' : (ct.includes('pcmu') || ct.includes('mulaw') || ct.startsWith('audio/basic')) ? 'mulaw' : 'pcm';
+    playerNode.port.postMessage({ type: 'format', format, block, rate });
   }
 
   function stopStreamingPlayback() {
@@ -34,20 +60,18 @@
     }
   }
 
+  // 原样转给 worklet（转移所有权，不拷贝）；分包不对齐由 worklet 拼接
+  function postBytes(u8) {
+    const buf = (u8.byteOffset === 0 && u8.byteLength === u8.buffer.byteLength) ? u8.buffer : u8.slice().buffer;
+    playerNode.port.postMessage({ type: 'bytes', data: buf }, [buf]);
+  }
+
   async function pipePCMToWorklet(resBody) {
     const reader = resBody.getReader();
-    const PRE_MS = 150;
-    const PRE_FRAMES = Math.floor(16000 * (PRE_MS / 1000));
-    let buffered = 0;
-
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
-      const i16 = new Int16Array(value.buffer, value.byteOffset, value.byteLength / 2);
-      const f32 = int16ToFloat32(i16);
-      buffered += f32.length;
-      playerNode.port.postMessage({ type: 'chunk', data: f32 }, [f32.buffer]);
-      if (buffered < PRE_FRAMES) continue; // 起播前预缓冲
+      if (value && value.byteLength) postBytes(value);
     }
   }
 
@@ -63,7 +87,7 @@
       res = await fetch(endpoint, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
+        body: JSON.stringify({ ...payload, format: FORMAT }),
         signal: currentAbort.signal
       });
     } catch (e) {
@@ -76,6 +100,7 @@
       try { const j = await res.json(); msg = j.detail || JSON.stringify(j); } catch { msg = await res.text().catch(()=> ''); }
       throw new Error(`HTTP ${res.status}: ${msg || 'unknown'}`);
     }
+    setStreamFormat(res.headers.get('Content-Type'));
     try {
       await pipePCMToWorklet(res.body);
     } finally {
@@ -83,6 +108,18 @@
     }
   }
 
+  // 全双工：WebSocket 收到的一块音频直接送进播放器（格式见 ack 的 mediaType）
+  async function playPCMChunk(buf) {
+    await ensurePlayer();
+    if (audioCtx.state === 'suspended') { try { await audioCtx.resume(); } catch {} }
+    playerNode.port.postMessage({ type: 'bytes', data: buf }, [buf]);
+  }
+
+  async function setPlaybackFormat(mediaType) {
+    await ensurePlayer();
+    setStreamFormat(mediaType);
+  }
+
   // 文本做 TTS
   async function streamAgentTTS(text, voice = 'en_US-amy-medium.onnx') {
     return _streamPostToWorklet(ENDPOINT_TTS, { text, voice });
@@ -90,7 +127,9 @@
 
   // 先问 Agent，再流式播放答案
   async function streamAgentReply(text, voice = 'en_US-amy-medium.onnx') {
-    return _streamPostToWorklet(ENDPOINT_AGENT, { text, voice });
+    const payload = { text, voice, session_id: SESSION_ID };
+    if (EXHIBIT) payload.exhibit = EXHIBIT;
+    return _streamPostToWorklet(ENDPOINT_AGENT, payload);
   }
 
   function stop() { stopStreamingPlayback(); }
@@ -100,6 +139,6 @@
     window.TTS_BASE = url.replace(/\/+$/,'');
   }
 
-  window.TTS = { streamAgentTTS, streamAgentReply, stopStreamingPlayback: stop, setBaseUrl,
-                 ENDPOINT_TTS: ENDPOINT_TTS, ENDPOINT_AGENT: ENDPOINT_AGENT };
+  window.TTS = { streamAgentTTS, streamAgentReply, stopStreamingPlayback: stop, setBaseUrl, playPCMChunk, setPlaybackFormat,
+                 sessionId, newSession, ENDPOINT_TTS: ENDPOINT_TTS, ENDPOINT_AGENT: ENDPOINT_AGENT, EXHIBIT: EXHIBIT, FORMAT: FORMAT };
 })();
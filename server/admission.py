@@ -0,0 +1,234 @@
+# server/admission.py
+from __future__ import annotations
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Hashable, Optional
+
+# 各阶段同时处理的请求数、排队上限、最长排队时间
+ADMIT_LLM_CONCURRENCY = int(os.getenv("ADMIT_LLM_CONCURRENCY", "8"))
+ADMIT_LLM_QUEUE = int(os.getenv("ADMIT_LLM_QUEUE", "32"))
+ADMIT_TTS_CONCURRENCY = int(os.getenv("ADMIT_TTS_CONCURRENCY", "8"))
+ADMIT_TTS_QUEUE = int(os.getenv("ADMIT_TTS_QUEUE", "32"))
+ADMIT_MAX_WAIT_S = float(os.getenv("ADMIT_MAX_WAIT_S", "10"))
+
+
+class Overloaded(Exception):
+    """排队已满或等待超时，对外返回 503 + Retry-After"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"{stage} stage is overloaded, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class Stage:
+    """
+    一个处理阶段（LLM / TTS）的准入控制：最多 concurrency 个同时进行，
+    最多 max_queue 个排队；队列满或等待超过 max_wait_s 直接拒绝。
+    """
+
+    def __init__(self, name: str, concurrency: int, max_queue: int, max_wait_s: float = ADMIT_MAX_WAIT_S):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_s = max_wait_s
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._waits: deque[float] = deque(maxlen=256)
+        self._service: deque[float] = deque(maxlen=64)
+
+    def retry_after(self) -> int:
+        # 按最近的平均处理时间估算队列排空所需时间
+        avg = sum(self._service) / len(self._service) if self._service else 1.0
+        return max(1, min(30, math.ceil(avg * (self.waiting + 1) / self.concurrency)))
+
+    def _reject(self) -> Overloaded:
+        self.rejected += 1
+        return Overloaded(self.name, self.retry_after())
+
+    async def acquire(self) -> float:
+        """拿到名额后返回开始时间，交给 release"""
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.concurrency)
+        if self._sem.locked() and self.waiting >= self.max_queue:
+            raise self._reject()
+        t0 = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), timeout=self.max_wait_s)
+        except asyncio.TimeoutError:
+            raise self._reject() from None
+        finally:
+            self.waiting -= 1
+        now = time.monotonic()
+        self._waits.append(now - t0)
+        self.in_flight += 1
+        self.admitted += 1
+        return now
+
+    def release(self, started: float) -> None:
+        self._service.append(time.monotonic() - started)
+        self.in_flight -= 1
+        self._sem.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        started = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    async def guard(self, gen: AsyncIterator) -> AsyncIterator:
+        """流式：第一次取数据时占名额，流结束（或被放弃）时归还"""
+        started = await self.acquire()
+        try:
+            async for item in gen:
+                yield item
+        finally:
+            self.release(started)
+            aclose = getattr(gen, "aclose", None)
+            if aclose is not None:
+                await aclose()
+
+    def stats(self) -> dict:
+        waits = sorted(self._waits)
+        return {
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_ms_mean": round(1000 * sum(waits) / len(waits), 1) if waits else 0.0,
+            "wait_ms_p95": round(1000 * waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1) if waits else 0.0,
+            "wait_ms_max": round(1000 * waits[-1], 1) if waits else 0.0,
+        }
+
+
+class _Broadcast:
+    # 一个上游流，多个订阅者各自从头读（后加入的先补读已产出的部分）
+    def __init__(self, gen: AsyncIterator, on_done: Callable[[], None]):
+        self.items: list = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._cond = asyncio.Condition()
+        self._on_done = on_done
+        self.task = asyncio.ensure_future(self._pump(gen))
+
+    async def _pump(self, gen: AsyncIterator) -> None:
+        try:
+            async for item in gen:
+                async with self._cond:
+                    self.items.append(item)
+                    self._cond.notify_all()
+        except asyncio.CancelledError:
+            self.error = ConnectionAbortedError("shared stream cancelled")
+        except Exception as e:
+            self.error = e
+        finally:
+            self._on_done()
+            aclose = getattr(gen, "aclose", None)
+            if aclose is not None:
+                try:
+                    await aclose()
+                except Exception:
+                    pass
+            async with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    async def subscribe(self) -> AsyncIterator:
+        self.subscribers += 1
+        i = 0
+        try:
+            while True:
+                async with self._cond:
+                    while i >= len(self.items) and not self.done:
+                        await self._cond.wait()
+                    if i < len(self.items):
+                        item = self.items[i]
+                        i += 1
+                    elif self.error is not None:
+                        raise self.error
+                    else:
+                        return
+                yield item
+        finally:
+            self.subscribers -= 1
+            # 所有人都走了就停掉上游
+            if self.subscribers == 0 and not self.done:
+                self.task.cancel()
+
+
+class SingleFlight:
+    """相同 key 的请求正在进行时，后来的直接等同一份结果（流式则共享同一条流）"""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self._streams: dict[Hashable, _Broadcast] = {}
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        fut = self._calls.get(key)
+        if fut is None:
+            self.leaders += 1
+            fut = asyncio.ensure_future(fn())
+            self._calls[key] = fut
+
+            def _done(f: asyncio.Future, key=key) -> None:
+                if self._calls.get(key) is f:
+                    del self._calls[key]
+                if not f.cancelled():
+                    f.exception()  # 没人等时也不报 "exception was never retrieved"
+
+            fut.add_done_callback(_done)
+        else:
+            self.followers += 1
+        # 某个请求断开不影响其他在等的请求
+        return await asyncio.shield(fut)
+
+    def stream(self, key: Hashable, make_gen: Callable[[], AsyncIterator]) -> AsyncIterator:
+        bc = self._streams.get(key)
+        if bc is None:
+            self.leaders += 1
+
+            def _done(key=key) -> None:
+                if self._streams.get(key) is bc:
+                    del self._streams[key]
+
+            bc = _Broadcast(make_gen(), _done)
+            self._streams[key] = bc
+        else:
+            self.followers += 1
+        return bc.subscribe()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "leaders": self.leaders,
+            "followers": self.followers,
+        }
+
+
+class Admission:
+    def __init__(self):
+        self.llm = Stage("llm", ADMIT_LLM_CONCURRENCY, ADMIT_LLM_QUEUE)
+        self.tts = Stage("tts", ADMIT_TTS_CONCURRENCY, ADMIT_TTS_QUEUE)
+        self.flights = SingleFlight()
+
+    def stats(self) -> dict:
+        return {"llm": self.llm.stats(), "tts": self.tts.stats(), "single_flight": self.flights.stats()}
+
+
+admission = Admission()
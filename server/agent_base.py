@@ -1,21 +1,37 @@
 # server/agent_base.py
 from __future__ import annotations
 import abc
-from typing import AsyncIterator, Optional
+import asyncio
+from typing import AsyncIterator, Callable, Optional
 
 class AgentInterface(abc.ABC):
     # Agent接口：问答 + 流式可选
 
     @abc.abstractmethod
-    def reply(self, text: str, system_prompt: Optional[str] = None) -> str:
-        # 输入用户文本，返回完整回答文本
+    def reply(self, text: str, system_prompt: Optional[str] = None, exhibit: Optional[str] = None,
+              session_id: Optional[str] = None) -> str:
+        # 输入用户文本，返回完整回答文本；exhibit 为展区范围（只有带知识库的 Agent 用得上，其余忽略）
+        # session_id 为多轮会话（同一访客的连续提问），不给时每轮独立
         raise NotImplementedError
 
-    async def reply_async(self, text: str, system_prompt: Optional[str] = None) -> str:
-        import asyncio
+    async def reply_async(self, text: str, system_prompt: Optional[str] = None,
+                          exhibit: Optional[str] = None, session_id: Optional[str] = None) -> str:
         loop = asyncio.get_running_loop()
-        return await loop.run_in_executor(None, self.reply, text, system_prompt)
+        return await loop.run_in_executor(None, self.reply, text, system_prompt, exhibit, session_id)
 
-    async def stream_reply(self, text: str, system_prompt: Optional[str] = None) -> AsyncIterator[str]:
+    async def stream_reply(self, text: str, system_prompt: Optional[str] = None,
+                           exhibit: Optional[str] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
         # 可选：流式输出 token/chunk。默认退化为一次性输出。
-        yield await self.reply_async(text, system_prompt)
+        yield await self.reply_async(text, system_prompt, exhibit, session_id)
+
+    async def end_session(self, session_id: str) -> bool:
+        # 可选：访客离开时丢掉会话（有会话的 Agent 覆盖）
+        return False
+
+    async def aclose(self) -> None:
+        # 可选：关闭上游连接池等资源（服务停止时调用）
+        return None
+
+    def warmup_steps(self) -> list[tuple[str, Callable, bool]]:
+        # 可选：服务启动后在后台逐个预热的组件 (名字, 函数, 是否影响 /ready)，函数可以是协程函数
+        return []
@@ -1,13 +1,18 @@
 # server/agent_openai.py
 from __future__ import annotations
+import asyncio
 import os
+import time
 from pathlib import Path
-from typing import Optional, List, Dict
+from typing import AsyncIterator, Optional, List, Dict, Sequence, Tuple
 
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, OpenAI
 
 from agent_base import AgentInterface
+from llm_client import LLM_REQUEST_TIMEOUT_S, UpstreamLimiter, http_limits, http_timeout
+from metrics import record, timed_stream
+from sessions import SessionStore
 
 # 加载 .env
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
@@ -25,17 +30,32 @@ if OPENAI_BASE_URL:
     client_kwargs["base_url"] = OPENAI_BASE_URL
 
 _client = OpenAI(**client_kwargs)
+# 服务里走异步客户端：共享长连接池，并发受 LLM_MAX_CONCURRENCY 限制
+_async_client = AsyncOpenAI(
+    **client_kwargs,
+    timeout=http_timeout(),
+    http_client=DefaultAsyncHttpxClient(limits=http_limits(), timeout=http_timeout()),
+)
+_limiter = UpstreamLimiter()
 
-def chat_once(user_text: str, system_prompt: Optional[str] = None) -> str:
-    # 发一轮对话，返回回复文本。
+def _messages(user_text: str, system_prompt: Optional[str] = None,
+              history: Sequence[Tuple[str, str]] = ()) -> List[Dict[str, str]]:
+    # system 和之前的轮次放前面且每轮不变，上游的前缀缓存可以复用
     messages: List[Dict[str, str]] = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
+    for question, answer in history:
+        messages.append({"role": "user", "content": question})
+        messages.append({"role": "assistant", "content": answer})
     messages.append({"role": "user", "content": user_text})
+    return messages
 
+def chat_once(user_text: str, system_prompt: Optional[str] = None,
+              history: Sequence[Tuple[str, str]] = ()) -> str:
+    # 发一轮对话，返回回复文本。
     resp = _client.chat.completions.create(
         model=OPENAI_MODEL,
-        messages=messages,
+        messages=_messages(user_text, system_prompt, history),
         temperature=0.6,
     )
     # 兼容常见字段
@@ -43,14 +63,97 @@ def chat_once(user_text: str, system_prompt: Optional[str] = None) -> str:
     reply = (choice.message.content or "").strip()
     return reply
 
+async def chat_once_async(user_text: str, system_prompt: Optional[str] = None,
+                          history: Sequence[Tuple[str, str]] = ()) -> str:
+    async def _call() -> str:
+        async with _limiter:
+            resp = await _async_client.chat.completions.create(
+                model=OPENAI_MODEL,
+                messages=_messages(user_text, system_prompt, history),
+                temperature=0.6,
+            )
+        return (resp.choices[0].message.content or "").strip()
+
+    t0 = time.perf_counter()
+    reply = await asyncio.wait_for(_call(), timeout=LLM_REQUEST_TIMEOUT_S)
+    record("llm_total", time.perf_counter() - t0)
+    return reply
+
+def chat_stream_async(user_text: str, system_prompt: Optional[str] = None,
+                      history: Sequence[Tuple[str, str]] = ()) -> AsyncIterator[str]:
+    return timed_stream(_chat_stream(user_text, system_prompt, history), "llm_ttft", "llm_total")
+
+async def _chat_stream(user_text: str, system_prompt: Optional[str] = None,
+                       history: Sequence[Tuple[str, str]] = ()) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + LLM_REQUEST_TIMEOUT_S
+    async with _limiter:
+        stream = await _async_client.chat.completions.create(
+            model=OPENAI_MODEL,
+            messages=_messages(user_text, system_prompt, history),
+            temperature=0.6,
+            stream=True,
+        )
+        try:
+            async for chunk in stream:
+                if loop.time() > deadline:
+                    raise TimeoutError(f"OpenAI stream exceeded {LLM_REQUEST_TIMEOUT_S:.0f}s")
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        finally:
+            await stream.close()
+
 class OpenAIAdapter(AgentInterface):
-    # 现有chat_once()包装成统一接口
+    # 现有chat_once()包装成统一接口（没有知识库，exhibit 忽略）；带 session_id 时把最近几轮作为 messages 发上去
 
     def __init__(self):
         # 需要的话这里读取 OPENAI_MODEL / OPENAI_API_KEY 等
         self.model = os.getenv("OPENAI_MODEL")
+        self.sessions = SessionStore()
 
-    def reply(self, text: str, system_prompt: Optional[str] = None) -> str:
+    def reply(self, text: str, system_prompt: Optional[str] = None, exhibit: Optional[str] = None,
+              session_id: Optional[str] = None) -> str:
         # 直接复用chat_once
         # from agent_openai import chat_once  # 避免循环导入
-        return chat_once(text, system_prompt=system_prompt)
+        if not session_id:
+            return chat_once(text, system_prompt=system_prompt)
+        session = self.sessions.get(session_id)
+        reply = chat_once(text, system_prompt=system_prompt, history=list(session.turns))
+        session.record(text, reply, None, system_prompt)
+        return reply
+
+    async def reply_async(self, text: str, system_prompt: Optional[str] = None,
+                          exhibit: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        if not session_id:
+            return await chat_once_async(text, system_prompt=system_prompt)
+        session = self.sessions.get(session_id)
+        async with session.lock:
+            reply = await chat_once_async(text, system_prompt=system_prompt, history=list(session.turns))
+            session.record(text, reply, None, system_prompt)
+        return reply
+
+    async def stream_reply(self, text: str, system_prompt: Optional[str] = None,
+                           exhibit: Optional[str] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        if not session_id:
+            async for delta in chat_stream_async(text, system_prompt=system_prompt):
+                yield delta
+            return
+        session = self.sessions.get(session_id)
+        async with session.lock:
+            parts: list[str] = []
+            try:
+                async for delta in chat_stream_async(text, system_prompt=system_prompt, history=list(session.turns)):
+                    parts.append(delta)
+                    yield delta
+            finally:
+                # 被打断时也记下已经说出的部分，访客的下一句可能就是接着它问的
+                session.record(text, "".join(parts).strip(), None, system_prompt)
+
+    async def end_session(self, session_id: str) -> bool:
+        return self.sessions.drop(session_id)
+
+    async def aclose(self) -> None:
+        await _async_client.close()
@@ -0,0 +1,113 @@
+# server/asr_vad.py
+from __future__ import annotations
+
+import math
+import os
+from collections import deque
+from typing import Optional
+
+import numpy as np
+
+ASR_VAD = os.getenv("ASR_VAD", "1").lower() in ("1", "true", "yes", "on")
+# 语音阈值 = max(最低阈值, 噪声底 + 余量)，单位 dBFS
+ASR_VAD_MIN_DB = float(os.getenv("ASR_VAD_MIN_DB", "-50"))
+ASR_VAD_MARGIN_DB = float(os.getenv("ASR_VAD_MARGIN_DB", "10"))
+# 语音开始前补送的静音（避免吞掉开头的辅音）
+ASR_VAD_PREROLL_MS = int(os.getenv("ASR_VAD_PREROLL_MS", "300"))
+# 说完后静音多久强制出最终结果
+ASR_ENDPOINT_MS = int(os.getenv("ASR_ENDPOINT_MS", "700"))
+# 连续多少毫秒超过阈值才算开始说话（滤掉咔哒声）
+ASR_VAD_ONSET_MS = int(os.getenv("ASR_VAD_ONSET_MS", "60"))
+
+SPEECH = "speech"       # 送去解码
+SILENCE = "silence"     # 跳过
+ENDPOINT = "endpoint"   # 送去解码，并强制出最终结果
+
+
+def frame_dbfs(chunk: bytes) -> float:
+    # s16le 的均方根电平，frombuffer 不复制
+    n = len(chunk) // 2
+    if n == 0:
+        return -120.0
+    x = np.frombuffer(chunk, dtype=np.int16, count=n).astype(np.float32)
+    rms = math.sqrt(float(np.dot(x, x)) / n)
+    return 20.0 * math.log10(rms / 32768.0) if rms > 0 else -120.0
+
+
+class EnergyVAD:
+    """
+    能量门限 + 自适应噪声底：
+    - 安静时持续跟踪噪声底（展厅的空调声、人声底噪），阈值随之浮动
+    - 超过阈值持续 onset_ms 才进入说话状态，开头补送 preroll_ms 的缓存帧
+    - 说话后的静音照常送解码，累计到 endpoint_ms 时返回 ENDPOINT；之后的静音全部跳过
+    """
+
+    def __init__(self, sample_rate: int, min_db: float = ASR_VAD_MIN_DB, margin_db: float = ASR_VAD_MARGIN_DB,
+                 preroll_ms: int = ASR_VAD_PREROLL_MS, endpoint_ms: int = ASR_ENDPOINT_MS,
+                 onset_ms: int = ASR_VAD_ONSET_MS):
+        self.sample_rate = sample_rate
+        self.min_db = min_db
+        self.margin_db = margin_db
+        self.preroll_ms = preroll_ms
+        self.endpoint_ms = max(200, endpoint_ms)
+        self.onset_ms = onset_ms
+        self.noise_db = min_db - margin_db
+        self.in_speech = False
+        self._voiced_ms = 0.0
+        self._silence_ms = 0.0
+        self._preroll: deque[bytes] = deque()
+        self._preroll_ms = 0.0
+
+    def _duration_ms(self, chunk: bytes) -> float:
+        return 1000.0 * (len(chunk) // 2) / self.sample_rate
+
+    def threshold(self) -> float:
+        return max(self.min_db, self.noise_db + self.margin_db)
+
+    def process(self, chunk: bytes) -> tuple[str, list[bytes]]:
+        """返回 (状态, 需要送去解码的帧)；进入说话状态时会带上预存的帧"""
+        ms = self._duration_ms(chunk)
+        db = frame_dbfs(chunk)
+        loud = db >= self.threshold()
+
+        if not self.in_speech:
+            if not loud:
+                # 噪声底只在安静时更新，慢升快降
+                alpha = 0.05 if db > self.noise_db else 0.3
+                self.noise_db += alpha * (db - self.noise_db)
+                self._voiced_ms = 0.0
+            else:
+                self._voiced_ms += ms
+            self._preroll.append(chunk)
+            self._preroll_ms += ms
+            while self._preroll and self._preroll_ms - self._duration_ms(self._preroll[0]) >= self.preroll_ms:
+                self._preroll_ms -= self._duration_ms(self._preroll.popleft())
+            if loud and self._voiced_ms >= self.onset_ms:
+                self.in_speech = True
+                self._silence_ms = 0.0
+                frames = list(self._preroll)
+                self._preroll.clear()
+                self._preroll_ms = 0.0
+                return SPEECH, frames
+            return SILENCE, []
+
+        if loud:
+            self._silence_ms = 0.0
+            return SPEECH, [chunk]
+        self._silence_ms += ms
+        if self._silence_ms >= self.endpoint_ms:
+            self.in_speech = False
+            self._voiced_ms = 0.0
+            return ENDPOINT, [chunk]
+        return SPEECH, [chunk]
+
+    def reset(self) -> None:
+        self.in_speech = False
+        self._voiced_ms = 0.0
+        self._silence_ms = 0.0
+        self._preroll.clear()
+        self._preroll_ms = 0.0
+
+
+def make_vad(sample_rate: int) -> Optional[EnergyVAD]:
+    return EnergyVAD(sample_rate) if ASR_VAD else None
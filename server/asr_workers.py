@@ -0,0 +1,192 @@
+# server/asr_workers.py
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from asr_vad import ENDPOINT, make_vad
+from metrics import ASR_DECODE_RTF
+from stt_vosk import recognizer_pool
+
+# 解码线程数（分片数）。Vosk 在 C 里解码时会释放 GIL，多个线程可以吃满多核
+ASR_WORKERS = int(os.getenv("ASR_WORKERS", str(min(4, os.cpu_count() or 1))))
+# 两次中间结果之间至少间隔多少毫秒音频（中间结果要解析 JSON、发 WebSocket 消息）
+ASR_PARTIAL_INTERVAL_MS = int(os.getenv("ASR_PARTIAL_INTERVAL_MS", "200"))
+
+
+def _text(raw: Optional[str], field: str) -> str:
+    try:
+        return (json.loads(raw or "{}").get(field) or "").strip()
+    except ValueError:
+        return ""
+
+
+class _Shard:
+    # 单线程执行器：同一会话的所有调用都在这一个线程里按顺序执行（识别器不是线程安全的）
+    def __init__(self, idx: int):
+        self.idx = idx
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"asr-{idx}")
+        self.sessions = 0
+        self.frames_in = 0
+        self.frames_decoded = 0
+        self.busy_s = 0.0
+
+
+class AsrSession:
+    """
+    一个 WebSocket 的识别会话，固定在某个分片上。
+    音频帧（bytes，不可变）直接交给工作线程，不复制；JSON 解析也在工作线程里做。
+    """
+
+    def __init__(self, pool: "AsrWorkerPool", shard: _Shard, sample_rate: int):
+        self.pool = pool
+        self.shard = shard
+        self.sample_rate = sample_rate
+        self._rec = None
+        self._closed = False
+        # 静音帧不送解码；说完后静音够长强制出最终结果
+        self._vad = make_vad(sample_rate)
+        self._since_partial_ms = 0.0
+        # 当前这句话的解码耗时和音频时长，出最终结果时记一次实时率
+        self._utt_busy_s = 0.0
+        self._utt_audio_s = 0.0
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.shard.executor, fn, *args)
+
+    # 以下 _do_* 在工作线程里执行
+
+    def _do_start(self) -> None:
+        self._do_release()
+        self._rec = recognizer_pool.acquire(self.sample_rate)
+        if self._vad is not None:
+            self._vad.reset()
+        self._since_partial_ms = 0.0
+        self._utt_busy_s = self._utt_audio_s = 0.0
+
+    def _observe_utterance(self) -> None:
+        if self._utt_audio_s > 0:
+            ASR_DECODE_RTF.observe(self._utt_busy_s / self._utt_audio_s)
+        self._utt_busy_s = self._utt_audio_s = 0.0
+
+    def _do_feed(self, chunk: bytes) -> Optional[tuple[str, str]]:
+        rec = self._rec
+        if rec is None:
+            return None
+        self.shard.frames_in += 1
+        if self._vad is None:
+            state, frames = None, [chunk]
+        else:
+            state, frames = self._vad.process(chunk)
+        if not frames:
+            return None
+
+        t0 = time.perf_counter()
+        is_final = False
+        try:
+            finals: list[str] = []
+            for f in frames:
+                if rec.AcceptWaveform(f):
+                    is_final = True
+                    finals.append(_text(rec.Result(), "text"))
+                ms = 1000.0 * (len(f) // 2) / self.sample_rate
+                self._since_partial_ms += ms
+                self._utt_audio_s += ms / 1000.0
+            if state == ENDPOINT:
+                # 静音已够长，不等 Kaldi 自己断句
+                is_final = True
+                finals.append(_text(rec.FinalResult(), "text"))
+            if is_final:
+                self._since_partial_ms = 0.0
+                return ("final", " ".join(t for t in finals if t))
+            if self._since_partial_ms < ASR_PARTIAL_INTERVAL_MS:
+                return None
+            self._since_partial_ms = 0.0
+            return ("partial", _text(rec.PartialResult(), "partial"))
+        finally:
+            dt = time.perf_counter() - t0
+            self.shard.frames_decoded += len(frames)
+            self.shard.busy_s += dt
+            self._utt_busy_s += dt
+            if is_final:
+                self._observe_utterance()
+
+    def _do_finish(self) -> str:
+        rec = self._rec
+        if rec is None:
+            return ""
+        t0 = time.perf_counter()
+        text = _text(rec.FinalResult(), "text")
+        self._utt_busy_s += time.perf_counter() - t0
+        self._observe_utterance()
+        self._do_release()
+        return text
+
+    def _do_release(self) -> None:
+        # 识别器 Reset 后还回池里，下次 start 直接复用
+        rec, self._rec = self._rec, None
+        if rec is not None:
+            recognizer_pool.release(rec, self.sample_rate)
+
+    # 事件循环侧
+
+    async def start(self) -> None:
+        await self._call(self._do_start)
+
+    async def feed(self, chunk: bytes) -> Optional[tuple[str, str]]:
+        """返回 ("final", 文本) / ("partial", 文本)；静音跳过、中间结果限流或未开始时返回 None"""
+        return await self._call(self._do_feed, chunk)
+
+    async def finish(self) -> str:
+        return await self._call(self._do_finish)
+
+    def close(self) -> None:
+        if not self._closed:
+            self._closed = True
+            # 排在该会话已提交的解码之后执行，不会和正在进行的解码冲突
+            try:
+                self.shard.executor.submit(self._do_release)
+            except RuntimeError:
+                pass
+            self.pool._release(self.shard)
+
+
+class AsrWorkerPool:
+    def __init__(self, workers: int = ASR_WORKERS):
+        self.shards = [_Shard(i) for i in range(max(1, workers))]
+        self._lock = threading.Lock()
+
+    def session(self, sample_rate: int = 16000) -> AsrSession:
+        # 新会话放到当前会话数最少的分片
+        with self._lock:
+            shard = min(self.shards, key=lambda s: s.sessions)
+            shard.sessions += 1
+        return AsrSession(self, shard, sample_rate)
+
+    def _release(self, shard: _Shard) -> None:
+        with self._lock:
+            shard.sessions -= 1
+
+    def shutdown(self) -> None:
+        for s in self.shards:
+            s.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self.shards),
+            "recognizers": recognizer_pool.stats(),
+            "shards": [
+                {"sessions": s.sessions, "frames_in": s.frames_in, "frames_decoded": s.frames_decoded,
+                 "busy_s": round(s.busy_s, 3)}
+                for s in self.shards
+            ],
+        }
+
+
+asr_pool = AsrWorkerPool()
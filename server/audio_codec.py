@@ -0,0 +1,388 @@
+# server/audio_codec.py
+"""
+流式 TTS 的输出编码：裸 PCM(s16le) / µ-law(G.711) / IMA-ADPCM
+16kHz 单声道下码率：pcm 256 kbit/s，mulaw 128 kbit/s，adpcm 约 66 kbit/s
+采样率跟语音模型走（Piper --output-raw 不重采样，en_US-amy-medium 是 22050），写在媒体类型的 rate= 里
+
+分帧约定（客户端 pcm-player.worklet.js 按这个在 worklet 里解码）：
+- 每块都是整帧（默认 20ms），网络把块拆开/合并也能按字节重新对齐
+- pcm 2 字节一个采样，mulaw 1 字节一个采样
+- adpcm 一帧一个独立的块：4 字节头（int16 首采样、uint8 步长索引、uint8 0）+ 其余采样的 4bit 码，
+  低半字节在前，帧长取偶数个采样（22050Hz 下 20ms 取 440 个），最后半字节补 0；块之间不带状态，丢块/拼接不影响后面的解码
+  每块的初始步长索引按本块平均差分估计，所以多块可以并行编码
+
+  python server/audio_codec.py --check      # 编码 -> 解码一段测试音，打印码率和信噪比
+"""
+from __future__ import annotations
+
+import argparse
+import os
+from typing import AsyncIterator, Iterator, Optional
+
+import numpy as np
+
+# 客户端没指定格式时的默认输出
+TTS_STREAM_FORMAT = os.getenv("TTS_STREAM_FORMAT", "pcm").strip().lower()
+# 一次编码的 ADPCM 块数达到这个值才逐列向量化，否则逐块查表（单帧时 numpy 每步的开销反而更大）
+ADPCM_VECTOR_MIN_BLOCKS = int(os.getenv("ADPCM_VECTOR_MIN_BLOCKS", "32"))
+
+FORMATS = ("pcm", "mulaw", "adpcm")
+
+# Accept 头里的媒体类型 -> 格式
+_ACCEPT_TYPES = {
+    "audio/l16": "pcm",
+    "audio/pcmu": "mulaw",
+    "audio/basic": "mulaw",
+    "audio/x-mulaw": "mulaw",
+    "audio/x-ima-adpcm": "adpcm",
+    "audio/ima-adpcm": "adpcm",
+}
+
+
+class AudioCodec:
+    """裸 PCM：编码即原样输出"""
+
+    name = "pcm"
+    bytes_per_sample = 2.0
+
+    def __init__(self, sample_rate: int = 16000, chunk_ms: int = 20):
+        self.sample_rate = sample_rate
+        self.chunk_ms = chunk_ms
+        self.frame_samples = int(sample_rate * chunk_ms / 1000)
+
+    @property
+    def pcm_frame_bytes(self) -> int:
+        return self.frame_samples * 2
+
+    @property
+    def frame_bytes(self) -> int:
+        # 一整帧编码后的字节数
+        return int(self.frame_samples * self.bytes_per_sample)
+
+    @property
+    def bytes_per_s(self) -> float:
+        # 按实际帧长算（adpcm 的帧可能比 chunk_ms 略短）
+        return self.frame_bytes * self.sample_rate / self.frame_samples
+
+    @property
+    def media_type(self) -> str:
+        return f"audio/L16; rate={self.sample_rate}; channels=1"
+
+    def encode(self, pcm: bytes) -> bytes:
+        """整帧的 s16le -> 编码后的字节（长度是 frame_bytes 的整数倍）；pcm 原样返回，不拷贝"""
+        return pcm
+
+    def encode_tail(self, pcm: bytes) -> bytes:
+        """不足一帧的尾巴"""
+        return bytes(pcm[:len(pcm) - len(pcm) % 2])
+
+    def decode(self, data: bytes) -> bytes:
+        return bytes(data)
+
+
+class MulawCodec(AudioCodec):
+    """G.711 µ-law：查 64K 表，一次 take 完成"""
+
+    name = "mulaw"
+    bytes_per_sample = 1.0
+
+    @property
+    def media_type(self) -> str:
+        return f"audio/PCMU; rate={self.sample_rate}; channels=1"
+
+    def encode(self, pcm: bytes) -> bytes:
+        x = np.frombuffer(pcm, dtype="<u2", count=len(pcm) // 2)
+        return _MULAW_ENC.take(x).tobytes()
+
+    def encode_tail(self, pcm: bytes) -> bytes:
+        return self.encode(pcm)
+
+    def decode(self, data: bytes) -> bytes:
+        return _MULAW_DEC.take(np.frombuffer(data, dtype=np.uint8)).astype("<i2").tobytes()
+
+
+class AdpcmCodec(AudioCodec):
+    """IMA-ADPCM，一帧一块"""
+
+    name = "adpcm"
+
+    def __init__(self, sample_rate: int = 16000, chunk_ms: int = 20):
+        super().__init__(sample_rate, chunk_ms)
+        # 每块首采样放块头，其余两个一字节：帧长向下取偶数
+        self.frame_samples -= self.frame_samples % 2
+        if self.frame_samples < 2:
+            raise ValueError(f"adpcm needs at least 2 samples per frame, got {self.frame_samples}")
+
+    @property
+    def frame_bytes(self) -> int:
+        return 4 + self.frame_samples // 2
+
+    @property
+    def media_type(self) -> str:
+        return f"audio/x-ima-adpcm; rate={self.sample_rate}; channels=1; block={self.frame_bytes}"
+
+    def encode(self, pcm: bytes) -> bytes:
+        x = np.frombuffer(pcm, dtype="<i2", count=len(pcm) // 2)
+        k = len(x) // self.frame_samples
+        return adpcm_encode_blocks(x[:k * self.frame_samples].reshape(k, self.frame_samples)).tobytes()
+
+    def encode_tail(self, pcm: bytes) -> bytes:
+        # 补静音到整帧，客户端只按定长块解码
+        n = len(pcm) - len(pcm) % 2
+        if n == 0:
+            return b""
+        return self.encode(bytes(pcm[:n]) + bytes(self.pcm_frame_bytes - n))
+
+    def decode(self, data: bytes) -> bytes:
+        b = np.frombuffer(data, dtype=np.uint8)
+        k = len(b) // self.frame_bytes
+        return adpcm_decode_blocks(b[:k * self.frame_bytes].reshape(k, self.frame_bytes)).astype("<i2").tobytes()
+
+
+_CODECS = {"pcm": AudioCodec, "mulaw": MulawCodec, "adpcm": AdpcmCodec}
+
+
+def get_codec(name: Optional[str] = None, sample_rate: int = 16000, chunk_ms: int = 20) -> AudioCodec:
+    name = (name or TTS_STREAM_FORMAT).strip().lower()
+    if name not in _CODECS:
+        raise ValueError(f"unknown audio format: {name!r} (expected one of {', '.join(FORMATS)})")
+    return _CODECS[name](sample_rate, chunk_ms)
+
+
+def negotiate(fmt: Optional[str] = None, accept: Optional[str] = None,
+              sample_rate: int = 16000, chunk_ms: int = 20) -> AudioCodec:
+    """
+    请求体里的 format 优先，其次按 Accept 头（q 值从高到低，取第一个认识的），都没有用 TTS_STREAM_FORMAT。
+    format 写错抛 ValueError（调用方返回 400）；Accept 里不认识的类型忽略。
+    """
+    if fmt:
+        return get_codec(fmt, sample_rate, chunk_ms)
+    prefs: list[tuple[float, int, str]] = []
+    for i, part in enumerate((accept or "").split(",")):
+        mtype, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for p in params:
+            if p.lower().startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if mtype.lower() in _ACCEPT_TYPES and q > 0:
+            prefs.append((-q, i, _ACCEPT_TYPES[mtype.lower()]))
+    name = min(prefs)[2] if prefs else None
+    return get_codec(name, sample_rate, chunk_ms)
+
+
+class FrameEncoder:
+    """
+    任意长度的 s16le 进来，定长编码块出去：攒够的整帧一次编码（一整句缓存命中就是一次向量化调用），
+    再按 frame_bytes 切开。输出是对输入（或编码结果）的 memoryview 切片，不逐帧拷贝；
+    只有跨两次输入的那一帧要拼接。调用方不能再修改喂进来的缓冲区。
+    """
+
+    def __init__(self, codec: AudioCodec):
+        self.codec = codec
+        self.pending = bytearray()
+
+    def feed(self, data: bytes) -> Iterator[bytes]:
+        step = self.codec.pcm_frame_bytes
+        mv = memoryview(data).cast("B")
+        if self.pending:
+            # 先把上次剩下的补成一整帧
+            need = step - len(self.pending)
+            self.pending += mv[:need]
+            mv = mv[need:]
+            if len(self.pending) < step:
+                return
+            head = bytes(self.pending)
+            self.pending.clear()
+            yield from self._frames(head)
+        n = len(mv) - len(mv) % step
+        if n:
+            yield from self._frames(mv[:n])
+        if n < len(mv):
+            self.pending += mv[n:]
+
+    def _frames(self, pcm) -> Iterator[bytes]:
+        out = memoryview(self.codec.encode(pcm)).cast("B")
+        fb = self.codec.frame_bytes
+        for off in range(0, len(out), fb):
+            yield out[off:off + fb]
+
+    def flush(self) -> Iterator[bytes]:
+        tail = self.codec.encode_tail(bytes(self.pending))
+        self.pending.clear()
+        if tail:
+            yield tail
+
+
+async def encode_stream(pcm: AsyncIterator[bytes], codec: AudioCodec) -> AsyncIterator[bytes]:
+    """s16le 流 -> 定长编码块流；尾巴按 s16 对齐（adpcm 补静音到整帧）。提前关掉时同时关掉上游"""
+    frames = FrameEncoder(codec)
+    try:
+        async for data in pcm:
+            for c in frames.feed(data):
+                yield c
+        for c in frames.flush():
+            yield c
+    finally:
+        await pcm.aclose()
+
+
+# µ-law 表
+
+def _mulaw_tables() -> tuple[np.ndarray, np.ndarray]:
+    # 编码表按 int16 的 uint16 视图索引，解码表 256 项
+    x = np.arange(65536, dtype=np.uint16).view(np.int16).astype(np.int32)
+    sign = (x < 0).astype(np.int32)
+    mag = np.minimum(np.abs(x), 32635) + 0x84
+    exp = np.floor(np.log2(mag)).astype(np.int32) - 7
+    mant = (mag >> (exp + 3)) & 0x0F
+    enc = (~((sign << 7) | (exp << 4) | mant) & 0xFF).astype(np.uint8)
+
+    u = ~np.arange(256, dtype=np.int32) & 0xFF
+    e, m = (u >> 4) & 0x07, u & 0x0F
+    val = (((m << 3) + 0x84) << e) - 0x84
+    dec = np.where(u & 0x80, -val, val).astype(np.int16)
+    return enc, dec
+
+
+_MULAW_ENC, _MULAW_DEC = _mulaw_tables()
+
+
+# IMA-ADPCM 表
+
+_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230, 253, 279, 307,
+    337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963, 1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066,
+    2272, 2499, 2749, 3024, 3327, 3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+)
+_INDEX_ADJ = (-1, -1, -1, -1, 2, 4, 6, 8)
+
+
+def _adpcm_tables() -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # 按 index*16+code 展平：解码器的预测增量（含符号）和下一个步长索引；编码端照解码器的算法更新，逐位一致
+    step = np.array(_STEPS, dtype=np.int32)[:, None]
+    code = np.arange(16, dtype=np.int32)[None, :]
+    vp = (step >> 3) + (code & 4 > 0) * step + (code & 2 > 0) * (step >> 1) + (code & 1 > 0) * (step >> 2)
+    vp = np.where(code & 8, -vp, vp)
+    nxt = np.clip(np.arange(89)[:, None] + np.array(_INDEX_ADJ * 2)[None, :], 0, 88)
+    return np.array(_STEPS, dtype=np.int32), vp.astype(np.int32).ravel(), nxt.astype(np.int32).ravel()
+
+
+_STEP, _VPDIFF, _NEXT = _adpcm_tables()
+_STEP_L, _VPDIFF_L, _NEXT_L = _STEP.tolist(), _VPDIFF.tolist(), _NEXT.tolist()
+
+
+def _initial_index(x: np.ndarray) -> np.ndarray:
+    # 步长取接近本块平均差分的一档，开头几个采样不至于跟不上
+    d = np.abs(np.diff(x, axis=1)).mean(axis=1)
+    return np.clip(np.searchsorted(_STEP, d), 0, 88).astype(np.int32)
+
+
+def _encode_columns(x: np.ndarray, pred: np.ndarray, idx: np.ndarray, codes: np.ndarray) -> None:
+    # 块之间互不依赖：沿时间逐列推进，每步对所有块一起算
+    xt = np.ascontiguousarray(x.T)
+    for i in range(1, xt.shape[0]):
+        d = xt[i] - pred
+        c = np.minimum((np.abs(d) << 2) // _STEP.take(idx), 7) | ((d < 0) << 3)
+        flat = (idx << 4) | c
+        pred += _VPDIFF.take(flat)
+        np.clip(pred, -32768, 32767, out=pred)
+        idx = _NEXT.take(flat)
+        codes[:, i - 1] = c
+
+
+def _encode_rows(x: np.ndarray, pred: np.ndarray, idx: np.ndarray, codes: np.ndarray) -> None:
+    # 块少时逐块查表，Python 整数运算比每步一组小数组的 numpy 调用快
+    step, vpdiff, nxt = _STEP_L, _VPDIFF_L, _NEXT_L
+    for b, row in enumerate(x.tolist()):
+        p, ix = int(pred[b]), int(idx[b])
+        out = []
+        for s in row[1:]:
+            d = s - p
+            if d < 0:
+                c = min((-d << 2) // step[ix], 7) | 8
+            else:
+                c = min((d << 2) // step[ix], 7)
+            f = (ix << 4) | c
+            p += vpdiff[f]
+            if p > 32767:
+                p = 32767
+            elif p < -32768:
+                p = -32768
+            ix = nxt[f]
+            out.append(c)
+        codes[b, :len(out)] = out
+
+
+def adpcm_encode_blocks(x: np.ndarray) -> np.ndarray:
+    """(块数, 每块采样数) 的 int16 -> (块数, 4 + 采样数/2) 的 uint8"""
+    k, n = x.shape
+    x = x.astype(np.int32)
+    pred = x[:, 0].copy()
+    idx = _initial_index(x)
+    codes = np.zeros((k, n), dtype=np.uint8)  # 第 0 个采样在块头里，最后半字节是补位
+    if k >= ADPCM_VECTOR_MIN_BLOCKS:
+        _encode_columns(x, pred, idx.copy(), codes)
+    else:
+        _encode_rows(x, pred, idx, codes)
+    out = np.empty((k, 4 + n // 2), dtype=np.uint8)
+    out[:, 0:2] = x[:, :1].astype("<i2").view(np.uint8)
+    out[:, 2] = idx
+    out[:, 3] = 0
+    out[:, 4:] = codes[:, 0::2] | (codes[:, 1::2] << 4)
+    return out
+
+
+def adpcm_decode_blocks(b: np.ndarray) -> np.ndarray:
+    """adpcm_encode_blocks 的逆过程（压测和自检用；客户端在 worklet 里解码）"""
+    k, nb = b.shape
+    n = (nb - 4) * 2
+    pred = b[:, 0:2].copy().view("<i2")[:, 0].astype(np.int32)
+    idx = b[:, 2].astype(np.int32)
+    codes = np.empty((k, n), dtype=np.int32)
+    codes[:, 0::2] = b[:, 4:] & 0x0F
+    codes[:, 1::2] = b[:, 4:] >> 4
+    out = np.empty((k, n), dtype=np.int32)
+    out[:, 0] = pred
+    for i in range(1, n):
+        flat = (idx << 4) | codes[:, i - 1]
+        pred = np.clip(pred + _VPDIFF.take(flat), -32768, 32767)
+        idx = _NEXT.take(flat)
+        out[:, i] = pred
+    return out.astype(np.int16)
+
+
+def snr_db(ref: bytes, got: bytes) -> float:
+    a = np.frombuffer(ref, dtype="<i2").astype(np.float64)
+    b = np.frombuffer(got, dtype="<i2")[:len(a)].astype(np.float64)
+    noise = float(((a[:len(b)] - b) ** 2).sum())
+    return float("inf") if noise == 0 else round(10 * np.log10(float((a ** 2).sum()) / noise), 1)
+
+
+def _check(seconds: float = 3.0, sample_rate: int = 16000) -> None:
+    # 带包络的和弦加一点噪声，近似语音的动态范围
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    env = 0.5 + 0.5 * np.sin(2 * np.pi * 3 * t)
+    sig = env * (6000 * np.sin(2 * np.pi * 220 * t) + 3000 * np.sin(2 * np.pi * 1330 * t))
+    sig += np.random.default_rng(0).normal(0, 200, len(t))
+    pcm = np.clip(sig, -32768, 32767).astype("<i2").tobytes()
+    for name in FORMATS:
+        codec = get_codec(name, sample_rate)
+        enc = FrameEncoder(codec)
+        data = b"".join(list(enc.feed(pcm)) + list(enc.flush()))
+        print(f"[CODEC] {name:<6} {codec.bytes_per_s * 8 / 1000:6.1f} kbit/s  "
+              f"{len(pcm) / max(1, len(data)):4.2f}x  SNR {snr_db(pcm, codec.decode(data))} dB  {codec.media_type}")
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="TTS stream audio codecs")
+    ap.add_argument("--check", action="store_true", help="round-trip a test tone through every format")
+    args = ap.parse_args()
+    if args.check:
+        _check()
+    else:
+        ap.print_help()
@@ -0,0 +1,47 @@
+# server/boot.py
+"""
+启动预热，单进程（main.py）和多进程的共享 host（host.py）共用：
+先登记组件（/ready 里可见），再在后台并行加载 Agent、Piper 常驻进程池、Vosk 模型。
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Callable, Optional
+
+from agent_base import AgentInterface
+from agent_factory import create_agent
+from readiness import LAZY, PENDING, readiness
+from stt_vosk import VOSK_PRELOAD, preload as preload_vosk
+from tts_piper import piper_tts
+
+
+def add_components() -> None:
+    readiness.add("agent")
+    readiness.add("piper")
+    readiness.add("vosk", required=VOSK_PRELOAD, state=PENDING if VOSK_PRELOAD else LAZY)
+
+
+async def warm_up(on_agent: Callable[[AgentInterface], None], tag: str = "BOOT") -> None:
+    """
+    互不依赖，并行加载：Agent（读取 AGENT_KIND，RAG 要加载向量模型和向量库，很慢）；
+    Piper 常驻进程池（启动巡检并预热默认语音）；Vosk 模型和识别器（第一次 start 不用等）。
+    Agent 一建好就交给 on_agent（调用方存成自己的全局变量），再逐项预热。
+    """
+    agent: Optional[AgentInterface] = None
+
+    def build_agent() -> None:
+        nonlocal agent
+        agent = create_agent()
+        on_agent(agent)
+
+    async def load_agent() -> None:
+        if await readiness.run("agent", build_agent):
+            # 向量模型、向量库、上游 LLM 等各自预热
+            for name, fn, required in agent.warmup_steps():
+                await readiness.run(name, fn, required)
+
+    jobs = [load_agent(), readiness.run("piper", piper_tts.start)]
+    if VOSK_PRELOAD:
+        jobs.append(readiness.run("vosk", preload_vosk))
+    await asyncio.gather(*jobs)
+    print(f"[{tag}] warm-up done, ready={readiness.ready}")
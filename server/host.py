@@ -0,0 +1,211 @@
+# server/host.py
+"""
+多进程模式的共享 host（serve.py --workers N 会自动拉起）：
+Agent（向量模型、向量库、BM25、各级缓存、多轮会话、入库和目录监听）、Piper 进程池和 TTS 缓存、
+Vosk 模型和解码线程都只在这个进程里加载一份；N 个 uvicorn worker 只做 HTTP / WebSocket、准入排队和音频编码，
+通过本机 IPC（ipc.py）调用这里。知识库入库（RAG_INDEX_ON_START / RAG_WATCH）也只在这里做。
+
+  python host.py --addr unix:/tmp/museum-host-8080.sock
+"""
+from __future__ import annotations
+
+# 最先导入：以它的导入时刻作为进程启动时间
+from readiness import readiness
+
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+from typing import Optional
+
+import metrics
+from agent_base import AgentInterface
+from asr_workers import asr_pool
+from boot import add_components, warm_up
+from ipc import Conn, RpcServer, default_addr
+from tts_piper import piper_tts
+
+AGENT: Optional[AgentInterface] = None
+rpc = RpcServer()
+_asr_ids = itertools.count(1)
+
+
+def _set_agent(agent: AgentInterface) -> None:
+    global AGENT
+    AGENT = agent
+
+
+def _agent() -> AgentInterface:
+    readiness.require("agent")
+    return AGENT
+
+
+@rpc.call("readiness")
+async def _readiness(conn: Conn) -> dict:
+    return readiness.stats()
+
+
+# Agent
+
+@rpc.call("agent.reply")
+async def _agent_reply(conn: Conn, text: str, system: Optional[str], exhibit: Optional[str],
+                       session_id: Optional[str]) -> str:
+    return await _agent().reply_async(text, system_prompt=system, exhibit=exhibit, session_id=session_id)
+
+
+@rpc.stream("agent.stream")
+async def _agent_stream(conn: Conn, text: str, system: Optional[str], exhibit: Optional[str],
+                        session_id: Optional[str]):
+    return _agent().stream_reply(text, system_prompt=system, exhibit=exhibit, session_id=session_id)
+
+
+@rpc.call("agent.end_session")
+async def _agent_end_session(conn: Conn, session_id: str) -> bool:
+    return await _agent().end_session(session_id)
+
+
+@rpc.call("agent.index_status")
+async def _agent_index_status(conn: Conn) -> Optional[dict]:
+    status = getattr(_agent(), "index_status", None)
+    return status() if status is not None else None
+
+
+@rpc.call("agent.sessions")
+async def _agent_sessions(conn: Conn) -> Optional[dict]:
+    sessions = getattr(_agent(), "sessions", None)
+    return sessions.stats() if sessions is not None else None
+
+
+# Piper
+
+@rpc.call("tts.synth")
+async def _tts_synth(conn: Conn, text: str, voice: Optional[str]) -> bytes:
+    readiness.require("piper")
+    return await piper_tts.synth(text=text, model_path=voice)
+
+
+@rpc.stream("tts.stream")
+async def _tts_stream(conn: Conn, text: str, voice: Optional[str]):
+    # 只发整句 PCM，切块和编码在 worker 里做
+    readiness.require("piper")
+    return await piper_tts.stream_pcm(text, voice)
+
+
+@rpc.call("tts.rate")
+async def _tts_rate(conn: Conn, voice: Optional[str]) -> int:
+    return await piper_tts.sample_rate(voice)
+
+
+@rpc.call("tts.pool")
+async def _tts_pool(conn: Conn) -> dict:
+    return piper_tts.pool.stats()
+
+
+@rpc.call("tts.cache")
+async def _tts_cache(conn: Conn) -> dict:
+    return piper_tts.cache.stats()
+
+
+# Vosk：识别会话绑在连接上，worker 断开时一起关掉
+
+def _asr_session(conn: Conn, sid: int):
+    session = conn.resources.get(("asr", sid))
+    if session is None:
+        raise KeyError(f"unknown ASR session {sid}")
+    return session
+
+
+@rpc.call("asr.open")
+async def _asr_open(conn: Conn, sample_rate: int) -> int:
+    readiness.require("vosk")
+    session = asr_pool.session(sample_rate)
+    sid = next(_asr_ids)
+    conn.resources[("asr", sid)] = session
+    await session.start()
+    return sid
+
+
+@rpc.call("asr.start")
+async def _asr_start(conn: Conn, sid: int) -> None:
+    await _asr_session(conn, sid).start()
+
+
+@rpc.call("asr.feed")
+async def _asr_feed(conn: Conn, sid: int, chunk: bytes):
+    return await _asr_session(conn, sid).feed(chunk)
+
+
+@rpc.call("asr.finish")
+async def _asr_finish(conn: Conn, sid: int) -> str:
+    return await _asr_session(conn, sid).finish()
+
+
+@rpc.call("asr.close")
+async def _asr_close(conn: Conn, sid: int) -> None:
+    session = conn.resources.pop(("asr", sid), None)
+    if session is not None:
+        session.close()
+
+
+@rpc.call("asr.stats")
+async def _asr_stats(conn: Conn) -> dict:
+    return asr_pool.stats()
+
+
+# 指标：worker 把自己的增量推过来，/metrics 从这里取汇总
+
+@rpc.call("metrics.merge")
+async def _metrics_merge(conn: Conn, deltas: dict) -> None:
+    metrics.merge(deltas)
+
+
+@rpc.call("metrics.render")
+async def _metrics_render(conn: Conn) -> str:
+    return metrics.render()
+
+
+async def serve(addr: str) -> None:
+    add_components()
+    server = await rpc.start(addr)
+    print(f"[HOST] listening on {addr} after {readiness.mark_listening():.2f}s, warming up in background")
+    # 和单进程模式（main.py）同一套预热
+    warm = asyncio.create_task(warm_up(_set_agent, tag="HOST"))
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Windows：靠 serve.py 结束进程
+            pass
+    # serve.py 被强杀时不留下孤儿进程
+    parent = os.getppid()
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), 2.0)
+        except asyncio.TimeoutError:
+            if os.getppid() != parent:
+                print("[HOST] parent exited, shutting down")
+                break
+
+    server.close()
+    warm.cancel()
+    await piper_tts.close()
+    if AGENT is not None:
+        await AGENT.aclose()
+    asr_pool.shutdown()
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="shared model host for multi-worker serving")
+    ap.add_argument("--addr", default=os.getenv("MUSEUM_HOST") or default_addr(8080),
+                    help="unix:/path.sock or tcp:127.0.0.1:PORT")
+    args = ap.parse_args()
+    asyncio.run(serve(args.addr))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,387 @@
+# server/ipc.py
+"""
+本机进程间调用：多进程模式下 worker 通过它调用共享 host（host.py）里的 Agent / Piper / Vosk。
+一个 worker 一条长连接（Unix 域套接字；Windows 上用 127.0.0.1 的 TCP），所有调用在上面多路复用。
+帧 = 帧头（负载字节数、调用号、类型、JSON 头字节数）+ JSON 头 + 可选的二进制负载（音频不进 JSON）。
+- call：一问一答；stream：一问多答（ITEM ... END），worker 放弃时发 CANCEL，host 取消对应的任务
+- host 处理时记录的阶段耗时（metrics.record）随应答带回，worker 并进当前请求的 Server-Timing
+- 连接断开：host 取消这条连接上的所有任务并释放绑定的资源；worker 这边进行中的调用抛 HostUnavailable，
+  下一次调用自动重连
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import os
+import socket
+import struct
+import tempfile
+from pathlib import Path
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+import metrics
+
+# 帧头：负载字节数、调用号、类型、JSON 头字节数
+_HEAD = struct.Struct("<IIBI")
+MAX_FRAME = 64 * 1024 * 1024
+# 连 host 的超时（秒）
+CONNECT_TIMEOUT_S = float(os.getenv("MUSEUM_HOST_CONNECT_TIMEOUT_S", "2"))
+
+CALL, STREAM, ITEM, END, ERROR, CANCEL = range(1, 7)
+
+_END = object()
+
+
+class HostUnavailable(ConnectionError):
+    """连不上 host，或者调用进行中连接断了"""
+
+
+class RemoteError(RuntimeError):
+    """host 端抛出的异常：type 为原异常类名，extra 为它的简单属性（比如 NotReady 的 component）"""
+
+    def __init__(self, type_: str, message: str, extra: Optional[dict] = None):
+        super().__init__(f"{type_}: {message}")
+        self.type = type_
+        self.message = message
+        self.extra = extra or {}
+
+
+def parse_addr(addr: str) -> tuple[str, Any]:
+    # "unix:/tmp/museum-host-8080.sock" 或 "tcp:127.0.0.1:8180"
+    kind, _, rest = addr.strip().partition(":")
+    if kind == "unix" and rest:
+        return "unix", rest
+    if kind == "tcp":
+        host, _, port = rest.rpartition(":")
+        if host and port.isdigit():
+            return "tcp", (host, int(port))
+    raise ValueError(f"bad host address {addr!r} (expected unix:/path.sock or tcp:127.0.0.1:PORT)")
+
+
+def default_addr(port: int) -> str:
+    # 按服务端口区分，同一台机器上可以跑多套
+    if os.name == "nt" or not hasattr(socket, "AF_UNIX"):
+        return f"tcp:127.0.0.1:{port + 100}"
+    return f"unix:{Path(tempfile.gettempdir()) / f'museum-host-{port}.sock'}"
+
+
+def probe(addr: str, timeout_s: float = 0.5) -> bool:
+    """同步探测 host 是否已在监听（serve.py 等 host 起来时用）"""
+    kind, target = parse_addr(addr)
+    family = socket.AF_UNIX if kind == "unix" else socket.AF_INET
+    with socket.socket(family, socket.SOCK_STREAM) as s:
+        s.settimeout(timeout_s)
+        try:
+            s.connect(target)
+            return True
+        except OSError:
+            return False
+
+
+def _pack(cid: int, kind: int, head: dict, blob: bytes = b"") -> bytes:
+    h = json.dumps(head, ensure_ascii=False, separators=(",", ":")).encode("utf-8") if head else b""
+    return _HEAD.pack(len(h) + len(blob), cid, kind, len(h)) + h + blob
+
+
+async def _read(reader: asyncio.StreamReader) -> tuple[int, int, dict, bytes]:
+    n, cid, kind, hlen = _HEAD.unpack(await reader.readexactly(_HEAD.size))
+    if n > MAX_FRAME or hlen > n:
+        raise ConnectionError(f"bad frame ({n} bytes, head {hlen})")
+    data = await reader.readexactly(n) if n else b""
+    return cid, kind, json.loads(data[:hlen]) if hlen else {}, data[hlen:]
+
+
+def _encode(value: Any) -> tuple[dict, bytes]:
+    # bytes 放二进制负载，其余走 JSON
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {"b": 1}, bytes(value)
+    return ({"v": value} if value is not None else {}), b""
+
+
+def _decode(head: dict, blob: bytes) -> Any:
+    return blob if head.get("b") else head.get("v")
+
+
+def _error_head(e: BaseException) -> dict:
+    extra = {k: v for k, v in vars(e).items() if isinstance(v, (str, int, float, bool)) or v is None}
+    return {"e": e.__class__.__name__, "msg": str(e), "x": extra}
+
+
+class Conn:
+    """host 侧的一条 worker 连接；resources 放和连接绑定、带 close() 的对象（比如 ASR 会话），断开时统一关掉"""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.tasks: dict[int, asyncio.Task] = {}
+        self.resources: dict = {}
+        self._drain = asyncio.Lock()
+
+    async def send(self, cid: int, kind: int, head: dict, blob: bytes = b"") -> None:
+        self.writer.write(_pack(cid, kind, head, blob))
+        async with self._drain:
+            await self.writer.drain()
+
+    def close(self) -> None:
+        for t in self.tasks.values():
+            t.cancel()
+        resources, self.resources = self.resources, {}
+        for r in resources.values():
+            try:
+                r.close()
+            except Exception as e:
+                print(f"[IPC] closing {r!r} failed: {e!r}")
+        self.writer.close()
+
+
+class RpcServer:
+    """
+    host 侧：注册方法，每个调用一个任务。
+    方法签名 fn(conn, *args)：call 返回结果（JSON 可表示的值或 bytes），stream 返回异步迭代器
+    """
+
+    def __init__(self):
+        self.calls: dict[str, Callable[..., Awaitable[Any]]] = {}
+        self.streams: dict[str, Callable[..., Awaitable[AsyncIterator]]] = {}
+        self.connections = 0
+
+    def call(self, name: str):
+        def register(fn):
+            self.calls[name] = fn
+            return fn
+        return register
+
+    def stream(self, name: str):
+        def register(fn):
+            self.streams[name] = fn
+            return fn
+        return register
+
+    async def start(self, addr: str) -> asyncio.AbstractServer:
+        kind, target = parse_addr(addr)
+        if kind == "unix":
+            # 上次异常退出留下的套接字文件
+            try:
+                os.unlink(target)
+            except FileNotFoundError:
+                pass
+            return await asyncio.start_unix_server(self._serve, path=target)
+        return await asyncio.start_server(self._serve, *target)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        conn = Conn(writer)
+        self.connections += 1
+        try:
+            while True:
+                try:
+                    cid, kind, head, blob = await _read(reader)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if kind == CANCEL:
+                    task = conn.tasks.get(cid)
+                    if task is not None:
+                        task.cancel()
+                elif kind in (CALL, STREAM):
+                    args = list(head.get("a") or ())
+                    if head.get("b"):
+                        args.append(blob)
+                    conn.tasks[cid] = asyncio.create_task(self._run(conn, cid, kind, head.get("m"), args))
+        finally:
+            self.connections -= 1
+            conn.close()
+
+    async def _run(self, conn: Conn, cid: int, kind: int, method: str, args: list) -> None:
+        with metrics.collect() as timings:
+            sent = 0
+
+            def with_timings(head: dict) -> dict:
+                # 上一帧之后新记录的阶段耗时
+                nonlocal sent
+                if len(timings) > sent:
+                    head["t"] = timings[sent:]
+                    sent = len(timings)
+                return head
+
+            try:
+                if kind == CALL:
+                    fn = self.calls.get(method)
+                    if fn is None:
+                        raise LookupError(f"unknown method {method!r}")
+                    head, blob = _encode(await fn(conn, *args))
+                    await conn.send(cid, END, with_timings(head), blob)
+                    return
+                fn = self.streams.get(method)
+                if fn is None:
+                    raise LookupError(f"unknown stream {method!r}")
+                gen = await fn(conn, *args)
+                try:
+                    async for item in gen:
+                        head, blob = _encode(item)
+                        await conn.send(cid, ITEM, with_timings(head), blob)
+                finally:
+                    await gen.aclose()
+                await conn.send(cid, END, with_timings({}))
+            except asyncio.CancelledError:
+                # worker 放弃了（CANCEL）或者连接断了
+                pass
+            except Exception as e:
+                try:
+                    await conn.send(cid, ERROR, with_timings(_error_head(e)))
+                except Exception:
+                    pass
+            finally:
+                conn.tasks.pop(cid, None)
+
+
+class RpcClient:
+    """worker 侧：一条连接，调用按调用号分发；第一次调用时连上，断开后下一次调用重连"""
+
+    def __init__(self, addr: str, connect_timeout_s: float = CONNECT_TIMEOUT_S):
+        parse_addr(addr)
+        self.addr = addr
+        self.connect_timeout_s = connect_timeout_s
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._pending: dict[int, asyncio.Future | asyncio.Queue] = {}
+        self._ids = itertools.count(1)
+        self._connect_lock = asyncio.Lock()
+        self._drain = asyncio.Lock()
+        # 连接断开时置位（worker 的后台任务据此立刻刷新组件状态）
+        self.lost = asyncio.Event()
+        self.connects = 0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    def _error(self, e: Exception) -> Exception:
+        # 子类把 host 端的异常还原成本地异常
+        return e
+
+    async def _connect(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return self._writer
+            kind, target = parse_addr(self.addr)
+            try:
+                if kind == "unix":
+                    conn = asyncio.open_unix_connection(target)
+                else:
+                    conn = asyncio.open_connection(*target)
+                reader, writer = await asyncio.wait_for(conn, self.connect_timeout_s)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise HostUnavailable(f"cannot reach host at {self.addr}: {e!r}") from None
+            self._writer = writer
+            self.connects += 1
+            self.lost.clear()
+            self._reader_task = asyncio.create_task(self._read_loop(reader, writer))
+            return writer
+
+    async def _read_loop(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                cid, kind, head, blob = await _read(reader)
+                waiter = self._pending.get(cid)
+                if waiter is None:
+                    continue
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait((kind, head, blob))
+                elif not waiter.done():
+                    self._pending.pop(cid, None)
+                    waiter.set_result((kind, head, blob))
+        except (asyncio.IncompleteReadError, ConnectionError, OSError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+            self.lost.set()
+            pending, self._pending = self._pending, {}
+            for waiter in pending.values():
+                err = HostUnavailable(f"connection to host at {self.addr} lost")
+                if isinstance(waiter, asyncio.Queue):
+                    waiter.put_nowait(err)
+                elif not waiter.done():
+                    waiter.set_exception(err)
+
+    async def _send(self, frame: bytes) -> None:
+        writer = await self._connect()
+        writer.write(frame)
+        async with self._drain:
+            await writer.drain()
+
+    def _unpack(self, kind: int, head: dict, blob: bytes) -> Any:
+        # 在调用方的上下文里把 host 的阶段耗时并进当前请求
+        metrics.add_timings(head.get("t") or ())
+        if kind == ERROR:
+            raise self._error(RemoteError(head.get("e", "Exception"), head.get("msg", ""), head.get("x")))
+        if kind == END and "v" not in head and not head.get("b"):
+            return _END
+        return _decode(head, blob)
+
+    async def call(self, method: str, *args: Any, data: Optional[bytes] = None) -> Any:
+        """一问一答；data 作为最后一个参数以二进制传过去"""
+        cid = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[cid] = fut
+        head = {"m": method, "a": list(args)}
+        if data is not None:
+            head["b"] = 1
+        try:
+            await self._send(_pack(cid, CALL, head, data or b""))
+            kind, head, blob = await fut
+        except HostUnavailable as e:
+            raise self._error(e) from None
+        finally:
+            self._pending.pop(cid, None)
+        value = self._unpack(kind, head, blob)
+        return None if value is _END else value
+
+    def notify(self, method: str, *args: Any) -> None:
+        """不等结果的调用（比如释放资源）；没连上就不发，host 会在连接断开时自己清理"""
+        writer = self._writer
+        if writer is not None:
+            writer.write(_pack(next(self._ids), CALL, {"m": method, "a": list(args)}))
+
+    async def open_stream(self, method: str, *args: Any) -> AsyncIterator:
+        """
+        一问多答：等到第一项（或错误）才返回，host 端一开始就失败时调用方还能返回 HTTP 错误；
+        提前关掉返回的迭代器会通知 host 取消
+        """
+        cid = next(self._ids)
+        q: asyncio.Queue = asyncio.Queue()
+        self._pending[cid] = q
+        try:
+            await self._send(_pack(cid, STREAM, {"m": method, "a": list(args)}))
+            first = await self._next(q)
+        except BaseException:
+            self._cancel(cid)
+            raise
+        return self._iter(cid, q, first)
+
+    async def _next(self, q: asyncio.Queue) -> Any:
+        item = await q.get()
+        if isinstance(item, Exception):
+            raise self._error(item)
+        return self._unpack(*item)
+
+    async def _iter(self, cid: int, q: asyncio.Queue, item: Any) -> AsyncIterator:
+        try:
+            while item is not _END:
+                yield item
+                item = await self._next(q)
+        finally:
+            if item is not _END:
+                self._cancel(cid)
+            self._pending.pop(cid, None)
+
+    def _cancel(self, cid: int) -> None:
+        if self._pending.pop(cid, None) is not None and self._writer is not None:
+            self._writer.write(_pack(cid, CANCEL, {}))
+
+    async def aclose(self) -> None:
+        writer, self._writer = self._writer, None
+        if writer is not None:
+            writer.close()
+        if self._reader_task is not None:
+            self._reader_task.cancel()
@@ -0,0 +1,161 @@
+# server/llm_client.py
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from metrics import PROMPT_TOKENS, record, timed_stream
+
+# 同时发往上游（Ollama / OpenAI）的请求数上限，超出的在本地排队
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+# 连接池大小（保持长连接复用）
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "32"))
+# 建连接超时；流式时两段数据之间的最长间隔；整个请求（含排队）的最长时间
+LLM_CONNECT_TIMEOUT_S = float(os.getenv("LLM_CONNECT_TIMEOUT_S", "5"))
+LLM_READ_TIMEOUT_S = float(os.getenv("LLM_READ_TIMEOUT_S", "120"))
+LLM_REQUEST_TIMEOUT_S = float(os.getenv("LLM_REQUEST_TIMEOUT_S", "300"))
+# Ollama 模型在最后一次请求后常驻内存多久（"30m"、"-1" 永久、"0" 用完即卸载）
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+
+
+def http_limits(pool_size: int = LLM_POOL_SIZE) -> httpx.Limits:
+    return httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size,
+                        keepalive_expiry=60.0)
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(connect=LLM_CONNECT_TIMEOUT_S, read=LLM_READ_TIMEOUT_S,
+                         write=LLM_CONNECT_TIMEOUT_S, pool=LLM_REQUEST_TIMEOUT_S)
+
+
+class UpstreamLimiter:
+    """并发上限 + 排队/在途计数，超时从进入排队算起"""
+
+    def __init__(self, limit: int = LLM_MAX_CONCURRENCY):
+        self.limit = max(1, limit)
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.total = 0
+
+    async def __aenter__(self) -> "UpstreamLimiter":
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.limit)
+        self.waiting += 1
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        self.total += 1
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.in_flight -= 1
+        self._sem.release()
+
+    def stats(self) -> dict:
+        return {"limit": self.limit, "in_flight": self.in_flight, "waiting": self.waiting, "total": self.total}
+
+
+class OllamaClient:
+    """
+    Ollama /api/generate 的异步客户端：共享一个 httpx.AsyncClient（长连接池），
+    并发受 UpstreamLimiter 限制，请求里带 keep_alive 让模型常驻。
+    """
+
+    def __init__(self, url: str, keep_alive: str = OLLAMA_KEEP_ALIVE,
+                 max_concurrency: int = LLM_MAX_CONCURRENCY, request_timeout_s: float = LLM_REQUEST_TIMEOUT_S):
+        self.url = url
+        self.keep_alive = keep_alive
+        self.request_timeout_s = request_timeout_s
+        self.limiter = UpstreamLimiter(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # 第一次用时在当前事件循环里创建
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(limits=http_limits(), timeout=http_timeout())
+        return self._client
+
+    def with_keep_alive(self, payload: dict) -> dict:
+        if self.keep_alive and "keep_alive" not in payload:
+            payload = {**payload, "keep_alive": self.keep_alive}
+        return payload
+
+    @staticmethod
+    def _on_done(data: dict, meta: Optional[dict]) -> None:
+        # 最后一行带统计：prompt_eval_count 是这次实际算的 prompt token（复用 KV 的前缀不算），
+        # context 是续接下一轮用的 token 序列
+        evaluated = data.get("prompt_eval_count")
+        if evaluated is not None:
+            PROMPT_TOKENS.observe(evaluated, "evaluated")
+        if data.get("prompt_eval_duration") is not None:
+            record("llm_prompt_eval", data["prompt_eval_duration"] / 1e9)
+        if meta is not None:
+            meta["context"] = data.get("context")
+            meta["prompt_eval_count"] = evaluated or 0
+
+    async def generate(self, payload: dict, meta: Optional[dict] = None) -> str:
+        async def _call() -> str:
+            async with self.limiter:
+                resp = await self.client.post(self.url, json=self.with_keep_alive({**payload, "stream": False}))
+                resp.raise_for_status()
+                data = resp.json()
+            if data.get("error"):
+                raise RuntimeError(f"Ollama error: {data['error']}")
+            self._on_done(data, meta)
+            return (data.get("response") or "").strip()
+
+        t0 = time.perf_counter()
+        answer = await asyncio.wait_for(_call(), timeout=self.request_timeout_s)
+        record("llm_total", time.perf_counter() - t0)
+        return answer
+
+    def stream(self, payload: dict, meta: Optional[dict] = None) -> AsyncIterator[str]:
+        # meta 不为 None 时，流正常结束后填入 context / prompt_eval_count
+        return timed_stream(self._stream(payload, meta), "llm_ttft", "llm_total")
+
+    async def _stream(self, payload: dict, meta: Optional[dict] = None) -> AsyncIterator[str]:
+        # Ollama 流式：每行一个 JSON，response 为增量文本，done=true 结束
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.request_timeout_s
+        async with self.limiter:
+            async with self.client.stream("POST", self.url,
+                                          json=self.with_keep_alive({**payload, "stream": True})) as resp:
+                resp.raise_for_status()
+                async for line in resp.aiter_lines():
+                    if loop.time() > deadline:
+                        raise TimeoutError(f"Ollama stream exceeded {self.request_timeout_s:.0f}s")
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise RuntimeError(f"Ollama error: {data['error']}")
+                    piece = data.get("response") or ""
+                    if piece:
+                        yield piece
+                    if data.get("done"):
+                        self._on_done(data, meta)
+                        break
+
+    async def preload(self, model: str) -> None:
+        # 空 prompt 的 generate 只加载模型，不生成
+        async with self.limiter:
+            payload = {"model": model, "prompt": "", "stream": False}
+            resp = await self.client.post(self.url, json=self.with_keep_alive(payload))
+            resp.raise_for_status()
+
+    async def aclose(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> dict:
+        return {"url": self.url, "keep_alive": self.keep_alive, **self.limiter.stats()}
@@ -1,24 +1,51 @@
 # server/main.py
 from __future__ import annotations
 
+import asyncio
+import inspect
 import json
+import os
 import time
 import struct
+import uuid
 from pathlib import Path
 from typing import Optional
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Response, HTTPException
+# 最先导入：以它的导入时刻作为进程启动时间，统计多久开始监听
+from readiness import NotReady, readiness
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Body, Request, Response, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 
-from tts_piper import piper_tts
-from stt_vosk import create_recognizer
+from admission import Overloaded, admission
+from audio_codec import AudioCodec, negotiate
+from metrics import TimingMiddleware, render as render_metrics
+from sessions import normalize_session_id
+from tts_pipeline import pipeline_pcm, prime_stream, split_sentences
 
 import traceback
 
-from agent_factory import create_agent
-AGENT = create_agent()   # 读取 AGENT_KIND，默认 openai；
+from agent_base import AgentInterface
+
+# 多进程模式（serve.py --workers N）：Agent / Piper / Vosk 都在共享 host 进程里，这里换成调用它的代理
+SHARED_HOST = os.getenv("MUSEUM_HOST", "").strip()
+if SHARED_HOST:
+    from remote import HostClient, RemoteAgent, RemoteAsrPool, RemotePiper, follow_host
+    from remote import render_metrics as render_shared
+    host = HostClient(SHARED_HOST)
+    piper_tts = RemotePiper(host)
+    asr_pool = RemoteAsrPool(host)
+else:
+    from tts_piper import piper_tts
+    from asr_workers import asr_pool
+    from boot import add_components, warm_up
+    host = None
+
+# 读取 AGENT_KIND，默认 openai；在启动后的后台任务里创建（RAG 要加载向量模型和 Chroma，很慢）
+AGENT: Optional[AgentInterface] = None
+_warmup_task: Optional[asyncio.Task] = None
 
 app = FastAPI()
 
@@ -29,7 +56,10 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+# 各阶段耗时：写进 Server-Timing 响应头，并汇总到 /metrics
+app.add_middleware(TimingMiddleware)
 
 # 静态托管
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -40,17 +70,176 @@ if not CLIENT_DIR.exists():
 app.mount("/client", StaticFiles(directory=str(CLIENT_DIR), html=False), name="client")
 
 
+# 排队已满：快速返回 503，客户端按 Retry-After 重试
+@app.exception_handler(Overloaded)
+async def on_overloaded(request, exc: Overloaded):
+    return JSONResponse({"detail": str(exc)}, status_code=503,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+# 组件还没加载好：返回 503，客户端按 Retry-After 重试
+@app.exception_handler(NotReady)
+async def on_not_ready(request, exc: NotReady):
+    return JSONResponse({"detail": str(exc), "component": exc.component, "state": exc.state}, status_code=503,
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+def _agent() -> AgentInterface:
+    readiness.require("agent")
+    return AGENT
+
+
+async def _resolve(value):
+    # 多进程模式下代理的统计接口返回协程
+    return await value if inspect.isawaitable(value) else value
+
+
+def _flight_text(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _exhibit(payload: dict) -> Optional[str]:
+    # 展区范围（知识库文档目录，如 "asia/guanyin"）；不传用服务端 RAG_EXHIBIT，"*" 为全馆
+    return (payload.get("exhibit") or "").strip() or None
+
+
+def _session_id(payload: dict) -> Optional[str]:
+    # 多轮会话 id（同一访客的连续提问，客户端生成）；不传则每轮独立
+    try:
+        return normalize_session_id(payload.get("session_id"))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _stream_codec(payload: dict, voice: Optional[str], accept: Optional[str] = None) -> AudioCodec:
+    # 流式音频格式：请求体 "format"（pcm / mulaw / adpcm）优先，其次 Accept 头，默认 TTS_STREAM_FORMAT；
+    # 采样率是语音模型的原始采样率（Piper 不重采样）
+    try:
+        rate = await piper_tts.sample_rate(voice)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    try:
+        return negotiate((payload.get("format") or "").strip() or None, accept, sample_rate=rate, chunk_ms=20)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _agent_answer(text: str, system: Optional[str], exhibit: Optional[str] = None,
+                        session_id: Optional[str] = None) -> str:
+    # 相同问题正在生成时共享同一次 LLM 调用（同一会话内；不同会话的上文不同）
+    async def run() -> str:
+        async with admission.llm.slot():
+            return await _agent().reply_async(text, system_prompt=system, exhibit=exhibit, session_id=session_id)
+    return await admission.flights.do(("reply", _flight_text(text), system, exhibit, session_id), run)
+
+
+async def _synth_wav(text: str, voice: Optional[str]) -> bytes:
+    async def run() -> bytes:
+        async with admission.tts.slot():
+            return await piper_tts.synth(text=text, model_path=voice)
+    return await admission.flights.do(("wav", _flight_text(text), voice), run)
+
+
+def _set_agent(agent: AgentInterface) -> None:
+    global AGENT
+    AGENT = agent
+
+
+@app.on_event("startup")
+async def on_startup():
+    # uvicorn 等 startup 返回后才开始监听：这里只登记组件、起后台任务，不做任何加载
+    global _warmup_task, AGENT
+    if host is not None:
+        # 组件在 host 里加载，状态由后台任务从 host 照抄过来
+        readiness.add("host")
+        AGENT = RemoteAgent(host)
+        _warmup_task = asyncio.create_task(follow_host(host, readiness))
+        print(f"[BOOT] worker {os.getpid()} listening after {readiness.mark_listening():.2f}s, "
+              f"shared host at {SHARED_HOST}")
+        return
+    add_components()
+    _warmup_task = asyncio.create_task(warm_up(_set_agent))
+    print(f"[BOOT] listening after {readiness.mark_listening():.2f}s, warming up in background")
+
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+    await piper_tts.close()
+    if AGENT is not None:
+        await AGENT.aclose()
+    asr_pool.shutdown()
+    if host is not None:
+        await host.aclose()
+
+
 @app.get("/", response_class=FileResponse)
 async def index():
     return FileResponse(CLIENT_DIR / "index.html")
 
 
-# 探活
+# 存活探针：进程在、事件循环能响应即可，不看组件是否加载完
 @app.get("/health", response_class=PlainTextResponse)
 async def health():
     return "ok"
 
 
+# 就绪探针：各组件（agent / embedder / vector_store / llm / piper / vosk）的加载状态和耗时，
+# 必需组件都就绪返回 200，否则 503
+@app.get("/ready")
+async def ready():
+    return JSONResponse(readiness.stats(), status_code=200 if readiness.ready else 503)
+
+
+# Prometheus 指标：各阶段耗时、prompt 大小、ASR 解码实时率、HTTP 响应头耗时
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # 多进程模式下为所有 worker 和 host 的汇总
+    text = await render_shared(host) if host is not None else render_metrics()
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+
+# Piper 进程池状态
+@app.get("/tts/pool")
+async def tts_pool_stats():
+    return await _resolve(piper_tts.pool.stats())
+
+
+# ASR 解码线程负载
+@app.get("/asr/workers")
+async def asr_worker_stats():
+    return await _resolve(asr_pool.stats())
+
+
+# TTS 缓存命中统计
+@app.get("/tts/cache")
+async def tts_cache_stats():
+    return await _resolve(piper_tts.cache.stats())
+
+
+# 准入队列：各阶段排队深度、等待时间、拒绝数，单飞合并次数
+@app.get("/agent/queue")
+async def agent_queue_stats():
+    return admission.stats()
+
+
+# 多轮会话：数量、保留的轮数、续接 context 占用
+@app.get("/agent/sessions")
+async def agent_sessions_stats():
+    sessions = getattr(_agent(), "sessions", None)
+    stats = await _resolve(sessions.stats()) if sessions is not None else None
+    if stats is None:
+        raise HTTPException(status_code=404, detail="agent has no sessions")
+    return stats
+
+
+# 访客离开（前端“新对话”）：丢掉会话，下一句从头开始
+@app.delete("/agent/sessions/{session_id}")
+async def agent_session_end(session_id: str):
+    return {"ended": await _agent().end_session(session_id)}
+
+
 # WebSocket Echo
 @app.websocket("/ws/echo")
 async def ws_echo(ws: WebSocket):
@@ -65,13 +254,25 @@ async def ws_echo(ws: WebSocket):
         print("[WS] echo disconnected")
 
 
+async def _ws_require(ws: WebSocket, *names: str) -> bool:
+    # WebSocket 没法回 503：发一条 error（带 retryAfter）后以 1013 (Try Again Later) 关闭
+    try:
+        readiness.require(*names)
+        return True
+    except NotReady as e:
+        await ws.send_text(json.dumps({"type": "error", "detail": str(e), "retryAfter": e.retry_after}))
+        await ws.close(code=1013)
+        return False
+
+
 # ASR WebSocket（Vosk，本地识别）
 @app.websocket("/ws/asr")
 async def ws_asr(ws: WebSocket):
     await ws.accept()
     print("[WS] asr connected")
 
-    recognizer = None
+    # 解码放在分片工作线程里，不阻塞事件循环
+    session = None
     last_partial: Optional[str] = None
 
     # 吞吐统计
@@ -96,60 +297,231 @@ async def ws_asr(ws: WebSocket):
 
                 t = data.get("type")
                 if t == "start":
+                    if not await _ws_require(ws, "vosk"):
+                        break
                     sr = int(data.get("sampleRate") or 16000)
-                    recognizer = create_recognizer(sr)
+                    if session is not None:
+                        session.close()
+                    session = asr_pool.session(sr)
+                    await session.start()
                     last_partial = None
                     await ws.send_text(json.dumps({"type": "ack", "sampleRate": sr}))
                     print(f"[ASR] start, sampleRate={sr}")
 
                 elif t == "stop":
-                    if recognizer is not None:
-                        final_json = recognizer.FinalResult()
-                        try:
-                            final_data = json.loads(final_json or "{}")
-                            text = (final_data.get("text") or "").strip()
-                        except Exception:
-                            text = ""
+                    if session is not None:
+                        text = await session.finish()
                         if text:
                             await ws.send_text(json.dumps({"type": "final", "text": text}))
                             print("[ASR] final:", text)
-                    recognizer = None
+                        session.close()
+                    session = None
                     last_partial = None
                 continue
 
             # 音频帧
-            if msg.get("bytes") is not None and recognizer is not None:
+            if msg.get("bytes") is not None and session is not None:
                 chunk = msg["bytes"]
                 bytes_in_window += len(chunk)
 
-                ok = recognizer.AcceptWaveform(chunk)
-                if ok:
-                    res = recognizer.Result()
-                    try:
-                        obj = json.loads(res or "{}")
-                        text = (obj.get("text") or "").strip()
-                    except Exception:
-                        text = ""
+                res = await session.feed(chunk)
+                if res is None:
+                    continue
+                kind, text = res
+                if kind == "final":
                     if text:
                         await ws.send_text(json.dumps({"type": "final", "text": text}))
                         print("[ASR] final:", text)
                     last_partial = None
                 else:
-                    part = recognizer.PartialResult()
-                    try:
-                        obj = json.loads(part or "{}")
-                        ptxt = (obj.get("partial") or "").strip()
-                    except Exception:
-                        ptxt = ""
+                    ptxt = text
                     if ptxt and ptxt != last_partial:
                         last_partial = ptxt
                         await ws.send_text(json.dumps({"type": "partial", "text": ptxt}))
     except WebSocketDisconnect:
         print("[WS] asr disconnected (exception)")
     finally:
+        if session is not None:
+            session.close()
         print("[WS] asr closed")
 
 
+# 全双工对话：一条 WebSocket 上行麦克风 PCM，下行识别结果 + 回答音频
+# 客户端 -> 服务端：{"type":"start","sampleRate":16000,"voice":"...","system":"...","exhibit":"...","session_id":"..."} /
+#                 {"type":"stop"} / 二进制 PCM；不给 session_id 时整条连接算一个会话，断开即丢弃
+# 服务端 -> 客户端：ack / partial / final / reply_start / reply_text / reply_end / barge_in / error（JSON），
+#                 回答音频为二进制 20ms 定长块，格式按 start 里的 "format"（默认 s16le 单声道，采样率同语音模型，见 ack 的 mediaType）
+CONVERSE_BARGE_IN = os.getenv("CONVERSE_BARGE_IN", "1").lower() in ("1", "true", "yes", "on")
+
+
+@app.websocket("/ws/converse")
+async def ws_converse(ws: WebSocket):
+    await ws.accept()
+    print("[WS] converse connected")
+
+    session = None
+    last_partial: Optional[str] = None
+    voice: Optional[str] = None
+    system: Optional[str] = None
+    exhibit: Optional[str] = None
+    # 连接自带的会话 id，断开时丢掉；客户端给了 session_id 就用客户端的（可以跨连接续上）
+    own_session = f"ws-{uuid.uuid4().hex}"
+    session_id = own_session
+    codec: Optional[AudioCodec] = None
+    turn_task: Optional[asyncio.Task] = None
+    turn_no = 0
+    playback_until = 0.0
+    send_lock = asyncio.Lock()
+
+    async def send_json(obj: dict) -> None:
+        async with send_lock:
+            await ws.send_text(json.dumps(obj))
+
+    async def send_bytes(data: bytes) -> None:
+        async with send_lock:
+            await ws.send_bytes(data)
+
+    async def run_turn(text: str, turn: int) -> None:
+        # 识别出的一句话 -> Agent 流式生成 -> 断句 -> Piper 流式合成，音频直接从这条 socket 发回
+        nonlocal playback_until
+
+        async def tap(sentences):
+            # 每句文本先发给前端显示，再送去合成
+            async for s in sentences:
+                await send_json({"type": "reply_text", "turn": turn, "text": s})
+                yield s
+
+        tokens = admission.llm.guard(_agent().stream_reply(text, system_prompt=system, exhibit=exhibit,
+                                                           session_id=session_id))
+        gen = admission.tts.guard(pipeline_pcm(tap(split_sentences(tokens)), piper_tts, model_path=voice,
+                                               codec=codec))
+        loop = asyncio.get_running_loop()
+        try:
+            await send_json({"type": "reply_start", "turn": turn})
+            async for chunk in gen:
+                await send_bytes(chunk)
+                # 音频比实时快地发出去，前端播放要晚于发送结束；按时长估算播放结束时刻
+                playback_until = max(playback_until, loop.time()) + len(chunk) / codec.bytes_per_s
+            await send_json({"type": "reply_end", "turn": turn})
+        except asyncio.CancelledError:
+            raise
+        except Overloaded as e:
+            await send_json({"type": "error", "turn": turn, "detail": str(e), "retryAfter": e.retry_after})
+        except Exception as e:
+            print(f"[WS] converse turn {turn} failed: {e!r}")
+            await send_json({"type": "error", "turn": turn, "detail": f"Agent/TTS error: {e}"})
+        finally:
+            # 被打断时关掉生成器：取消句子合成、断开 LLM 流，释放准入名额
+            await gen.aclose()
+
+    def replying() -> bool:
+        # 还在生成，或者前端还在播放已发出的音频
+        running = turn_task is not None and not turn_task.done()
+        return running or asyncio.get_running_loop().time() < playback_until
+
+    async def cancel_turn(reason: str) -> None:
+        nonlocal turn_task, playback_until
+        if not replying():
+            return
+        task, turn_task = turn_task, None
+        playback_until = 0.0
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        print(f"[WS] converse turn {turn_no} cancelled ({reason})")
+        # 通知前端清空播放缓冲
+        await send_json({"type": "barge_in", "turn": turn_no})
+
+    async def on_final(text: str) -> None:
+        nonlocal turn_task, turn_no, last_partial
+        last_partial = None
+        if not text:
+            return
+        await send_json({"type": "final", "text": text})
+        print("[ASR] final:", text)
+        await cancel_turn("new question")
+        turn_no += 1
+        turn_task = asyncio.create_task(run_turn(text, turn_no))
+
+    try:
+        while True:
+            msg = await ws.receive()
+
+            if msg.get("type") == "websocket.disconnect":
+                print(f"[WS] converse disconnected code={msg.get('code')}")
+                break
+
+            if msg.get("text") is not None:
+                try:
+                    data = json.loads(msg["text"])
+                except json.JSONDecodeError:
+                    print("[ASR] invalid text:", msg["text"])
+                    continue
+
+                t = data.get("type")
+                if t == "start":
+                    if not await _ws_require(ws, "vosk", "agent", "piper"):
+                        break
+                    sr = int(data.get("sampleRate") or 16000)
+                    voice = (data.get("voice") or "").strip() or None
+                    system = (data.get("system") or "").strip() or None
+                    exhibit = _exhibit(data)
+                    try:
+                        codec = negotiate((data.get("format") or "").strip() or None,
+                                          sample_rate=await piper_tts.sample_rate(voice), chunk_ms=20)
+                        session_id = normalize_session_id(data.get("session_id")) or own_session
+                    except (ValueError, FileNotFoundError) as e:
+                        await send_json({"type": "error", "detail": str(e)})
+                        continue
+                    if session is not None:
+                        session.close()
+                    session = asr_pool.session(sr)
+                    await session.start()
+                    last_partial = None
+                    await send_json({"type": "ack", "sampleRate": sr, "format": codec.name,
+                                     "mediaType": codec.media_type})
+                    print(f"[ASR] converse start, sampleRate={sr}")
+                elif t == "stop":
+                    if session is not None:
+                        text = await session.finish()
+                        session.close()
+                        session = None
+                        await on_final(text)
+                elif t == "cancel":
+                    await cancel_turn("client")
+                continue
+
+            if msg.get("bytes") is not None and session is not None:
+                res = await session.feed(msg["bytes"])
+                if res is None:
+                    continue
+                kind, text = res
+                if kind == "final":
+                    await on_final(text)
+                elif text and text != last_partial:
+                    last_partial = text
+                    # 访客又开口了：立刻停掉正在生成/播放的回答
+                    if CONVERSE_BARGE_IN and replying():
+                        await cancel_turn("barge-in")
+                    await send_json({"type": "partial", "text": text})
+    except WebSocketDisconnect:
+        print("[WS] converse disconnected (exception)")
+    finally:
+        if turn_task is not None and not turn_task.done():
+            turn_task.cancel()
+        if session is not None:
+            session.close()
+        if AGENT is not None:
+            try:
+                await AGENT.end_session(own_session)
+            except Exception as e:
+                print(f"[WS] converse end_session failed: {e!r}")
+        print("[WS] converse closed")
+
+
 # TTS（Piper，本地合成整段 WAV）
 @app.post("/tts")
 async def tts_endpoint(payload: dict = Body(...)):
@@ -157,26 +529,44 @@ async def tts_endpoint(payload: dict = Body(...)):
     voice = (payload.get("voice") or "").strip() or None
     if not text:
         return Response(content=b"", media_type="audio/wav")
+    readiness.require("piper")
 
     try:
-        wav_bytes = piper_tts.synth(text=text, model_path=voice)
+        wav_bytes = await _synth_wav(text, voice)
         return Response(content=wav_bytes, media_type="audio/wav")
+    except Overloaded:
+        raise
     except Exception as e:
         err = f"[TTS] error: {e}".encode("utf-8")
         return Response(content=err, media_type="text/plain", status_code=500)
 
 
+# 知识库索引状态（仅 RAG 模式）
+@app.get("/rag/status")
+async def rag_status():
+    status = getattr(_agent(), "index_status", None)
+    result = await _resolve(status()) if status is not None else None
+    if result is None:
+        raise HTTPException(status_code=404, detail="agent has no knowledge base")
+    return result
+
+
 # Agent 文本回复（纯文本）
 @app.post("/agent/reply")
 async def agent_reply(payload: dict = Body(...)):
     text = (payload.get("text") or "").strip()
     system = (payload.get("system") or "").strip() or None
+    exhibit = _exhibit(payload)
+    session_id = _session_id(payload)
     if not text:
         return {"reply": ""}
+    readiness.require("agent")
 
     try:
         # 使用AGENT(默认是 OpenAIAdapter，内部仍然调用 chat_once）
-        reply = await AGENT.reply_async(text, system_prompt=system)
+        reply = await _agent_answer(text, system, exhibit, session_id)
+    except Overloaded:
+        raise
     except Exception as e:
         reply = f"[agent error] {e!r}"
 
@@ -189,14 +579,19 @@ async def agent_tts(payload: dict = Body(...)):
     user_text = (payload.get("text") or "").strip()
     system = (payload.get("system") or "").strip() or None
     voice = (payload.get("voice") or "").strip() or None
+    exhibit = _exhibit(payload)
+    session_id = _session_id(payload)
 
     if not user_text:
         return Response(content=b"", media_type="audio/wav")
+    readiness.require("agent", "piper")
 
     try:
         # 通过AGENT获取回答文本
-        reply = await AGENT.reply_async(user_text, system_prompt=system)
+        reply = await _agent_answer(user_text, system, exhibit, session_id)
         reply = (reply or "").strip()
+    except Overloaded:
+        raise
     except Exception as e:
         err = f"[agent error] {e}".encode("utf-8")
         return Response(content=err, media_type="text/plain", status_code=500)
@@ -205,24 +600,31 @@ async def agent_tts(payload: dict = Body(...)):
         return Response(content=b"", media_type="audio/wav")
 
     try:
-        wav_bytes = piper_tts.synth(text=reply, model_path=voice)
+        wav_bytes = await _synth_wav(reply, voice)
         return Response(content=wav_bytes, media_type="audio/wav")
+    except Overloaded:
+        raise
     except Exception as e:
         err = f"[TTS] error: {e}".encode("utf-8")
         return Response(content=err, media_type="text/plain", status_code=500)
 
 
-# TTS 流式（s16le）
+# TTS 流式（s16le / mulaw / adpcm）
 @app.post("/tts/stream")
-async def tts_stream_endpoint(payload: dict = Body(...)):
+async def tts_stream_endpoint(request: Request, payload: dict = Body(...)):
     text = (payload.get("text") or "").strip()
     voice = (payload.get("voice") or "").strip() or None
+    codec = await _stream_codec(payload, voice, request.headers.get("accept"))
     if not text:
-        return Response(content=b"", media_type="audio/L16; rate=16000; channels=1")
+        return Response(content=b"", media_type=codec.media_type)
+    readiness.require("piper")
 
     try:
-        gen = await piper_tts.stream_s16le(text=text, model_path=voice, sample_rate=16000, chunk_ms=20)
-        return StreamingResponse(gen, media_type="audio/L16; rate=16000; channels=1")
+        gen = await piper_tts.stream_s16le(text=text, model_path=voice, codec=codec)
+        gen = await prime_stream(admission.tts.guard(gen))
+        return StreamingResponse(gen, media_type=codec.media_type)
+    except Overloaded:
+        raise
     except Exception as e:
         detail = f"{e.__class__.__name__}: {e}"
         tb = traceback.format_exc()
@@ -233,28 +635,34 @@ async def tts_stream_endpoint(payload: dict = Body(...)):
 
 # Agent TTS流式
 @app.post("/agent/tts/stream")
-async def agent_tts_stream(payload: dict = Body(...)):
+async def agent_tts_stream(request: Request, payload: dict = Body(...)):
     """
-    输入: { "text": "...", "system": "(可选)", "voice": "en_US-amy-medium.onnx(可选)" }
-    输出: 裸PCM流 (audio/L16; rate=16000; channels=1)
+    输入: { "text": "...", "system": "(可选)", "voice": "en_US-amy-medium.onnx(可选)", "exhibit": "asia/guanyin(可选)",
+           "format": "pcm|mulaw|adpcm(可选，也可用 Accept 头)", "session_id": "多轮会话 id(可选)" }
+    输出: 定长约 20ms 块的音频流，Content-Type 标明格式和采样率（默认裸PCM，如 audio/L16; rate=22050; channels=1）
     """
     user_text = (payload.get("text") or "").strip()
     system = (payload.get("system") or "").strip() or None
     voice = (payload.get("voice") or "").strip() or None
+    exhibit = _exhibit(payload)
+    session_id = _session_id(payload)
+    codec = await _stream_codec(payload, voice, request.headers.get("accept"))
     if not user_text:
         raise HTTPException(status_code=400, detail="empty text")
+    readiness.require("agent", "piper")
 
     try:
-        # 通过AGENT获取回答文本
-        answer = await AGENT.reply_async(user_text, system_prompt=system)
-        answer = (answer or "").strip()
-        if not answer:
-            raise RuntimeError("empty agent reply")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Agent error: {e}")
-
-    try:
-        gen = await piper_tts.stream_s16le(text=answer, model_path=voice, sample_rate=16000, chunk_ms=20)
-        return StreamingResponse(gen, media_type="audio/L16; rate=16000; channels=1")
+        # 边生成边断句边合成：第一句合成好就开始出声；相同请求（同一格式）共享同一条音频流
+        def make_gen():
+            tokens = admission.llm.guard(_agent().stream_reply(user_text, system_prompt=system, exhibit=exhibit,
+                                                               session_id=session_id))
+            return admission.tts.guard(pipeline_pcm(split_sentences(tokens), piper_tts, model_path=voice,
+                                                    codec=codec))
+        key = ("stream", _flight_text(user_text), system, voice, exhibit, session_id, codec.name)
+        gen = admission.flights.stream(key, make_gen)
+        gen = await prime_stream(gen)
+        return StreamingResponse(gen, media_type=codec.media_type)
+    except Overloaded:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"TTS error: {e}")
+        raise HTTPException(status_code=500, detail=f"Agent/TTS error: {e}")
@@ -0,0 +1,219 @@
+# server/metrics.py
+from __future__ import annotations
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Iterable, Optional
+
+# 0 关闭所有打点（/metrics 仍可访问，只是没有数据）
+METRICS = os.getenv("METRICS", "1").lower() in ("1", "true", "yes", "on")
+# Server-Timing 响应头，0 关闭（比如不想把内部耗时暴露给浏览器）
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1").lower() in ("1", "true", "yes", "on")
+
+# 秒
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (32, 64, 128, 256, 512, 768, 1024, 1536, 2048, 3072, 4096, 8192)
+# 解码耗时 / 音频时长
+RTF_BUCKETS = (0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0)
+
+
+class Histogram:
+    """
+    Prometheus 直方图（累积桶 + sum + count），按标签值分组。
+    observe 只做一次二分查找和几次加法，工作线程（ASR 解码）里也可以调用。
+    """
+
+    def __init__(self, name: str, help: str, buckets: Iterable[float], labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = labelnames
+        self._series: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        if not METRICS:
+            return
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labels)
+            if s is None:
+                # [各桶计数（非累积，最后一格是 +Inf）, sum, count]
+                s = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            s[0][i] += 1
+            s[1] += value
+            s[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(k, list(v[0]), v[1], v[2]) for k, v in sorted(self._series.items())]
+        for labels, counts, total, n in series:
+            base = ",".join(f'{k}="{_escape(v)}"' for k, v in zip(self.labelnames, labels))
+            sep = "," if base else ""
+            acc = 0
+            for le, c in zip(list(self.buckets) + ["+Inf"], counts):
+                acc += c
+                lines.append(f'{self.name}_bucket{{{base}{sep}le="{le}"}} {acc}')
+            suffix = f"{{{base}}}" if base else ""
+            lines.append(f"{self.name}_sum{suffix} {total:.6f}")
+            lines.append(f"{self.name}_count{suffix} {n}")
+        return lines
+
+    def drain(self) -> list:
+        # 取出并清空已有数据（多进程模式下 worker 把增量推给 host 汇总）
+        with self._lock:
+            series, self._series = self._series, {}
+        return [[list(k), v[0], v[1], v[2]] for k, v in series.items()]
+
+    def merge(self, series: list) -> None:
+        with self._lock:
+            for labels, counts, total, n in series:
+                s = self._series.get(tuple(labels))
+                if s is None:
+                    s = self._series[tuple(labels)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                for i, c in enumerate(counts[:len(s[0])]):
+                    s[0][i] += c
+                s[1] += total
+                s[2] += n
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# 各阶段耗时：retrieve / embed / vector_query / lexical / build_prompt / llm_ttft / llm_prompt_eval / llm_total /
+# piper_spawn / piper_acquire / piper_first_chunk / piper_total
+STAGE_SECONDS = Histogram("museum_stage_seconds", "Per-stage latency in seconds.", LATENCY_BUCKETS, ("stage",))
+PROMPT_TOKENS = Histogram("museum_prompt_tokens",
+                          "Prompt size in tokens (raw/packed: approximate, before/after packing; "
+                          "evaluated: reported by the LLM, excluding reused KV cache).",
+                          TOKEN_BUCKETS, ("which",))
+ASR_DECODE_RTF = Histogram("museum_asr_decode_rtf", "ASR decode time per second of audio, per utterance.",
+                           RTF_BUCKETS)
+HTTP_SECONDS = Histogram("museum_http_request_seconds", "HTTP time to response headers in seconds.",
+                         LATENCY_BUCKETS, ("path", "status"))
+
+REGISTRY = (STAGE_SECONDS, PROMPT_TOKENS, ASR_DECODE_RTF, HTTP_SECONDS)
+
+# 当前请求收集的 (阶段, 毫秒)，用来拼 Server-Timing；asyncio.to_thread / create_task 会带上同一个列表
+_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar("timings", default=None)
+
+
+def record(stage: str, seconds: float) -> None:
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((stage, seconds * 1000.0))
+
+
+@contextmanager
+def collect():
+    # 不经过 HTTP 中间件的调用（host 处理 worker 的请求）自己收集阶段耗时
+    timings: list = []
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+def add_timings(items: Iterable) -> None:
+    # 别的进程（host）记录的阶段耗时：只并进当前请求的 Server-Timing，直方图由那个进程自己记
+    timings = _timings.get()
+    if timings is not None:
+        timings.extend((name, ms) for name, ms in items)
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+async def timed_stream(gen: AsyncIterator, first_stage: str, total_stage: str,
+                       t0: Optional[float] = None) -> AsyncIterator:
+    """流式阶段：记录到第一块的时间和总时间；中途放弃（打断、断开）的不计总时间"""
+    t0 = time.perf_counter() if t0 is None else t0
+    first = True
+    try:
+        async for item in gen:
+            if first:
+                first = False
+                record(first_stage, time.perf_counter() - t0)
+            yield item
+    finally:
+        # 被放弃时立刻关掉上游（断开 HTTP 流、归还 Piper 进程），不等垃圾回收
+        await gen.aclose()
+    record(total_stage, time.perf_counter() - t0)
+
+
+def render() -> str:
+    lines: list[str] = []
+    for h in REGISTRY:
+        lines.extend(h.render())
+    return "\n".join(lines) + "\n"
+
+
+def drain() -> dict:
+    return {h.name: series for h in REGISTRY if (series := h.drain())}
+
+
+def merge(deltas: dict) -> None:
+    by_name = {h.name: h for h in REGISTRY}
+    for name, series in deltas.items():
+        h = by_name.get(name)
+        if h is not None:
+            h.merge(series)
+
+
+def server_timing(timings: list) -> str:
+    # 同名阶段（比如多句的 piper_first_chunk）只报第一次
+    seen: dict[str, float] = {}
+    for name, ms in timings:
+        seen.setdefault(name, ms)
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in seen.items())
+
+
+class TimingMiddleware:
+    """
+    纯 ASGI 中间件：每个 HTTP 请求一个收集列表，发响应头时把已完成的阶段写进 Server-Timing，
+    并记录到响应头为止的耗时。流式接口在出第一块音频前才发响应头，所以能带上检索、首 token、首块合成。
+    """
+
+    def __init__(self, app, skip_prefixes: tuple[str, ...] = ("/client", "/metrics")):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        timings: list = []
+        token = _timings.set(timings)
+        t0 = time.perf_counter()
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                elapsed = time.perf_counter() - t0
+                route = scope.get("route")
+                path = getattr(route, "path", None) or "other"
+                HTTP_SECONDS.observe(elapsed, path, str(message.get("status", 0)))
+                if SERVER_TIMING:
+                    header = server_timing(timings + [("total", elapsed * 1000.0)])
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", header.encode("latin-1"))]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _timings.reset(token)
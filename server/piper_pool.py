@@ -0,0 +1,480 @@
+# server/piper_pool.py
+from __future__ import annotations
+
+import asyncio
+import os
+import subprocess
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from pathlib import Path
+from typing import AsyncIterator, Callable, Optional
+
+from metrics import record, timed_stream
+
+# 每个语音常驻的最少/最多进程数，以及全局进程上限
+POOL_MIN_PER_VOICE = int(os.getenv("PIPER_POOL_MIN", "1"))
+POOL_MAX_PER_VOICE = int(os.getenv("PIPER_POOL_MAX_PER_VOICE", "2"))
+POOL_MAX_TOTAL = int(os.getenv("PIPER_POOL_MAX_TOTAL", "4"))
+# 语音闲置多久后回收（秒）
+POOL_IDLE_EVICT_S = float(os.getenv("PIPER_POOL_IDLE_S", "600"))
+# 单句合成超时（秒）
+UTTERANCE_TIMEOUT_S = float(os.getenv("PIPER_UTTERANCE_TIMEOUT_S", "60"))
+# 巡检间隔（秒）
+HEALTH_INTERVAL_S = float(os.getenv("PIPER_POOL_HEALTH_S", "15"))
+# 读管道的方式：asyncio（事件循环直接读管道，POSIX 默认）/ thread（阻塞读放在专用线程池，Windows 默认）
+PIPER_IO = os.getenv("PIPER_IO", "auto").strip().lower()
+# 每次从 stdout 最多读多少字节（16kHz s16le 下 64KB 约 2 秒音频），读到的大块再按 20ms 切
+PIPER_READ_BYTES = int(os.getenv("PIPER_READ_BYTES", "65536"))
+# thread 模式的专用线程池大小：每个进程常驻 stdout/stderr 两个读线程，外加写 stdin 的名额；不占默认线程池
+PIPER_IO_THREADS = int(os.getenv("PIPER_IO_THREADS", "0")) or 2 * POOL_MAX_TOTAL + 2
+
+# Piper 每处理完一行会在 stderr 打印这一行；此时该行音频已全部写入 stdout
+_DONE_MARK = "Real-time factor"
+# 看到结束标记后，再等这么久把管道里剩余的音频读干净
+_DRAIN_S = 0.05
+
+_EOU = object()    # 一句结束
+_EXIT = object()   # 进程退出
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+
+
+def io_mode() -> str:
+    if PIPER_IO in ("asyncio", "thread"):
+        return PIPER_IO
+    return "thread" if os.name == "nt" else "asyncio"
+
+
+def _io_executor() -> ThreadPoolExecutor:
+    global _io_pool
+    if _io_pool is None:
+        _io_pool = ThreadPoolExecutor(max_workers=max(3, PIPER_IO_THREADS), thread_name_prefix="piper-io")
+    return _io_pool
+
+
+class PiperWorker:
+    """
+    常驻 Piper 进程：模型只加载一次，stdin 每行一句，stdout 输出裸 PCM。
+    asyncio 模式下管道直接挂在事件循环上，读写都不经过线程；
+    thread 模式（Windows 的 SelectorEventLoop 不支持子进程管道）读 stdout/stderr 各占专用线程池的一个线程，
+    数据通过 call_soon_threadsafe 投递回事件循环。
+    """
+
+    def __init__(self, model: Path, args: list[str], cwd: str, env: dict, io: Optional[str] = None):
+        self.model = model
+        self.args = args
+        self.cwd = cwd
+        self.env = env
+        self.io = io or io_mode()
+        self.proc = None  # asyncio.subprocess.Process 或 subprocess.Popen
+        self.started_at = 0.0
+        self.last_used = 0.0
+        self.utterances = 0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._stderr_tail: deque[str] = deque(maxlen=20)
+
+    async def start(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        if self.io == "asyncio":
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.args,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=self.cwd,
+                env=self.env,
+                limit=PIPER_READ_BYTES,
+            )
+            self._loop.create_task(self._read_stdout())
+            self._loop.create_task(self._read_stderr())
+        else:
+            self.proc = subprocess.Popen(
+                self.args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                cwd=self.cwd,
+                env=self.env,
+                bufsize=0,
+            )
+            _io_executor().submit(self._pump_stdout)
+            _io_executor().submit(self._pump_stderr)
+        self.started_at = self.last_used = time.monotonic()
+
+    def returncode(self) -> Optional[int]:
+        if self.proc is None:
+            return None
+        return self.proc.returncode if self.io == "asyncio" else self.proc.poll()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.returncode() is None
+
+    def kill(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            if self.returncode() is None:
+                self.proc.kill()
+        except Exception:
+            pass
+
+    def stderr_tail(self) -> str:
+        return "\n".join(self._stderr_tail)[-800:]
+
+    def _stderr_line(self, raw: bytes) -> bool:
+        # 记下 stderr 的最后几行；返回这一行是不是一句结束的标记
+        line = raw.decode("utf-8", "ignore").rstrip()
+        if _DONE_MARK in line:
+            return True
+        if line:
+            self._stderr_tail.append(line)
+        return False
+
+    # asyncio 模式
+
+    async def _read_stdout(self) -> None:
+        try:
+            while True:
+                # 有多少读多少（最多 PIPER_READ_BYTES），一次唤醒处理一大块
+                chunk = await self.proc.stdout.read(PIPER_READ_BYTES)
+                if not chunk:
+                    break
+                self._queue.put_nowait(chunk)
+        except Exception:
+            pass
+        self._queue.put_nowait(_EXIT)
+
+    async def _read_stderr(self) -> None:
+        try:
+            async for raw in self.proc.stderr:
+                if self._stderr_line(raw):
+                    self._queue.put_nowait(_EOU)
+        except Exception:
+            pass
+
+    # thread 模式
+
+    def _post(self, item) -> None:
+        try:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭
+            pass
+
+    def _pump_stdout(self) -> None:
+        out = self.proc.stdout
+        try:
+            while True:
+                # bufsize=0：raw 读，有多少返回多少
+                chunk = out.read(PIPER_READ_BYTES)
+                if not chunk:
+                    break
+                self._post(chunk)
+        except Exception:
+            pass
+        self._post(_EXIT)
+
+    def _pump_stderr(self) -> None:
+        try:
+            for raw in self.proc.stderr:
+                if self._stderr_line(raw):
+                    self._post(_EOU)
+        except Exception:
+            pass
+
+    def _write_line(self, line: str) -> None:
+        self.proc.stdin.write((line + "\n").encode("utf-8"))
+        self.proc.stdin.flush()
+
+    async def _send(self, line: str) -> None:
+        if self.io == "asyncio":
+            self.proc.stdin.write((line + "\n").encode("utf-8"))
+            await self.proc.stdin.drain()
+        else:
+            await self._loop.run_in_executor(_io_executor(), self._write_line, line)
+
+    async def speak(self, text: str) -> AsyncIterator[bytes]:
+        """
+        合成一句，逐块产出 PCM。调用方须完整消费；中途放弃的 worker 由池子负责排空或重启。
+        """
+        # 换行会被 Piper 当成多句，合并成一行
+        line = " ".join(text.split())
+        if not line:
+            return
+        await self._send(line)
+        self.utterances += 1
+
+        got_eou = False
+        while True:
+            timeout = _DRAIN_S if got_eou else UTTERANCE_TIMEOUT_S
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                if got_eou:
+                    return
+                self.kill()
+                raise RuntimeError(f"Piper worker timed out after {UTTERANCE_TIMEOUT_S}s")
+            if item is _EOU:
+                got_eou = True
+                continue
+            if item is _EXIT:
+                rc = self.returncode()
+                raise RuntimeError(f"Piper worker exited (code {rc}): {self.stderr_tail()}")
+            yield item
+
+    async def drain(self) -> bool:
+        """把被放弃的那一句剩下的音频读掉，成功则 worker 可复用"""
+        got_eou = False
+        while True:
+            timeout = _DRAIN_S if got_eou else UTTERANCE_TIMEOUT_S
+            try:
+                item = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                return got_eou
+            if item is _EOU:
+                got_eou = True
+            elif item is _EXIT:
+                return False
+
+
+class _Voice:
+    def __init__(self, model: Path):
+        self.model = model
+        self.workers: list[PiperWorker] = []
+        self.idle: deque[PiperWorker] = deque()
+        self.last_used = time.monotonic()
+        self.pinned = False
+
+
+class PiperPool:
+    """
+    按语音分组的 Piper 常驻进程池：
+    - 每个语音保持 min_per_voice 个热进程，最多 max_per_voice 个
+    - 全局最多 max_total 个进程，满了先回收别的语音的空闲进程
+    - 定期巡检：清理挂掉的进程并给常驻语音补足热进程，回收长时间闲置的语音
+    """
+
+    def __init__(self, make_args: Callable[[Path], list[str]], cwd: str, env: dict,
+                 min_per_voice: int = POOL_MIN_PER_VOICE,
+                 max_per_voice: int = POOL_MAX_PER_VOICE,
+                 max_total: int = POOL_MAX_TOTAL,
+                 idle_evict_s: float = POOL_IDLE_EVICT_S):
+        self.make_args = make_args
+        self.cwd = cwd
+        self.env = env
+        self.max_total = max(1, max_total)
+        self.max_per_voice = min(max(1, max_per_voice), self.max_total)
+        self.min_per_voice = min(max(0, min_per_voice), self.max_per_voice)
+        if (self.min_per_voice, self.max_per_voice) != (min_per_voice, max_per_voice):
+            # 预热会同时占住 min_per_voice 个进程，超过上限就永远等不到
+            print(f"[PIPER] pool limits clamped to min={self.min_per_voice} max_per_voice={self.max_per_voice} "
+                  f"max_total={self.max_total} (need min <= max_per_voice <= max_total)")
+        self.idle_evict_s = idle_evict_s
+        self._voices: dict[str, _Voice] = {}
+        self._cond: Optional[asyncio.Condition] = None
+        self._health_task: Optional[asyncio.Task] = None
+        self.spawned = 0
+        # 发现已退出并移除的进程数（之后按需重新拉起的计在 spawned 里）
+        self.died = 0
+        self.evicted = 0
+
+    # 内部工具
+
+    def _condition(self) -> asyncio.Condition:
+        # 延迟创建，保证绑定到运行中的事件循环
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    def _total(self) -> int:
+        return sum(len(v.workers) for v in self._voices.values())
+
+    async def _spawn(self, voice: _Voice) -> PiperWorker:
+        t0 = time.perf_counter()
+        w = PiperWorker(voice.model, self.make_args(voice.model), self.cwd, self.env)
+        await w.start()
+        record("piper_spawn", time.perf_counter() - t0)
+        voice.workers.append(w)
+        self.spawned += 1
+        print(f"[PIPER] worker started: {voice.model.name} (pid={w.proc.pid}, total={self._total()})")
+        return w
+
+    def _remove(self, voice: _Voice, w: PiperWorker) -> None:
+        w.kill()
+        if w in voice.workers:
+            voice.workers.remove(w)
+        try:
+            voice.idle.remove(w)
+        except ValueError:
+            pass
+
+    def _evict_one_idle(self, exclude: str) -> bool:
+        # 找最久没用过的其他语音的空闲进程
+        candidates = [(v.last_used, k) for k, v in self._voices.items() if k != exclude and v.idle]
+        if not candidates:
+            return False
+        _, key = min(candidates)
+        voice = self._voices[key]
+        self._remove(voice, voice.idle.popleft())
+        self.evicted += 1
+        return True
+
+    # 对外接口
+
+    async def acquire(self, model: Path) -> PiperWorker:
+        key = str(model)
+        cond = self._condition()
+        async with cond:
+            while True:
+                voice = self._voices.get(key)
+                if voice is None:
+                    voice = self._voices[key] = _Voice(model)
+                voice.last_used = time.monotonic()
+
+                while voice.idle:
+                    w = voice.idle.popleft()
+                    if w.alive():
+                        return w
+                    self._remove(voice, w)
+                    self.died += 1
+
+                if len(voice.workers) < self.max_per_voice:
+                    if self._total() >= self.max_total:
+                        self._evict_one_idle(exclude=key)
+                    if self._total() < self.max_total:
+                        return await self._spawn(voice)
+
+                await cond.wait()
+
+    async def release(self, w: PiperWorker, clean: bool = True) -> None:
+        if clean and not w.alive():
+            clean = False
+            self.died += 1
+        if not clean and w.alive():
+            # 中途放弃：排空剩余音频后复用，失败则杀掉
+            clean = await w.drain()
+        cond = self._condition()
+        async with cond:
+            voice = self._voices.get(str(w.model))
+            if voice is None or w not in voice.workers:
+                w.kill()
+            elif clean:
+                w.last_used = time.monotonic()
+                voice.idle.append(w)
+            else:
+                self._remove(voice, w)
+            cond.notify_all()
+
+    @asynccontextmanager
+    async def worker(self, model: Path):
+        w = await self.acquire(model)
+        clean = False
+        try:
+            yield w
+            clean = True
+        finally:
+            await asyncio.shield(self.release(w, clean=clean))
+
+    async def stream(self, model: Path, text: str) -> AsyncIterator[bytes]:
+        t0 = time.perf_counter()
+        async with self.worker(model) as w:
+            # 排队等进程（含新拉起进程）的时间单独记，首块/总时间从拿到进程算起
+            t1 = time.perf_counter()
+            record("piper_acquire", t1 - t0)
+            async for chunk in timed_stream(w.speak(text), "piper_first_chunk", "piper_total", t1):
+                yield chunk
+
+    async def warm(self, model: Path, pin: bool = True, probe_text: str = "Hello.") -> int:
+        """预热：拉起 min_per_voice 个进程，并各合成一句让模型真正加载进内存；返回预热成功的进程数"""
+        # 同时占住 n 个进程，n 不能超过单语音和全局上限，否则 acquire 会一直等自己手里的进程
+        n = max(1, min(self.min_per_voice, self.max_per_voice, self.max_total))
+        workers = [await self.acquire(model) for _ in range(n)]
+        voice = self._voices[str(model)]
+        voice.pinned = voice.pinned or pin
+        ok = 0
+        for w in workers:
+            clean = False
+            try:
+                async for _ in w.speak(probe_text):
+                    pass
+                clean = True
+                ok += 1
+            except Exception as e:
+                print(f"[PIPER] warm-up failed for {model.name}: {e}")
+            finally:
+                await self.release(w, clean=clean)
+        return ok
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.sleep(HEALTH_INTERVAL_S)
+            try:
+                await self.check()
+            except Exception as e:
+                print(f"[PIPER] health check error: {e!r}")
+
+    async def check(self) -> None:
+        """巡检：清理死进程、回收闲置语音、补足常驻语音的热进程"""
+        now = time.monotonic()
+        refill: list[Path] = []
+        cond = self._condition()
+        async with cond:
+            for key, voice in list(self._voices.items()):
+                for w in list(voice.idle):
+                    if not w.alive():
+                        print(f"[PIPER] worker died: {voice.model.name} {w.stderr_tail()[-200:]}")
+                        self._remove(voice, w)
+                        self.died += 1
+
+                idle_for = now - voice.last_used
+                if not voice.pinned and idle_for > self.idle_evict_s:
+                    for w in list(voice.idle):
+                        self._remove(voice, w)
+                        self.evicted += 1
+                    if not voice.workers:
+                        del self._voices[key]
+                        print(f"[PIPER] voice evicted after {idle_for:.0f}s idle: {voice.model.name}")
+                    continue
+
+                if voice.pinned and len(voice.workers) < self.min_per_voice:
+                    refill.append(voice.model)
+            cond.notify_all()
+
+        for model in refill:
+            await self.warm(model)
+
+    def start(self) -> None:
+        if self._health_task is None or self._health_task.done():
+            self._health_task = asyncio.get_running_loop().create_task(self._health_loop())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for voice in self._voices.values():
+            for w in list(voice.workers):
+                w.kill()
+        self._voices.clear()
+
+    def stats(self) -> dict:
+        return {
+            "io": io_mode(),
+            "total": self._total(),
+            "max_total": self.max_total,
+            "spawned": self.spawned,
+            "died": self.died,
+            "evicted": self.evicted,
+            "voices": {
+                v.model.name: {
+                    "workers": len(v.workers),
+                    "idle": len(v.idle),
+                    "pinned": v.pinned,
+                    "idle_for_s": round(time.monotonic() - v.last_used, 1),
+                }
+                for v in self._voices.values()
+            },
+        }
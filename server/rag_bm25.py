@@ -0,0 +1,170 @@
+# server/rag_bm25.py
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Iterable, Optional
+
+# BM25 参数
+BM25_K1 = float(os.getenv("RAG_BM25_K1", "1.2"))
+BM25_B = float(os.getenv("RAG_BM25_B", "0.75"))
+
+# 字母数字串，允许中间带 . - ' （年份区间 960–1279、馆藏号 1923.921、Bodhisattva's）
+_WORD = re.compile(r"[a-z0-9]+(?:[.\-–'’][a-z0-9]+)*")
+_CJK = re.compile(r"[一-鿿]+")
+_STOPWORDS = frozenset(
+    "a an and are as at be by can did do does for from had has have he her his how i in is it its "
+    "me my of on or our she so that the their them there these they this to was we were what when "
+    "where which who whom why will with you your".split()
+)
+
+
+def tokenize(text: str) -> list[str]:
+    """英文按词（去停用词），连写的分隔符另外拆出子词；中文按单字 + 相邻二字"""
+    text = text.lower()
+    tokens: list[str] = []
+    for m in _WORD.finditer(text):
+        w = m.group(0)
+        if w in _STOPWORDS:
+            continue
+        tokens.append(w)
+        parts = re.split(r"[.\-–'’]", w)
+        if len(parts) > 1:
+            tokens.extend(p for p in parts if p and p not in _STOPWORDS)
+    for m in _CJK.finditer(text):
+        run = m.group(0)
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    进程内倒排索引，和向量库里的 chunk 一一对应（同样的 id、正文、元数据）。
+    正文一起存，纯词法命中时不用再回向量库取文档。
+    """
+
+    def __init__(self, k1: float = BM25_K1, b: float = BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.docs: dict[str, tuple[str, dict]] = {}
+        self._tf: dict[str, Counter] = {}
+        self._len: dict[str, int] = {}
+        self._postings: dict[str, dict[str, int]] = {}
+        self._total_len = 0
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def ids(self) -> set[str]:
+        with self._lock:
+            return set(self.docs)
+
+    def add(self, cid: str, text: str, meta: dict) -> None:
+        with self._lock:
+            if cid in self.docs:
+                self.remove(cid)
+            tf = Counter(tokenize(text))
+            self.docs[cid] = (text, dict(meta))
+            self._tf[cid] = tf
+            n = sum(tf.values())
+            self._len[cid] = n
+            self._total_len += n
+            for term, c in tf.items():
+                self._postings.setdefault(term, {})[cid] = c
+
+    def add_many(self, items: Iterable[tuple[str, str, dict]]) -> None:
+        with self._lock:
+            for cid, text, meta in items:
+                self.add(cid, text, meta)
+
+    def remove(self, cid: str) -> None:
+        with self._lock:
+            tf = self._tf.pop(cid, None)
+            if tf is None:
+                return
+            self.docs.pop(cid, None)
+            self._total_len -= self._len.pop(cid, 0)
+            for term in tf:
+                plist = self._postings.get(term)
+                if plist is not None:
+                    plist.pop(cid, None)
+                    if not plist:
+                        del self._postings[term]
+
+    def remove_many(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for cid in ids:
+                self.remove(cid)
+
+    def idf(self, term: str) -> float:
+        n = len(self.docs)
+        df = len(self._postings.get(term, ()))
+        return math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+
+    def search(self, query: str, k: int, allowed: Optional[frozenset[str]] = None
+               ) -> list[tuple[str, float, float]]:
+        """
+        返回 [(id, bm25 分数, 查询词覆盖率)]，按分数降序。
+        覆盖率 = 该 chunk 含有的查询词占全部查询词的比例，用来判断是否可以只走词法。
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        with self._lock:
+            n_docs = len(self.docs)
+            if n_docs == 0:
+                return []
+            avgdl = self._total_len / n_docs
+            scores: dict[str, float] = {}
+            hits: Counter = Counter()
+            for term in terms:
+                plist = self._postings.get(term)
+                if not plist:
+                    continue
+                idf = self.idf(term)
+                for cid, tf in plist.items():
+                    if allowed is not None and cid not in allowed:
+                        continue
+                    dl = self._len[cid]
+                    denom = tf + self.k1 * (1.0 - self.b + self.b * dl / avgdl)
+                    scores[cid] = scores.get(cid, 0.0) + idf * tf * (self.k1 + 1.0) / denom
+                    hits[cid] += 1
+        ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(cid, score, hits[cid] / len(terms)) for cid, score in ranked]
+
+    # 持久化：只存正文和元数据，加载时重新分词建倒排
+
+    def save(self, path: Path) -> None:
+        with self._lock:
+            data = {"version": 1, "docs": {cid: [t, m] for cid, (t, m) in self.docs.items()}}
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "BM25Index":
+        index = cls()
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return index
+        if data.get("version") == 1:
+            index.add_many((cid, t, m) for cid, (t, m) in data.get("docs", {}).items())
+        return index
+
+
+def rrf_merge(ranked_lists: list[list[str]], k: int = 60) -> list[tuple[str, float]]:
+    """Reciprocal Rank Fusion：score(d) = Σ 1 / (k + rank_i(d))，rank 从 1 开始"""
+    scores: dict[str, float] = {}
+    for ranked in ranked_lists:
+        for rank, cid in enumerate(ranked, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,173 @@
+# server/rag_cache.py
+from __future__ import annotations
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+import numpy as np
+
+# 精确缓存：规范化问题 -> 向量 / 检索结果
+RAG_CACHE_SIZE = int(os.getenv("RAG_CACHE_SIZE", "512"))
+RAG_CACHE_TTL_S = float(os.getenv("RAG_CACHE_TTL_S", "600"))
+# 语义答案缓存：问题向量足够接近且检索到的 chunk 完全相同时直接复用答案
+RAG_ANSWER_CACHE = os.getenv("RAG_ANSWER_CACHE", "1").lower() in ("1", "true", "yes", "on")
+RAG_ANSWER_CACHE_SIZE = int(os.getenv("RAG_ANSWER_CACHE_SIZE", "256"))
+RAG_ANSWER_SIM = float(os.getenv("RAG_ANSWER_SIM", "0.97"))
+
+_TRAILING_PUNCT = re.compile(r"[\s?？!！.。,，]+$")
+
+
+def normalize_query(text: str) -> str:
+    return _TRAILING_PUNCT.sub("", " ".join(text.lower().split()))
+
+
+class TTLCache:
+    # 带过期时间的 LRU，线程安全（检索跑在线程池里）
+    def __init__(self, max_items: int, ttl_s: float):
+        self.max_items = max(1, max_items)
+        self.ttl_s = ttl_s
+        self._items: OrderedDict[Any, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None or item[0] < now:
+                if item is not None:
+                    del self._items[key]
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Any, value: Any) -> None:
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_s, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._items), "hits": self.hits, "misses": self.misses}
+
+
+class _Answer:
+    __slots__ = ("vec", "chunk_ids", "system", "answer", "expires")
+
+    def __init__(self, vec: np.ndarray, chunk_ids: frozenset, system: Optional[str], answer: str, expires: float):
+        self.vec = vec
+        self.chunk_ids = chunk_ids
+        self.system = system
+        self.answer = answer
+        self.expires = expires
+
+
+class QueryCache:
+    """
+    三层：
+    - embeddings：规范化问题 -> 查询向量（与知识库无关，不随索引失效）
+    - results：规范化问题 -> 检索结果（知识库有任何变动就整体清空）
+    - answers：语义答案缓存，向量余弦相似度 >= sim_threshold、检索到的 chunk 集合一致、system 相同才命中
+    """
+
+    def __init__(self, size: int = RAG_CACHE_SIZE, ttl_s: float = RAG_CACHE_TTL_S,
+                 answer_cache: bool = RAG_ANSWER_CACHE, answer_size: int = RAG_ANSWER_CACHE_SIZE,
+                 sim_threshold: float = RAG_ANSWER_SIM):
+        self.embeddings = TTLCache(size, ttl_s)
+        self.results = TTLCache(size, ttl_s)
+        self.answer_cache = answer_cache
+        self.answer_size = max(1, answer_size)
+        self.ttl_s = ttl_s
+        self.sim_threshold = sim_threshold
+        self._answers: list[_Answer] = []
+        self._lock = threading.Lock()
+        self.answer_hits = 0
+        self.answer_misses = 0
+        self.invalidations = 0
+        # 每次失效 +1；检索开始前记下版本，结束时版本变了就不写缓存，避免旧结果回填
+        self.version = 0
+
+    @staticmethod
+    def _unit(vec) -> np.ndarray:
+        v = np.asarray(vec, dtype=np.float32)
+        n = float(np.linalg.norm(v))
+        return v / n if n > 0 else v
+
+    def put_results(self, key: str, value: Any, version: int) -> None:
+        if version == self.version:
+            self.results.put(key, value)
+
+    def lookup_answer(self, vec, chunk_ids: frozenset, system: Optional[str]) -> Optional[str]:
+        if not self.answer_cache or vec is None:
+            return None
+        q = self._unit(vec)
+        now = time.monotonic()
+        with self._lock:
+            self._answers = [a for a in self._answers if a.expires >= now]
+            best: Optional[_Answer] = None
+            best_sim = self.sim_threshold
+            for a in self._answers:
+                if a.chunk_ids != chunk_ids or a.system != system:
+                    continue
+                sim = float(np.dot(a.vec, q))
+                if sim >= best_sim:
+                    best, best_sim = a, sim
+            if best is None:
+                self.answer_misses += 1
+                return None
+            # 命中的挪到末尾，淘汰时从头删（LRU）
+            self._answers.remove(best)
+            self._answers.append(best)
+            self.answer_hits += 1
+            return best.answer
+
+    def store_answer(self, vec, chunk_ids: frozenset, system: Optional[str], answer: str) -> None:
+        if not self.answer_cache or vec is None or not answer:
+            return
+        entry = _Answer(self._unit(vec), chunk_ids, system, answer, time.monotonic() + self.ttl_s)
+        with self._lock:
+            self._answers.append(entry)
+            if len(self._answers) > self.answer_size:
+                del self._answers[: len(self._answers) - self.answer_size]
+
+    def invalidate(self, changed_ids: Optional[set[str]] = None) -> None:
+        """
+        知识库变动：检索结果全部作废；答案只删引用了变动 chunk 的（changed_ids 为 None 时全删）
+        """
+        self.invalidations += 1
+        self.version += 1
+        self.results.clear()
+        with self._lock:
+            if changed_ids is None:
+                self._answers.clear()
+            else:
+                self._answers = [a for a in self._answers if not (a.chunk_ids & changed_ids)]
+
+    def stats(self) -> dict:
+        return {
+            "embeddings": self.embeddings.stats(),
+            "results": self.results.stats(),
+            "answers": {
+                "enabled": self.answer_cache,
+                "entries": len(self._answers),
+                "hits": self.answer_hits,
+                "misses": self.answer_misses,
+                "sim_threshold": self.sim_threshold,
+            },
+            "invalidations": self.invalidations,
+        }
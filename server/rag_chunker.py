@@ -0,0 +1,230 @@
+# server/rag_chunker.py
+from __future__ import annotations
+
+import os
+import re
+from pathlib import Path
+from typing import Optional
+
+RAG_CHUNKER = os.getenv("RAG_CHUNKER", "structured")
+# 每个 chunk 的 token 上限（MiniLM 超过 256 个 wordpiece 会被截断）
+CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "200"))
+# 相邻 chunk 之间重叠的 token 数（按整句回带）
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "30"))
+# 小于这个长度的尾巴并进前一个 chunk
+CHUNK_MIN_TOKENS = int(os.getenv("RAG_CHUNK_MIN_TOKENS", "20"))
+# 额外的样板行正则，一行一个
+BOILERPLATE_FILE = os.getenv("RAG_BOILERPLATE_FILE", "")
+
+_TOKEN = re.compile(r"[一-鿿]|\w+|[^\w\s]")
+_SENT_SPLIT = re.compile(r"(?<=[.!?。！？])\s+|(?<=[。！？])")
+_MD_HEADING = re.compile(r"^\s{0,3}(#{1,6})\s+(.+?)\s*#*\s*$")
+_URL_ONLY = re.compile(r"^\s*(https?://\S+|www\.\S+)\s*$")
+
+# 抓取网页常见的导航/页脚/按钮文字
+DEFAULT_BOILERPLATE = [
+    r"skip to (main )?content",
+    r"visit|exhibitions|events|art & artists|learn with us|support us",
+    r"(primary|secondary|main|footer) navigation",
+    r"buy tickets?",
+    r"become a member",
+    r"shop",
+    r"share",
+    r"image actions",
+    r"cc0 public domain designation",
+    r"iiif manifest",
+    r"sign up|subscribe|newsletters?|email address|see all newsletters",
+    r"(privacy|cookie) (policy|settings)",
+    r"terms (of use|and conditions)",
+    r"back to top",
+    r"menu|search|close|open",
+]
+
+
+def count_tokens(text: str) -> int:
+    # 近似 token 数：英文按词和标点，中文按字
+    return len(_TOKEN.findall(text))
+
+
+def split_sentences(text: str) -> list[str]:
+    return [s.strip() for s in _SENT_SPLIT.split(text) if s and s.strip()]
+
+
+class Chunk:
+    __slots__ = ("text", "meta")
+
+    def __init__(self, text: str, meta: Optional[dict] = None):
+        self.text = text
+        self.meta = meta or {}
+
+
+class BlankLineChunker:
+    """原来的按空行切分"""
+
+    name = "blank_line"
+
+    @property
+    def signature(self) -> str:
+        return self.name
+
+    def chunk(self, content: str) -> list[Chunk]:
+        return [Chunk(c.strip()) for c in content.split("\n\n") if c.strip()]
+
+
+class StructuredChunker:
+    """
+    按结构切分：
+    - 去掉导航、按钮、单独一行的链接等样板行
+    - Markdown 标题和全大写小标题作为章节边界，章节名写进元数据
+    - 章节内按句子装箱到 max_tokens，相邻 chunk 回带 overlap_tokens 的整句
+    - 连续的短行（字段名/值、标签列表）合并成一行，不单独成块
+    """
+
+    name = "structured"
+
+    def __init__(self, max_tokens: int = CHUNK_TOKENS, overlap_tokens: int = CHUNK_OVERLAP,
+                 min_tokens: int = CHUNK_MIN_TOKENS, boilerplate: Optional[list[str]] = None):
+        self.max_tokens = max(16, max_tokens)
+        self.overlap_tokens = max(0, min(overlap_tokens, self.max_tokens // 2))
+        self.min_tokens = max(0, min_tokens)
+        patterns = list(DEFAULT_BOILERPLATE if boilerplate is None else boilerplate)
+        if BOILERPLATE_FILE and Path(BOILERPLATE_FILE).exists():
+            patterns += [ln.strip() for ln in Path(BOILERPLATE_FILE).read_text(encoding="utf-8").splitlines()
+                         if ln.strip() and not ln.startswith("#")]
+        self._boilerplate = re.compile(r"^\s*(?:" + "|".join(patterns) + r")\s*[:.]?\s*$", re.I)
+
+    @property
+    def signature(self) -> str:
+        # 参数变了清单会触发全量重建
+        return f"{self.name}:{self.max_tokens}:{self.overlap_tokens}:{self.min_tokens}"
+
+    # 预处理
+
+    def _is_boilerplate(self, line: str) -> bool:
+        return bool(self._boilerplate.match(line) or _URL_ONLY.match(line))
+
+    @staticmethod
+    def _heading(line: str) -> Optional[str]:
+        m = _MD_HEADING.match(line)
+        if m:
+            return m.group(2).strip()
+        s = line.strip()
+        # 全大写、不长、没有句末标点的行当作小标题（ABOUT THIS ARTWORK）
+        letters = [c for c in s if c.isalpha()]
+        if (3 <= len(s) <= 60 and len(letters) >= 3 and s.upper() == s
+                and any(c.isupper() for c in letters) and s[-1] not in ".!?:;,"):
+            return s.title()
+        return None
+
+    @staticmethod
+    def _is_short(line: str) -> bool:
+        s = line.strip()
+        return len(s.split()) <= 8 and s[-1:] not in ".!?。！？"
+
+    def _sections(self, content: str) -> list[tuple[Optional[str], list[str]]]:
+        """切成 [(章节名, 段落列表)]"""
+        sections: list[tuple[Optional[str], list[str]]] = [(None, [])]
+        para: list[str] = []
+        shorts: list[str] = []
+
+        def flush_shorts() -> None:
+            if not shorts:
+                return
+            # 连续短行：一两行照常并入段落，多行合并为 "a; b; c"
+            para.append("; ".join(shorts) if len(shorts) > 2 else " ".join(shorts))
+            shorts.clear()
+
+        def flush_para() -> None:
+            flush_shorts()
+            if para:
+                sections[-1][1].append(" ".join(para))
+                para.clear()
+
+        for raw in content.splitlines():
+            line = raw.strip()
+            if not line:
+                flush_para()
+                continue
+            if self._is_boilerplate(line):
+                continue
+            title = self._heading(line)
+            if title is not None:
+                flush_para()
+                sections.append((title, []))
+                continue
+            if self._is_short(line):
+                shorts.append(line)
+            else:
+                flush_shorts()
+                para.append(line)
+        flush_para()
+        return [(t, paras) for t, paras in sections if paras]
+
+    # 装箱
+
+    def _pack(self, paras: list[str]) -> list[str]:
+        units: list[tuple[str, int]] = []
+        for p in paras:
+            for s in split_sentences(p):
+                n = count_tokens(s)
+                if n > self.max_tokens:
+                    # 超长句按词硬切
+                    words = s.split()
+                    step = max(1, int(len(words) * self.max_tokens / n))
+                    for i in range(0, len(words), step):
+                        piece = " ".join(words[i:i + step])
+                        units.append((piece, count_tokens(piece)))
+                else:
+                    units.append((s, n))
+
+        chunks: list[list[tuple[str, int]]] = []
+        cur: list[tuple[str, int]] = []
+        cur_tokens = 0
+        for unit in units:
+            if cur and cur_tokens + unit[1] > self.max_tokens:
+                chunks.append(cur)
+                # 回带末尾几句作为重叠
+                carry: list[tuple[str, int]] = []
+                carried = 0
+                for u in reversed(cur):
+                    if carried + u[1] > self.overlap_tokens:
+                        break
+                    carry.insert(0, u)
+                    carried += u[1]
+                cur, cur_tokens = carry, carried
+            cur.append(unit)
+            cur_tokens += unit[1]
+        if cur:
+            tail_tokens = sum(u[1] for u in cur)
+            if chunks and tail_tokens < self.min_tokens:
+                chunks[-1].extend(u for u in cur if u not in chunks[-1])
+            else:
+                chunks.append(cur)
+        return [" ".join(u[0] for u in c) for c in chunks]
+
+    def chunk(self, content: str) -> list[Chunk]:
+        out: list[Chunk] = []
+        for title, paras in self._sections(content):
+            texts = self._pack(paras)
+            # 很短的章节（只有一两句）并进上一个 chunk，章节名沿用上一个
+            if len(texts) == 1 and count_tokens(texts[0]) < self.min_tokens and out \
+                    and count_tokens(out[-1].text) + count_tokens(texts[0]) <= self.max_tokens:
+                out[-1].text += "\n" + (f"{title}: {texts[0]}" if title else texts[0])
+                continue
+            for t in texts:
+                out.append(Chunk(t, {"section": title} if title else {}))
+        return out
+
+
+_CHUNKERS = {
+    BlankLineChunker.name: BlankLineChunker,
+    StructuredChunker.name: StructuredChunker,
+}
+
+
+def get_chunker(name: Optional[str] = None):
+    name = (name or RAG_CHUNKER).strip().lower()
+    try:
+        return _CHUNKERS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown RAG_CHUNKER: {name} (choose from {', '.join(_CHUNKERS)})")
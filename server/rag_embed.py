@@ -0,0 +1,294 @@
+# server/rag_embed.py
+"""
+向量化后端（RAG_EMBED_BACKEND）：
+- sentence_transformers：PyTorch 上跑 RAG_EMBED_MODEL（原来的方式）
+- onnx：同一个模型导出成 ONNX，在 onnxruntime 上跑（默认 int8 动态量化），服务进程不需要 torch，
+  内存小、CPU 上查询向量化更快
+
+onnx 后端要先导出一次（导出时需要 sentence-transformers / torch，只在导出的机器上需要）：
+  python rag_embed.py --export                 # 导出 RAG_EMBED_MODEL 并做 int8 量化
+  python rag_embed.py --export --no-quantize   # 只导出 fp32
+导出目录 RAG_ONNX_DIR/<模型名>/ 下有 model.onnx、model.int8.onnx、tokenizer.json、embed_config.json，
+可以整个拷到不装 torch 的导览机上用。
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+RAG_EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "sentence_transformers")
+# 推理线程数，0 为运行时默认（一般是全部核）
+RAG_EMBED_THREADS = int(os.getenv("RAG_EMBED_THREADS", "0"))
+RAG_ONNX_DIR = Path(os.getenv("RAG_ONNX_DIR", str(BASE_DIR / "models" / "onnx")))
+RAG_ONNX_QUANTIZE = os.getenv("RAG_ONNX_QUANTIZE", "1").lower() in ("1", "true", "yes", "on")
+
+DEFAULT_BATCH = 32
+ONNX_CONFIG = "embed_config.json"
+
+
+def onnx_model_dir(model_name: str, root: Path = RAG_ONNX_DIR) -> Path:
+    return root / re.sub(r"[^\w.-]+", "__", model_name).strip("_")
+
+
+def embed_signature(model_name: str, backend: str = RAG_EMBED_BACKEND, quantize: bool = RAG_ONNX_QUANTIZE) -> str:
+    """写进入库清单：换后端或量化方式向量就变了，要全量重建"""
+    if backend == "sentence_transformers":
+        # 和旧清单里的 embed_model 一致，老索引不用重建
+        return model_name
+    return f"{model_name}@onnx-{'int8' if quantize else 'fp32'}"
+
+
+class SentenceTransformerEmbedder:
+    backend = "sentence_transformers"
+
+    def __init__(self, model_name: str = RAG_EMBED_MODEL, threads: int = RAG_EMBED_THREADS):
+        self.model_name = model_name
+        self.threads = threads
+        self.signature = embed_signature(model_name, self.backend)
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    if self.threads:
+                        import torch
+                        torch.set_num_threads(self.threads)
+                    self._model = SentenceTransformer(self.model_name, device="cpu")
+        return self._model
+
+    def encode(self, texts: Sequence[str], batch_size: int = DEFAULT_BATCH) -> list[list[float]]:
+        if not texts:
+            return []
+        return self.model.encode(list(texts), batch_size=batch_size, show_progress_bar=False).tolist()
+
+    # Chroma 的 embedding_function 接口
+    def __call__(self, input: Sequence[str]) -> list[list[float]]:
+        return self.encode(input)
+
+
+class OnnxEmbedder:
+    """
+    onnxruntime 推理 + HF tokenizers 分词，池化和归一化按导出时记录的配置在 numpy 里做。
+    一批里先按长度排序再分组，补齐的 padding 少；InferenceSession.run 线程安全，不加锁。
+    """
+
+    backend = "onnx"
+
+    def __init__(self, model_name: str = RAG_EMBED_MODEL, model_dir: Optional[Path] = None,
+                 quantize: bool = RAG_ONNX_QUANTIZE, threads: int = RAG_EMBED_THREADS):
+        self.model_name = model_name
+        self.model_dir = Path(model_dir) if model_dir else onnx_model_dir(model_name)
+        self.quantize = quantize
+        self.threads = threads
+        self.signature = embed_signature(model_name, self.backend, quantize)
+        self._session = None
+        self._tokenizer = None
+        self._inputs: set[str] = set()
+        self._lock = threading.Lock()
+        self.pooling = "mean"
+        self.normalize = True
+
+    def _load(self) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = self.model_dir / ("model.int8.onnx" if self.quantize else "model.onnx")
+        cfg_path = self.model_dir / ONNX_CONFIG
+        if not path.exists() or not cfg_path.exists():
+            raise FileNotFoundError(f"ONNX embedding model not found: {path}\n"
+                                    f"run: python rag_embed.py --export")
+        cfg = json.loads(cfg_path.read_text(encoding="utf-8"))
+        self.pooling = cfg.get("pooling", "mean")
+        self.normalize = bool(cfg.get("normalize", True))
+
+        tok = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        tok.enable_truncation(max_length=int(cfg.get("max_tokens", 256)))
+        tok.no_padding()
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads:
+            opts.intra_op_num_threads = self.threads
+        opts.inter_op_num_threads = 1
+        session = ort.InferenceSession(str(path), opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in session.get_inputs()}
+        self._tokenizer = tok
+        self._session = session
+
+    def _ensure(self) -> None:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._load()
+
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        m = mask[:, :, None].astype(hidden.dtype)
+        if self.pooling == "max":
+            return np.where(m > 0, hidden, -1e9).max(axis=1)
+        return (hidden * m).sum(axis=1) / np.clip(m.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts: Sequence[str], batch_size: int = DEFAULT_BATCH) -> list[list[float]]:
+        if not texts:
+            return []
+        self._ensure()
+        encs = self._tokenizer.encode_batch(list(texts))
+        order = sorted(range(len(encs)), key=lambda i: len(encs[i].ids))
+        out: Optional[np.ndarray] = None
+        for off in range(0, len(order), max(1, batch_size)):
+            idx = order[off:off + batch_size]
+            width = max(1, max(len(encs[i].ids) for i in idx))
+            ids = np.zeros((len(idx), width), dtype=np.int64)
+            mask = np.zeros_like(ids)
+            types = np.zeros_like(ids)
+            for r, i in enumerate(idx):
+                e = encs[i]
+                n = len(e.ids)
+                ids[r, :n] = e.ids
+                mask[r, :n] = e.attention_mask
+                types[r, :n] = e.type_ids
+            feed = {"input_ids": ids, "attention_mask": mask}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = types
+            pooled = self._pool(self._session.run(None, feed)[0], mask)
+            if self.normalize:
+                pooled = pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            if out is None:
+                out = np.empty((len(encs), pooled.shape[1]), dtype=np.float32)
+            out[idx] = pooled
+        return out.tolist()
+
+    def __call__(self, input: Sequence[str]) -> list[list[float]]:
+        return self.encode(input)
+
+
+EMBEDDERS = ("sentence_transformers", "onnx")
+
+
+def get_embedder(model_name: str = RAG_EMBED_MODEL, backend: Optional[str] = None):
+    backend = (backend or RAG_EMBED_BACKEND).strip().lower()
+    if backend == "sentence_transformers":
+        return SentenceTransformerEmbedder(model_name)
+    if backend == "onnx":
+        return OnnxEmbedder(model_name)
+    raise ValueError(f"unknown RAG_EMBED_BACKEND: {backend} (choose from {', '.join(EMBEDDERS)})")
+
+
+# 导出
+
+def _pooling_mode(pooling) -> str:
+    if pooling is None:
+        return "mean"
+    # sentence-transformers 新版是 pooling_mode 属性，旧版是 get_pooling_mode_str()
+    mode = getattr(pooling, "pooling_mode", None)
+    if mode is None and hasattr(pooling, "get_pooling_mode_str"):
+        mode = pooling.get_pooling_mode_str()
+    return {"mean_tokens": "mean", "cls_token": "cls", "max_tokens": "max"}.get(str(mode), str(mode))
+
+
+def export_onnx(model_name: str = RAG_EMBED_MODEL, out_dir: Optional[Path] = None, quantize: bool = True,
+                opset: int = 17) -> Path:
+    """sentence-transformers 模型 -> ONNX（只导出 transformer 主体，池化/归一化在 OnnxEmbedder 里做）"""
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    out_dir = Path(out_dir) if out_dir else onnx_model_dir(model_name)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    hf = st[0].auto_model.eval()
+    tokenizer = st.tokenizer
+    pooling = next((m for m in st if isinstance(m, Pooling)), None)
+    mode = _pooling_mode(pooling)
+    if mode not in ("mean", "cls", "max"):
+        raise ValueError(f"unsupported pooling mode for ONNX export: {mode}")
+
+    sample = tokenizer(["The Seated Guanyin was carved from wood."], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class _Body(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(names, args))).last_hidden_state
+
+    axes = {n: {0: "batch", 1: "seq"} for n in names + ["last_hidden_state"]}
+    t0 = time.perf_counter()
+    export_kwargs = dict(input_names=names, output_names=["last_hidden_state"], dynamic_axes=axes,
+                         opset_version=opset)
+    with torch.no_grad():
+        try:
+            torch.onnx.export(_Body(hf), tuple(sample[n] for n in names), str(out_dir / "model.onnx"),
+                              dynamo=False, **export_kwargs)
+        except TypeError:
+            # 老版本 torch 没有 dynamo 参数
+            torch.onnx.export(_Body(hf), tuple(sample[n] for n in names), str(out_dir / "model.onnx"),
+                              **export_kwargs)
+    tokenizer.save_pretrained(str(out_dir))
+    if not (out_dir / "tokenizer.json").exists():
+        raise RuntimeError(f"{model_name} has no fast tokenizer (tokenizer.json), cannot run without transformers")
+    print(f"[EMBED] exported {out_dir / 'model.onnx'} in {time.perf_counter() - t0:.1f}s")
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(out_dir / "model.onnx"), str(out_dir / "model.int8.onnx"), weight_type=QuantType.QInt8)
+        print(f"[EMBED] quantized -> {out_dir / 'model.int8.onnx'}")
+
+    cfg = {
+        "model": model_name,
+        "pooling": mode,
+        "normalize": any(isinstance(m, Normalize) for m in st),
+        "max_tokens": int(st.max_seq_length or 256),
+        "dim": (getattr(st, "get_embedding_dimension", None) or st.get_sentence_embedding_dimension)(),
+        "inputs": names,
+        "exported_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    (out_dir / ONNX_CONFIG).write_text(json.dumps(cfg, indent=1), encoding="utf-8")
+
+    # 和原模型对一下：余弦相似度应接近 1（int8 一般 > 0.99）
+    probe = ["Who is Guanyin?", "The gift shop is open until five in the afternoon."]
+    ref = st.encode(probe, normalize_embeddings=True)
+    for q in ([False, True] if quantize else [False]):
+        got = np.asarray(OnnxEmbedder(model_name, out_dir, quantize=q).encode(probe))
+        got = got / np.linalg.norm(got, axis=1, keepdims=True)
+        cos = (ref * got).sum(axis=1)
+        print(f"[EMBED] {'int8' if q else 'fp32'} vs sentence-transformers cosine: min {cos.min():.4f}")
+    return out_dir
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="embedding backends / ONNX export")
+    ap.add_argument("--export", action="store_true", help="export RAG_EMBED_MODEL to ONNX")
+    ap.add_argument("--model", default=RAG_EMBED_MODEL)
+    ap.add_argument("--out", default=None, help="output dir (default: RAG_ONNX_DIR/<model>)")
+    ap.add_argument("--no-quantize", action="store_true", help="skip int8 quantization")
+    args = ap.parse_args()
+    if not args.export:
+        ap.print_help()
+        return
+    export_onnx(args.model, Path(args.out) if args.out else None, quantize=not args.no_quantize)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,447 @@
+# server/rag_ingest.py
+"""
+离线增量入库：
+  python rag_ingest.py              # 只处理新增/修改/删除的文件
+  python rag_ingest.py --full       # 全量重建
+  python rag_ingest.py --dry-run    # 只看会改什么
+
+清单（<集合名>.manifest.json，放在 RAG_DB_PATH 下）记录每个文件和每个 chunk 的内容哈希，
+chunk id = 相对路径::内容哈希，内容不变则 id 不变，不会重复向量化；
+文件改了只对新 chunk 做向量化，旧 chunk 和已删除文件的 chunk 会从库里删掉。
+"""
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from dotenv import load_dotenv
+
+from rag_bm25 import BM25Index
+from rag_chunker import RAG_CHUNKER, get_chunker
+from rag_embed import SentenceTransformerEmbedder, embed_signature, get_embedder
+from rag_store import RAG_STORE, VectorStore, open_store
+
+load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+DOC_DIR = Path(os.getenv("RAG_DOC_DIR", str(BASE_DIR / "rag_docs")))
+DB_PATH = Path(os.getenv("RAG_DB_PATH", str(BASE_DIR / "chroma_db")))
+COLLECTION = os.getenv("RAG_COLLECTION", "rag_kb")
+EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# 每批向量化/写库的 chunk 数
+EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", "64"))
+# >1 时用多进程向量化，吃满多核
+EMBED_WORKERS = int(os.getenv("RAG_EMBED_WORKERS", "1"))
+
+MANIFEST_VERSION = 1
+# chunk 元数据里分区键的来源；改了要全量重建（旧 chunk 没有 exhibit 字段）
+PARTITION_SCHEME = "dir-v1"
+DOC_PATTERNS = ("*.txt", "*.md")
+# 锁文件超过这个时间视为上次异常退出留下的
+LOCK_STALE_S = 6 * 3600
+
+
+def list_doc_files(doc_dir: Path) -> list[Path]:
+    if not doc_dir.exists():
+        return []
+    files: list[Path] = []
+    for pattern in DOC_PATTERNS:
+        files.extend(doc_dir.rglob(pattern))
+    return sorted(files)
+
+
+def _sha256(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def exhibit_key(rel: str) -> str:
+    """
+    分区键：文档所在目录（相对 RAG_DOC_DIR），比如 asia/guanyin/label.md -> "asia/guanyin"；
+    放在根目录的文档（开放时间、总览等）键为 ""，只在全馆范围里检索到
+    """
+    return rel.rpartition("/")[0]
+
+
+def chunk_ids(rel: str, chunks: list[str]) -> list[str]:
+    # 同一文件里内容完全相同的段落加序号区分
+    seen: dict[str, int] = {}
+    ids: list[str] = []
+    for chunk in chunks:
+        h = _sha256(chunk.encode("utf-8"))[:16]
+        n = seen.get(h, 0)
+        seen[h] = n + 1
+        ids.append(f"{rel}::{h}" if n == 0 else f"{rel}::{h}#{n}")
+    return ids
+
+
+class _IngestLock:
+    # 同一个库同一时间只允许一个入库进程
+    def __init__(self, db_path: Path):
+        self.path = db_path / "ingest.lock"
+        self.fd: Optional[int] = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            if time.time() - self.path.stat().st_mtime > LOCK_STALE_S:
+                self.path.unlink()
+        except OSError:
+            pass
+        try:
+            self.fd = os.open(str(self.path), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            raise RuntimeError(f"another ingest is running (lock: {self.path})")
+        os.write(self.fd, str(os.getpid()).encode())
+        return self
+
+    def __exit__(self, *exc):
+        if self.fd is not None:
+            os.close(self.fd)
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+
+class Ingestor:
+    def __init__(self, doc_dir: Path = DOC_DIR, db_path: Path = DB_PATH,
+                 collection_name: str = COLLECTION, embed_model: str = EMBED_MODEL,
+                 batch_size: int = EMBED_BATCH, workers: int = EMBED_WORKERS,
+                 store: Optional[VectorStore] = None, store_backend: str = RAG_STORE, embed_fn: Optional[Callable[[list[str]], list]] = None,
+                 chunker=None):
+        self.doc_dir = Path(doc_dir)
+        self.db_path = Path(db_path)
+        self.collection_name = collection_name
+        self.embed_model = embed_model
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self._store = store
+        self.store_backend = store_backend
+        self._embedder = None
+        # 传入时直接用它向量化（服务进程里复用已加载的模型）
+        self.embed_fn = embed_fn
+        # 写进清单：换模型、换后端（onnx / 量化）都要全量重建
+        self.embed_signature = (getattr(embed_fn, "signature", embed_model) if embed_fn is not None
+                                else embed_signature(embed_model))
+        self.chunker = chunker if chunker is not None else get_chunker()
+        self.files: Optional[dict] = None
+        self.manifest_path = self.db_path / f"{collection_name}.manifest.json"
+        # 词法索引和向量库同步维护，存在清单旁边
+        self.bm25_path = self.db_path / f"{collection_name}.bm25.json"
+        self._bm25: Optional[BM25Index] = None
+
+    @property
+    def store(self) -> VectorStore:
+        if self._store is None:
+            self._store = open_store(self.db_path, self.collection_name, self.store_backend)
+        return self._store
+
+    @property
+    def bm25(self) -> BM25Index:
+        if self._bm25 is None:
+            self._bm25 = BM25Index.load(self.bm25_path)
+        return self._bm25
+
+    def sync_bm25(self, keep: Optional[set[str]] = None, save: bool = False) -> int:
+        """
+        让词法索引和向量库对齐：补上缺的 chunk（从库里取正文），去掉多余的。
+        keep 默认为清单里的可见 chunk；返回改动条数。
+        """
+        keep = self.live_ids() if keep is None else keep
+        have = self.bm25.ids()
+        missing = sorted(keep - have)
+        extra = have - keep
+        self.bm25.add_many(self.store.get(missing))
+        self.bm25.remove_many(extra)
+        if save or missing or extra or not self.bm25_path.exists():
+            self.bm25.save(self.bm25_path)
+        return len(missing) + len(extra)
+
+    # 清单
+
+    def load_manifest(self) -> dict:
+        try:
+            data = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != MANIFEST_VERSION:
+            return {}
+        return data
+
+    def save_manifest(self, files: dict, pending_delete: Optional[list[str]] = None) -> None:
+        data = {
+            "version": MANIFEST_VERSION,
+            "collection": self.collection_name,
+            "embed_model": self.embed_signature,
+            "store": self.store.signature,
+            "partitions": PARTITION_SCHEME,
+            "chunker": self.chunker.signature,
+            "updated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "files": files,
+            "pending_delete": pending_delete or [],
+        }
+        self.db_path.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_name(self.manifest_path.name + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    # 向量化
+
+    def _encoder(self):
+        if self._embedder is None:
+            self._embedder = get_embedder(self.embed_model)
+        return self._embedder
+
+    def embed(self, texts: list[str]) -> list[list[float]]:
+        if self.embed_fn is not None:
+            if hasattr(self.embed_fn, "encode"):
+                # rag_embed 的向量化器：整批交给它自己分批（onnx 后端会按长度排序）
+                return self.embed_fn.encode(texts, batch_size=self.batch_size)
+            out: list = []
+            for off in range(0, len(texts), self.batch_size):
+                out.extend(self.embed_fn(texts[off:off + self.batch_size]))
+            return [list(map(float, e)) for e in out]
+        embedder = self._encoder()
+        if (isinstance(embedder, SentenceTransformerEmbedder) and self.workers > 1
+                and len(texts) >= self.batch_size * self.workers):
+            model = embedder.model
+            pool = model.start_multi_process_pool(["cpu"] * self.workers)
+            try:
+                emb = model.encode_multi_process(texts, pool, batch_size=self.batch_size)
+            finally:
+                model.stop_multi_process_pool(pool)
+            return emb.tolist()
+        return embedder.encode(texts, batch_size=self.batch_size)
+
+    # 主流程
+
+    def _ensure_docs(self) -> list[Path]:
+        files = list_doc_files(self.doc_dir)
+        if files:
+            return files
+        self.doc_dir.mkdir(parents=True, exist_ok=True)
+        sample_file = self.doc_dir / "sample.md"
+        sample_file.write_text(
+            "# Hello KB\nThis file is for RAG demo. Put your museum notes here.",
+            encoding="utf-8",
+        )
+        print("[INGEST] no docs found, sample.md created")
+        return [sample_file]
+
+    def live_ids(self) -> set[str]:
+        # 当前清单里所有应当可见的 chunk id
+        files = self.files if self.files is not None else self.load_manifest().get("files", {})
+        return {cid for entry in files.values() for cid in entry["chunks"]}
+
+    def partitions(self) -> dict[str, set[str]]:
+        # 分区键 -> 可见 chunk id
+        files = self.files if self.files is not None else self.load_manifest().get("files", {})
+        parts: dict[str, set[str]] = {}
+        for rel, entry in files.items():
+            parts.setdefault(exhibit_key(rel), set()).update(entry["chunks"])
+        return parts
+
+    def run(self, full: bool = False, dry_run: bool = False, verify: bool = False,
+            paths: Optional[Iterable[str]] = None, defer_delete: bool = False,
+            on_plan: Optional[Callable[[dict], None]] = None) -> dict:
+        """
+        - paths: 只检查这些相对路径（监听文件变动时用），其余文件沿用清单
+        - defer_delete: 旧 chunk 先不删，id 放进 report["orphans"]，由调用方在切换可见集合后调用 delete_chunks
+        - on_plan: 写库之前拿统计（chunks_added / chunks_deleted）回调一次，调用方据此知道会多出多少不可见的 chunk
+        """
+        with _IngestLock(self.db_path):
+            return self._run(full=full, dry_run=dry_run, verify=verify,
+                             paths=paths, defer_delete=defer_delete, on_plan=on_plan)
+
+    def delete_chunks(self, ids: list[str]) -> None:
+        with _IngestLock(self.db_path):
+            self.store.delete(ids)
+            self.store.flush()
+            self.bm25.remove_many(ids)
+            self.bm25.save(self.bm25_path)
+            manifest = self.load_manifest()
+            if manifest:
+                gone = set(ids)
+                pending = [x for x in manifest.get("pending_delete", []) if x not in gone]
+                self.save_manifest(manifest.get("files", {}), pending_delete=pending)
+
+    def _run(self, full: bool, dry_run: bool, verify: bool,
+             paths: Optional[Iterable[str]], defer_delete: bool,
+             on_plan: Optional[Callable[[dict], None]] = None) -> dict:
+        t0 = time.perf_counter()
+        manifest = self.load_manifest()
+        if manifest and (manifest.get("embed_model") != self.embed_signature
+                         or manifest.get("chunker") != self.chunker.signature
+                         # 旧清单没有这一项，当时只有 chroma
+                         or manifest.get("store", "chroma") != self.store.signature
+                         or manifest.get("partitions") != PARTITION_SCHEME
+                         or manifest.get("collection") != self.collection_name):
+            print("[INGEST] embed model / chunker / store / partitions / collection changed, full rebuild")
+            full = True
+        old_files: dict = {} if full else manifest.get("files", {})
+        bootstrap = full or not manifest
+
+        if paths is not None and not bootstrap:
+            wanted = set(paths)
+            files = [self.doc_dir / rel for rel in sorted(wanted) if (self.doc_dir / rel).is_file()]
+            # 不在本次范围内的文件原样保留
+            new_files: dict = {rel: e for rel, e in old_files.items() if rel not in wanted}
+        else:
+            wanted = None
+            files = self._ensure_docs()
+            new_files = {}
+        to_add: list[tuple[str, str, dict]] = []
+        # 内容没变但段落位置变了的 chunk，只更新元数据，不重新向量化
+        to_touch: list[tuple[str, dict]] = []
+        # 上次延迟删除但没删成的
+        orphans: list[str] = list(manifest.get("pending_delete", [])) if manifest else []
+        changed = 0
+
+        for fp in files:
+            rel = fp.relative_to(self.doc_dir).as_posix()
+            st = fp.stat()
+            old = old_files.get(rel)
+            # 大小和修改时间都没变就不读文件
+            if old and not verify and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+                new_files[rel] = old
+                continue
+
+            raw = fp.read_bytes()
+            digest = _sha256(raw)
+            if old and old["sha256"] == digest:
+                new_files[rel] = {**old, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+                continue
+
+            changed += 1
+            chunks = self.chunker.chunk(raw.decode("utf-8", errors="ignore"))
+            ids = chunk_ids(rel, [c.text for c in chunks])
+            old_ids = set(old["chunks"]) if old else set()
+            exhibit = exhibit_key(rel)
+            for i, (cid, chunk) in enumerate(zip(ids, chunks)):
+                meta = {"source": rel, "chunk": i, "exhibit": exhibit, **chunk.meta}
+                if cid not in old_ids:
+                    to_add.append((cid, chunk.text, meta))
+                else:
+                    to_touch.append((cid, meta))
+            orphans.extend(sorted(old_ids - set(ids)))
+            new_files[rel] = {
+                "sha256": digest,
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "chunks": ids,
+            }
+
+        scope = set(old_files) if wanted is None else (wanted & set(old_files))
+        deleted = sorted(scope - set(new_files))
+        for rel in deleted:
+            orphans.extend(old_files[rel]["chunks"])
+
+        live = {cid for entry in new_files.values() for cid in entry["chunks"]}
+        if bootstrap:
+            # 没有清单（或全量重建）时，库里不属于当前清单的 id 一律清掉（包括旧版 path::序号）
+            existing = self.store.ids()
+            orphans = sorted(existing - live)
+            if not full:
+                to_add = [x for x in to_add if x[0] not in existing]
+        orphans = sorted(set(orphans) - live)
+
+        report = {
+            "files": len(files),
+            "files_changed": changed,
+            "files_deleted": len(deleted),
+            "chunks_live": len(live),
+            "chunks_added": len(to_add),
+            "chunks_deleted": len(orphans),
+            "embed_s": 0.0,
+        }
+        if dry_run:
+            report["total_s"] = round(time.perf_counter() - t0, 3)
+            return report
+        if on_plan is not None:
+            on_plan(report)
+
+        if to_add:
+            t_embed = time.perf_counter()
+            embeddings = self.embed([x[1] for x in to_add])
+            report["embed_s"] = round(time.perf_counter() - t_embed, 3)
+            step = max(self.batch_size, 256)
+            for off in range(0, len(to_add), step):
+                batch = to_add[off:off + step]
+                self.store.upsert(
+                    ids=[x[0] for x in batch],
+                    documents=[x[1] for x in batch],
+                    metadatas=[x[2] for x in batch],
+                    embeddings=embeddings[off:off + step],
+                )
+        if to_touch:
+            self.store.update_metadatas([x[0] for x in to_touch], [x[1] for x in to_touch])
+
+        self.bm25.add_many(to_add)
+        for cid, meta in to_touch:
+            doc = self.bm25.docs.get(cid)
+            if doc is not None:
+                self.bm25.add(cid, doc[0], meta)
+
+        if defer_delete:
+            self.store.flush()
+            # 先记进清单，进程中途退出下次入库也会补删
+            self.save_manifest(new_files, pending_delete=orphans)
+            report["orphans"] = orphans
+        else:
+            self.store.delete(orphans)
+            self.store.flush()
+            self.save_manifest(new_files)
+        self.files = new_files
+        # 延迟删除的旧 chunk 在词法索引里也先留着，和向量库保持一致
+        self.sync_bm25(live | (set(orphans) if defer_delete else set()), save=True)
+        report["added_ids"] = [x[0] for x in to_add]
+        report["total_s"] = round(time.perf_counter() - t0, 3)
+        return report
+
+
+def summarize(report: dict) -> dict:
+    # 打印用：去掉 id 列表
+    return {k: v for k, v in report.items() if not isinstance(v, list)}
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Incremental knowledge-base ingest for the RAG agent")
+    ap.add_argument("--doc-dir", default=str(DOC_DIR))
+    ap.add_argument("--db-path", default=str(DB_PATH))
+    ap.add_argument("--collection", default=COLLECTION)
+    ap.add_argument("--embed-model", default=EMBED_MODEL)
+    ap.add_argument("--batch-size", type=int, default=EMBED_BATCH)
+    ap.add_argument("--workers", type=int, default=EMBED_WORKERS,
+                    help="embedding processes (default: RAG_EMBED_WORKERS or 1)")
+    ap.add_argument("--store", default=RAG_STORE, help="chroma | numpy (default: RAG_STORE)")
+    ap.add_argument("--chunker", default=RAG_CHUNKER, help="blank_line | structured (default: RAG_CHUNKER)")
+    ap.add_argument("--full", action="store_true", help="re-embed everything")
+    ap.add_argument("--verify", action="store_true", help="hash every file even if size/mtime match")
+    ap.add_argument("--dry-run", action="store_true")
+    args = ap.parse_args(argv)
+
+    ingestor = Ingestor(
+        doc_dir=Path(args.doc_dir),
+        db_path=Path(args.db_path),
+        collection_name=args.collection,
+        embed_model=args.embed_model,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        store_backend=args.store,
+        chunker=get_chunker(args.chunker),
+    )
+    print(f"[INGEST] docs: {ingestor.doc_dir} -> {ingestor.db_path} ({ingestor.collection_name}, "
+          f"store {ingestor.store.signature}, chunker {ingestor.chunker.signature}, embed {ingestor.embed_signature})")
+    report = ingestor.run(full=args.full, dry_run=args.dry_run, verify=args.verify)
+    print("[INGEST] " + json.dumps(summarize(report)))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,25 +1,78 @@
 from __future__ import annotations
 
+import asyncio
+import contextlib
 import os
+import threading
+import time
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Callable, Optional
 
-import chromadb
 import requests
-from chromadb.utils import embedding_functions
 from dotenv import load_dotenv
 
 from agent_base import AgentInterface
+from llm_client import LLM_CONNECT_TIMEOUT_S, LLM_READ_TIMEOUT_S, OllamaClient
+from metrics import PROMPT_TOKENS, span
+from rag_bm25 import rrf_merge, tokenize
+from rag_cache import QueryCache, normalize_query
+from rag_chunker import count_tokens
+from rag_embed import get_embedder
+from rag_ingest import Ingestor, summarize
+from rag_packer import ContextPacker
+from rag_store import open_store
+from sessions import Session, SessionStore
 
 
 load_dotenv(dotenv_path=Path(__file__).resolve().parent / ".env")
 
 
+# 固定的讲解员说明：每次请求逐字相同，放在 prompt 最前面
+DOCENT_INSTRUCTIONS = """You are a helpful assistant.
+
+# Role and setting
+You are a museum docent. Your job is to answer visitors' questions based on the museum knowledge base excerpts that come with each question. Use the same language as the visitor's input.
+
+# Relevance and how to answer
+1. **Judge relevance**: Is the visitor's question related to the topic of the excerpts? If the question is clearly about something else (e.g. unrelated artist, unrelated museum), say that it was not found in the museum's records and do not invent an answer.
+
+2. **When the excerpts directly answer the question**: Answer from them and cite excerpt numbers [1], [2] where appropriate.
+
+3. **When you cannot give a valid answer from [2]** (e.g. the question asks "why" or "the reason" and the excerpts only say *that* something is so, not *why*): then follow this step instead:
+   - First state what *is* in the knowledge base (with [number] if useful).
+   - Then say clearly: "This is not stated in our museum's knowledge base" or "The records don't give the reason."
+   - After that, you may add: "But one possible explanation is ..." or "I think a likely reason could be ..." and give a short, reasonable inference. Always make it obvious that this part is your own suggestion, not from the records.
+
+4. **When no excerpts were found**: Say so clearly and politely. You may suggest the visitor go to the information desk or check the museum catalog. Do not present guesses as if they came from the museum's records.
+
+# Guidelines
+- Never present your own inference or guess as if it came from the knowledge base.
+- Keep answers concise; cite [1], [2] for any claim that comes from the excerpts.
+- The visitor may ask follow-up questions. Earlier questions and answers tell you what the visitor is referring to; cite only the excerpts that come with the current question.
+"""
+
+NO_EXCERPTS = "(No relevant information was found in the knowledge base for this question.)"
+ALREADY_GIVEN = "(The relevant excerpts were already given earlier in this conversation.)"
+
+
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).lower() in ("1", "true", "yes", "on")
+
+
+def normalize_exhibit(exhibit: Optional[str]) -> Optional[str]:
+    # "Asia\\Guanyin/" -> "Asia/Guanyin"；空串为不限范围
+    key = (exhibit or "").replace("\\", "/").strip().strip("/")
+    return key or None
+
+
 class RagOllamaAdapter(AgentInterface):
     def __init__(self) -> None:
         base_dir = Path(__file__).resolve().parent.parent
         self.ollama_model = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
         self.ollama_url = os.getenv("OLLAMA_URL", "http://127.0.0.1:11434/api/generate")
+        # 异步长连接客户端（限并发、超时、keep_alive）；同步 reply 用 requests.Session 复用连接
+        self.ollama = OllamaClient(self.ollama_url)
+        self._session = requests.Session()
         self.doc_dir = Path(os.getenv("RAG_DOC_DIR", str(base_dir / "rag_docs")))
         self.top_k = int(os.getenv("RAG_TOP_K", "5"))
         self.max_distance = float(os.getenv("RAG_MAX_DISTANCE", "0.70"))
@@ -27,155 +80,505 @@ class RagOllamaAdapter(AgentInterface):
         self.embed_model = os.getenv(
             "RAG_EMBED_MODEL", "sentence-transformers/all-MiniLM-L6-v2"
         )
-        db_path = Path(os.getenv("RAG_DB_PATH", str(base_dir / "chroma_db")))
-
-        print(f"[RAG] init chroma db: {db_path}")
-        client = chromadb.PersistentClient(path=str(db_path))
-        embedder = embedding_functions.SentenceTransformerEmbeddingFunction(
-            model_name=self.embed_model
-        )
-        self.collection = client.get_or_create_collection(
-            name=self.collection_name,
-            embedding_function=embedder,
+        self.db_path = Path(os.getenv("RAG_DB_PATH", str(base_dir / "chroma_db")))
+
+        # RAG_EMBED_BACKEND：sentence_transformers（默认）/ onnx（int8 量化，CPU 上更快更省内存）
+        self.embedder = get_embedder(model_name=self.embed_model)
+        print(f"[RAG] embedder: {self.embedder.signature}")
+        # RAG_STORE：chroma（默认）/ numpy（内存映射矩阵 + 精确 top-k，几千条规模下更快更省）
+        self.store = open_store(self.db_path, self.collection_name)
+        print(f"[RAG] vector store: {self.store.signature} @ {self.db_path} ({self.store.count()} chunks)")
+
+        # 入库复用这里已经加载的向量模型
+        self.ingestor = Ingestor(
+            doc_dir=self.doc_dir,
+            db_path=self.db_path,
+            collection_name=self.collection_name,
+            embed_model=self.embed_model,
+            store=self.store,
+            embed_fn=self.embedder,
         )
-        self.index_docs()
-
-    def _all_doc_files(self) -> list[Path]:
-        txt_files = list(self.doc_dir.rglob("*.txt")) if self.doc_dir.exists() else []
-        md_files = list(self.doc_dir.rglob("*.md")) if self.doc_dir.exists() else []
-        return sorted(txt_files + md_files)
-
-    def index_docs(self) -> None:
-        files = self._all_doc_files()
-        print(f"[RAG] docs dir: {self.doc_dir}")
-
-        if not files:
-            self.doc_dir.mkdir(parents=True, exist_ok=True)
-            sample_file = self.doc_dir / "sample.md"
-            sample_file.write_text(
-                "# Hello KB\nThis file is for RAG demo. Put your museum notes here.",
-                encoding="utf-8",
-            )
-            files = [sample_file]
-            print("[RAG] no docs found, sample.md created")
+        # 可见的 chunk id 集合（不可变快照，整体替换即原子切换）；没有清单时为 None，不做过滤
+        self._live_ids: Optional[frozenset[str]] = None
+        # 展区分区（文档目录）-> 可见 chunk id，和 _live_ids 一起整体替换
+        self._partitions: dict[str, frozenset[str]] = {}
+        # 请求不带 exhibit 时的默认范围（每台导览机各自配置）；"*" 表示全馆
+        self.default_exhibit = normalize_exhibit(os.getenv("RAG_EXHIBIT", ""))
+        # 分区里命中不足 RAG_SCOPE_MIN_HITS 条时依次放宽：parent（上级目录）、global（全馆）
+        self.scope_fallback = [x.strip() for x in os.getenv("RAG_SCOPE_FALLBACK", "parent,global").split(",")
+                               if x.strip()]
+        self.scope_min_hits = int(os.getenv("RAG_SCOPE_MIN_HITS", "1"))
+        # 库里暂时不可见的 chunk 数，检索时多取这么多条
+        self._overfetch = 0
+        self.swap_grace_s = float(os.getenv("RAG_SWAP_GRACE_S", "5"))
+        self._reindex_lock = threading.Lock()
+        # 查询向量 / 检索结果 / 语义答案缓存
+        self.cache = QueryCache()
+        # 混合检索：BM25 + 向量，RRF 融合；词法命中足够强时跳过向量化
+        self.hybrid = _env_flag("RAG_HYBRID", "1")
+        self.lexical_fast = _env_flag("RAG_LEXICAL_FAST", "1")
+        self.lexical_fast_score = float(os.getenv("RAG_LEXICAL_FAST_SCORE", "15"))
+        # 单个词的问题只要库里有这个词覆盖率就是 1，不能据此跳过向量化（和距离门槛）
+        self.lexical_fast_min_terms = int(os.getenv("RAG_LEXICAL_FAST_MIN_TERMS", "2"))
+        # 只有词法命中（没有向量距离可比）的 chunk 要过的门槛：BM25 分数和查询词覆盖率
+        self.lexical_min_score = float(os.getenv("RAG_LEXICAL_MIN_SCORE", "3"))
+        self.lexical_min_coverage = float(os.getenv("RAG_LEXICAL_MIN_COVERAGE", "0.5"))
+        self.bm25_top_k = int(os.getenv("RAG_BM25_TOP_K", str(self.top_k * 2)))
+        self.rrf_k = int(os.getenv("RAG_RRF_K", "60"))
+        # prompt 装箱：去近重复、裁到相关句子、整体不超过 RAG_PROMPT_TOKENS（RAG_PACK=0 关闭）
+        self.packer = ContextPacker(idf=lambda t: self.ingestor.bm25.idf(t)) if _env_flag("RAG_PACK", "1") else None
+        # 多轮会话：追问接着上一轮返回的 context 算，只发新的问题和资料
+        self.num_ctx = int(os.getenv("OLLAMA_NUM_CTX", "4096"))
+        # 追问轮的资料预算；从文本重建时带上的历史轮次预算
+        self.followup_tokens = int(os.getenv("RAG_FOLLOWUP_TOKENS", "512"))
+        self.history_tokens = int(os.getenv("RAG_HISTORY_TOKENS", "384"))
+        # context 超过这个长度就不再续接（再加一轮问题和回答会超 num_ctx），下一轮从文本重建
+        self.session_max_context = int(os.getenv("SESSION_MAX_CONTEXT_TOKENS",
+                                                 str(self.num_ctx - self.followup_tokens - 512)))
+        self.sessions = SessionStore()
+
+        # 索引由 rag_ingest.py 离线构建；RAG_INDEX_ON_START=1 时启动时顺带做一次增量入库
+        if _env_flag("RAG_INDEX_ON_START"):
+            self.index_docs()
         else:
-            print(f"[RAG] found docs: {len(files)}")
-
-        ids: list[str] = []
-        texts: list[str] = []
-        metas: list[dict] = []
-        for fp in files:
-            content = fp.read_text(encoding="utf-8", errors="ignore")
-            chunks = [c.strip() for c in content.split("\n\n") if c.strip()]
-            for i, chunk in enumerate(chunks):
-                ids.append(f"{fp}::{i}")
-                texts.append(chunk)
-                metas.append({"source": str(fp), "chunk": i})
-
-        if not ids:
-            return
-
-        existing_ids = set(self.collection.get(ids=ids).get("ids", []))
-        to_add = [(i, t, m) for i, t, m in zip(ids, texts, metas) if i not in existing_ids]
-        if not to_add:
-            print("[RAG] no new chunks")
-            return
-
-        print(f"[RAG] adding chunks: {len(to_add)}")
-        self.collection.add(
-            ids=[x[0] for x in to_add],
-            documents=[x[1] for x in to_add],
-            metadatas=[x[2] for x in to_add],
-        )
-
-    def retrieve(self, query: str) -> list[tuple[str, dict, float]]:
-        res = self.collection.query(
-            query_texts=[query],
-            n_results=self.top_k,
-            include=["documents", "metadatas", "distances"],
-        )
-        docs = res.get("documents", [[]])[0]
-        metas = res.get("metadatas", [[]])[0]
-        dists = res.get("distances", [[]])[0]
-
-        filtered: list[tuple[str, dict, float]] = []
-        for doc, meta, dist in zip(docs, metas, dists):
-            if dist is not None and dist <= self.max_distance:
-                filtered.append((doc, meta, float(dist)))
-        return filtered
-
-    def build_prompt(self, query: str, contexts: list[tuple[str, dict, float]]) -> str:
-        if not contexts:
-            return f"""You are a helpful assistant.
-
-# Role and setting
-You are a museum docent. Your job is to answer visitors' questions based on the museum's knowledge base. Use the same language as the visitor's input.
-
-# Task
-- No relevant information was found in the knowledge base for this question. Say so clearly and politely.
-- You may suggest the visitor go to the information desk or check the museum catalog.
-- Do not present guesses as if they came from the museum's records.
-
-# Visitor question
-{query}
-"""
-
-        context_block = "\n\n".join(
+            if self.ingestor.load_manifest():
+                self._refresh_view()
+                if self.hybrid:
+                    # 词法索引缺失或和清单对不上时从向量库补齐
+                    self.ingestor.sync_bm25(set(self._live_ids))
+            if self.store.count() == 0:
+                print("[RAG] collection is empty, run: python rag_ingest.py")
+
+        # RAG_WATCH=1：后台监听文档目录，改动自动增量重建
+        self.watcher = None
+        if _env_flag("RAG_WATCH"):
+            from rag_watcher import DocWatcher
+            self.watcher = DocWatcher(self.doc_dir, self.reindex_files).start()
+
+    def warmup_steps(self) -> list[tuple[str, Callable, bool]]:
+        # 向量模型先跑一次（第一次推理要初始化），向量库先读一次；
+        # Ollama 是外部服务，没起来不影响本服务就绪，只在 /ready 里显示
+        return [
+            ("embedder", lambda: self.embedder(["warm up"]), True),
+            ("vector_store", self.store.count, True),
+            ("llm", self._preload_llm, False),
+        ]
+
+    async def _preload_llm(self) -> None:
+        await self.ollama.preload(self.ollama_model)
+
+    def index_docs(self) -> dict:
+        # 启动时还没有查询在跑，旧 chunk 直接删
+        report = self.reindex_files(None, grace_s=0)
+        print(f"[RAG] ingest: {summarize(report)}")
+        return report
+
+    def reindex_files(self, rels: Optional[set[str]], grace_s: Optional[float] = None) -> dict:
+        """
+        增量重建（rels 为 None 时检查全部文件），保证进行中的 retrieve 看不到半新半旧的文件：
+        1. 新 chunk 写入库，但不在可见集合里
+        2. 整体替换可见集合
+        3. 等 swap_grace_s 让持有旧快照的查询结束，再删旧 chunk
+        """
+        def on_plan(plan: dict) -> None:
+            # 写库前：新 chunk 写进去还没切换、旧 chunk 切换后还没删，最多这么多条不可见
+            self._overfetch = plan["chunks_added"] + plan["chunks_deleted"]
+
+        with self._reindex_lock:
+            try:
+                report = self.ingestor.run(paths=rels, defer_delete=True, on_plan=on_plan)
+                orphans = report.get("orphans", [])
+                self._overfetch = len(orphans)
+                self._refresh_view()
+                if report.get("added_ids") or orphans:
+                    self.cache.invalidate(set(report.get("added_ids", [])) | set(orphans))
+                if orphans:
+                    time.sleep(self.swap_grace_s if grace_s is None else grace_s)
+                    self.ingestor.delete_chunks(orphans)
+            finally:
+                self._overfetch = 0
+        return report
+
+    def _refresh_view(self) -> None:
+        # 先换分区再换可见集合：查询里两者取交集，不会看到不可见的 chunk
+        self._partitions = {k: frozenset(v) for k, v in self.ingestor.partitions().items()}
+        self._live_ids = frozenset(self.ingestor.live_ids())
+
+    def index_status(self) -> dict:
+        return {
+            "collection": self.collection_name,
+            "store": self.store.stats(),
+            "chunks_visible": None if self._live_ids is None else len(self._live_ids),
+            "partitions": {k or "(root)": len(v) for k, v in sorted(self._partitions.items())},
+            "default_exhibit": self.default_exhibit,
+            "scope_fallback": self.scope_fallback,
+            "watcher": self.watcher.stats() if self.watcher else None,
+            "cache": self.cache.stats(),
+            "sessions": self.sessions.stats(),
+            "ollama": self.ollama.stats(),
+        }
+
+    def embed_query(self, query: str) -> list[float]:
+        key = normalize_query(query)
+        vec = self.cache.embeddings.get(key)
+        if vec is None:
+            with span("embed"):
+                vec = [float(x) for x in self.embedder([query])[0]]
+            self.cache.embeddings.put(key, vec)
+        return vec
+
+    def _query_store(self, vec: list[float], live: Optional[frozenset[str]],
+                     exhibits: Optional[list[str]] = None) -> list[tuple[str, str, dict, float]]:
+        extra = self._overfetch if live is not None else 0
+        with span("vector_query"):
+            res = self.store.query(vec, self.top_k + extra, exhibits=exhibits)
+
+        hits: list[tuple[str, str, dict, float]] = []
+        for cid, doc, meta, dist in res:
+            if live is not None and cid not in live:
+                continue
+            if dist <= self.max_distance:
+                hits.append((cid, doc, meta, dist))
+            if len(hits) >= self.top_k:
+                break
+        return hits
+
+    def _lexical(self, query: str, live: Optional[frozenset[str]]) -> list[tuple[str, float, float]]:
+        if not self.hybrid or not len(self.ingestor.bm25):
+            return []
+        with span("lexical"):
+            return self.ingestor.bm25.search(query, self.bm25_top_k, allowed=live)
+
+    def _lexical_is_strong(self, query: str, lexical: list[tuple[str, float, float]]) -> bool:
+        # 最高分的 chunk 含全部查询词（至少两个）、且分数够高（说明命中了稀有词，如馆藏号、人名、朝代）
+        if not self.lexical_fast or not lexical:
+            return False
+        if len(set(tokenize(query))) < self.lexical_fast_min_terms:
+            return False
+        _, score, coverage = lexical[0]
+        return coverage >= 1.0 and score >= self.lexical_fast_score
+
+    def _lexical_admits(self, score: float, coverage: float) -> bool:
+        return score >= self.lexical_min_score and coverage >= self.lexical_min_coverage
+
+    def _fuse(self, dense: list[tuple[str, str, dict, float]], lexical: list[tuple[str, float, float]]
+              ) -> list[tuple[str, str, dict, float]]:
+        by_id = {cid: (cid, doc, meta, dist) for cid, doc, meta, dist in dense}
+        docs = self.ingestor.bm25.docs
+        # 没有任何向量命中落在 max_distance 内，说明问题和馆藏无关：只凭一个常见词（painting、museum、朝代名）
+        # 词法命中的 chunk 不算数，照常走"没找到"；有向量命中时，词法独有的也要过分数和覆盖率门槛
+        ranked = [cid for cid, score, coverage in lexical
+                  if cid in by_id or (dense and self._lexical_admits(score, coverage))]
+        fused = rrf_merge([[h[0] for h in dense], ranked], k=self.rrf_k) if ranked else \
+            [(h[0], 0.0) for h in dense]
+        out: list[tuple[str, str, dict, float]] = []
+        for cid, _ in fused:
+            if cid in by_id:
+                out.append(by_id[cid])
+            elif cid in docs:
+                # 只有词法命中，没有向量距离
+                text, meta = docs[cid]
+                out.append((cid, text, meta, float("nan")))
+            if len(out) >= self.top_k:
+                break
+        return out
+
+    def scope_chain(self, exhibit: Optional[str]) -> list[Optional[str]]:
+        """检索范围的回退链，比如 asia/guanyin -> asia -> 全馆（None）"""
+        if exhibit is None or exhibit == "*":
+            return [None]
+        chain: list[Optional[str]] = [exhibit]
+        if "parent" in self.scope_fallback:
+            parent = exhibit
+            while "/" in parent:
+                parent = parent.rpartition("/")[0]
+                chain.append(parent)
+        if "global" in self.scope_fallback:
+            chain.append(None)
+        return chain
+
+    @staticmethod
+    def _scope_keys(scope: str, partitions: dict[str, frozenset[str]]) -> list[str]:
+        # 一个范围包含它下面所有子目录的分区
+        prefix = scope + "/"
+        return [k for k in partitions if k == scope or k.startswith(prefix)]
+
+    def _search_scoped(self, query: str, vec: Optional[list[float]], live: Optional[frozenset[str]],
+                       keys: Optional[list[str]], allowed: Optional[frozenset[str]]
+                       ) -> tuple[Optional[list[float]], list[tuple[str, str, dict, float]]]:
+        lexical = self._lexical(query, allowed)
+        if self._lexical_is_strong(query, lexical):
+            # 第一条已经够强；后面的同样没有向量距离，要过和融合时一样的门槛
+            docs = self.ingestor.bm25.docs
+            hits = [(cid, *docs[cid], float("nan")) for i, (cid, score, coverage) in enumerate(lexical[: self.top_k])
+                    if cid in docs and (i == 0 or self._lexical_admits(score, coverage))]
+            return vec, hits
+        vec = vec if vec is not None else self.embed_query(query)
+        dense = self._query_store(vec, live, keys)
+        return vec, (self._fuse(dense, lexical) if lexical else dense)
+
+    def _search_uncached(self, query: str, exhibit: Optional[str] = None
+                         ) -> tuple[Optional[list[float]], list[tuple[str, str, dict, float]]]:
+        live = self._live_ids  # 取一次快照，整个查询只用它
+        partitions = self._partitions
+        vec: Optional[list[float]] = None
+        hits: list[tuple[str, str, dict, float]] = []
+        chain = self.scope_chain(exhibit)
+        for scope in chain:
+            if scope is None:
+                keys, allowed = None, live
+            else:
+                keys = self._scope_keys(scope, partitions)
+                if not keys:
+                    continue
+                allowed = frozenset().union(*(partitions[k] for k in keys))
+            vec, hits = self._search_scoped(query, vec, live, keys, allowed)
+            if len(hits) >= self.scope_min_hits:
+                if scope != chain[0]:
+                    print(f"[RAG] scope {exhibit} -> {scope or 'global'}")
+                break
+        return vec, hits
+
+    def search(self, query: str, exhibit: Optional[str] = None
+               ) -> tuple[Optional[list[float]], list[tuple[str, dict, float]], frozenset[str]]:
+        """
+        返回 (查询向量, 检索结果, 命中的 chunk id 集合)，先查缓存。
+        走词法快速路径时没有查询向量（为 None），也就不查语义答案缓存。
+        exhibit 为展区范围（文档目录），不给时用 RAG_EXHIBIT。
+        """
+        exhibit = normalize_exhibit(exhibit) or self.default_exhibit
+        key = (normalize_query(query), exhibit)
+        version = self.cache.version
+        hit = self.cache.results.get(key)
+        if hit is not None:
+            contexts, ids, dense = hit
+            return (self.embed_query(query) if dense else None), contexts, ids
+        with span("retrieve"):
+            vec, hits = self._search_uncached(query, exhibit)
+        contexts = [(doc, meta, dist) for _, doc, meta, dist in hits]
+        ids = frozenset(h[0] for h in hits)
+        self.cache.put_results(key, (contexts, ids, vec is not None), version)
+        return vec, contexts, ids
+
+    def retrieve(self, query: str, exhibit: Optional[str] = None) -> list[tuple[str, dict, float]]:
+        return self.search(query, exhibit)[1]
+
+    @staticmethod
+    def _context_block(contexts: list[tuple[str, dict, float]]) -> str:
+        return "\n\n".join(
             [
-                f"[{i+1}] {chunk}\n(Source: {meta['source']} #{meta['chunk']}; distance={dist:.3f})"
+                f"[{i+1}] {chunk}\n(Source: {meta['source']} #{meta['chunk']}"
+                + (f" / {meta['section']}; " if meta.get("section") else "; ")
+                + (f"distance={dist:.3f})" if dist == dist else "keyword match)")
                 for i, (chunk, meta, dist) in enumerate(contexts)
             ]
         )
-        return f"""You are a helpful assistant.
-
-# Role and setting
-You are a museum docent. Use the museum knowledge base excerpts below when they are relevant. Use the same language as the visitor's input.
-
-# Relevance and how to answer
-1. **Judge relevance**: Is the visitor's question related to the topic of the Context below? If the question is clearly about something else (e.g. unrelated artist, unrelated museum), say that it was not found in the museum's records and do not invent an answer.
-
-2. **When the Context directly answers the question**: Answer from the Context and cite excerpt numbers [1], [2] where appropriate.
-
-3. **When you cannot give a valid answer from [2]** (e.g. the question asks "why" or "the reason" and the Context only says *that* something is so, not *why*): then follow this step instead:
-   - First state what *is* in the knowledge base (with [number] if useful).
-   - Then say clearly: "This is not stated in our museum's knowledge base" or "The records don't give the reason."
-   - After that, you may add: "But one possible explanation is ..." or "I think a likely reason could be ..." and give a short, reasonable inference. Always make it obvious that this part is your own suggestion, not from the records.
-
-# Guidelines
-- Never present your own inference or guess as if it came from the knowledge base.
-- Keep answers concise; cite [1], [2] for any claim that comes from the Context.
 
+    @staticmethod
+    def _prompt_head(system_prompt: Optional[str]) -> str:
+        # 固定的说明在最前面，逐字不变，上游的 KV 缓存（以及会话的 context）才能复用
+        if not system_prompt:
+            return DOCENT_INSTRUCTIONS
+        return f"{DOCENT_INSTRUCTIONS}\n# Additional instructions\n{system_prompt}\n"
+
+    def _history_block(self, history: list[tuple[str, str]]) -> str:
+        # 从文本重建时带上最近几轮（从新往旧，不超过 history_tokens）
+        lines: list[str] = []
+        used = 0
+        for question, answer in reversed(history):
+            turn = f"Visitor: {question}\nDocent: {answer}"
+            used += count_tokens(turn)
+            if lines and used > self.history_tokens:
+                break
+            lines.append(turn)
+        if not lines:
+            return ""
+        return "\n# Earlier in this conversation\n" + "\n\n".join(reversed(lines)) + "\n"
+
+    @staticmethod
+    def _turn_block(query: str, excerpts: str) -> str:
+        return f"""
 # Visitor question
 {query}
 
 # Museum knowledge base excerpts (ordered by relevance)
-{context_block}
+{excerpts}
 """
 
-    def call_ollama(self, prompt: str, system_prompt: Optional[str] = None) -> str:
-        final_prompt = prompt
-        if system_prompt:
-            final_prompt = f"{system_prompt}\n\n{prompt}"
-
-        resp = requests.post(
-            self.ollama_url,
-            json={
-                "model": self.ollama_model,
-                "prompt": final_prompt,
-                "stream": False,
-                "options": {
-                    "template": "{{ .Prompt }}",
-                    "num_ctx": 4096,
-                    "temperature": 0.2,
-                },
+    def build_prompt(self, query: str, contexts: list[tuple[str, dict, float]],
+                     system_prompt: Optional[str] = None, history: Optional[list[tuple[str, str]]] = None,
+                     continued: bool = False, session: Optional[Session] = None) -> str:
+        """
+        完整 prompt = 固定说明 + system + 之前几轮（history）+ 本轮问题和资料；
+        continued=True 时接着会话的 context 往下写，只有本轮问题和资料，context 里已有的资料不再重复。
+        给了 session 时把本轮放进 prompt 的资料记到 session.pending。
+        """
+        with span("build_prompt"):
+            return self._build_prompt(query, contexts, system_prompt, history or [], continued, session)
+
+    @staticmethod
+    def _excerpt_key(meta: dict) -> str:
+        return f"{meta.get('source')}#{meta.get('chunk')}"
+
+    def _build_prompt(self, query: str, contexts: list[tuple[str, dict, float]], system_prompt: Optional[str],
+                      history: list[tuple[str, str]], continued: bool, session: Optional[Session]) -> str:
+        head = "\n" if continued else self._prompt_head(system_prompt) + self._history_block(history)
+        sent = session.sent if continued and session is not None else {}
+
+        def fresh(items: list[tuple[str, dict, float]]) -> list[tuple[str, dict, float]]:
+            # 原文已经在 context 里的资料不再发
+            return [c for c in items if c[0] not in sent.get(self._excerpt_key(c[1]), "")]
+
+        def finish(items: list[tuple[str, dict, float]]) -> str:
+            if session is not None:
+                session.pending = {self._excerpt_key(m): doc for doc, m, _ in items}
+            if items:
+                return head + self._turn_block(query, self._context_block(items))
+            return head + self._turn_block(query, ALREADY_GIVEN if contexts else NO_EXCERPTS)
+
+        if not contexts or self.packer is None:
+            prompt = finish(fresh(contexts))
+            PROMPT_TOKENS.observe(count_tokens(prompt), "raw")
+            return prompt
+
+        # 按 token 预算装箱：去近重复、裁到相关句子、超预算截断；追问轮的预算另算（前几轮的资料还在 context 里）
+        limit = self.followup_tokens if continued else self.packer.budget_tokens
+        before = count_tokens(head + self._turn_block(query, self._context_block(contexts)))
+        base = count_tokens(head + self._turn_block(query, ""))
+        # 每条的编号和来源行开销
+        overhead = count_tokens(self._context_block([("", contexts[0][1], contexts[0][2])])) + 2
+        budget = max(0, limit - base)
+        candidates = fresh(contexts)
+        packed = fresh(self.packer.pack(query, candidates, budget, per_chunk_overhead=overhead)) if candidates else []
+        prompt = finish(packed)
+        after = count_tokens(prompt)
+        PROMPT_TOKENS.observe(before, "raw")
+        PROMPT_TOKENS.observe(after, "packed")
+        print(f"[RAG] prompt tokens {before} -> {after} "
+              f"(chunks {len(contexts)} -> {len(packed)}, budget {limit}{', continued' if continued else ''})")
+        return prompt
+
+    def _ollama_payload(self, prompt: str, stream: bool, context: Optional[list[int]] = None) -> dict:
+        payload = {
+            "model": self.ollama_model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {
+                "template": "{{ .Prompt }}",
+                "num_ctx": self.num_ctx,
+                "temperature": 0.2,
             },
-            timeout=600,
+        }
+        if context:
+            # 上一轮返回的 token 序列：Ollama 接着它往下算，不重新处理前面的内容
+            payload["context"] = context
+        return payload
+
+    def call_ollama(self, prompt: str, context: Optional[list[int]] = None, meta: Optional[dict] = None) -> str:
+        # 同步路径（脚本/调试用），服务里走 reply_async / stream_reply
+        resp = self._session.post(
+            self.ollama_url,
+            json=self.ollama.with_keep_alive(self._ollama_payload(prompt, stream=False, context=context)),
+            timeout=(LLM_CONNECT_TIMEOUT_S, LLM_READ_TIMEOUT_S),
         )
         resp.raise_for_status()
         data = resp.json()
+        if meta is not None:
+            meta["context"] = data.get("context")
         return (data.get("response") or "").strip()
 
-    def reply(self, text: str, system_prompt: Optional[str] = None) -> str:
-        contexts = self.retrieve(text)
-        prompt = self.build_prompt(text, contexts)
-        return self.call_ollama(prompt, system_prompt=system_prompt)
+    def _prepare(self, text: str, system_prompt: Optional[str], exhibit: Optional[str] = None,
+                 session: Optional[Session] = None
+                 ) -> tuple[Optional[list[float]], frozenset[str], Optional[str], Optional[str], Optional[list[int]]]:
+        """检索 + 查答案缓存 + 拼 prompt，返回 (查询向量, chunk id, 缓存的答案, prompt, 续接的 context)"""
+        followup = session is not None and len(session.turns) > 0
+        # 追问常省略主语（"它是哪个朝代的"），和上一个问题一起检索
+        query = f"{session.turns[-1][0]} {text}" if followup else text
+        vec, contexts, ids = self.search(query, exhibit)
+        if followup:
+            # 追问的意思依赖上下文，不查也不存答案缓存（向量为 None 时缓存直接跳过）
+            vec = None
+        cached = self.cache.lookup_answer(vec, ids, system_prompt)
+        if cached is not None:
+            return vec, ids, cached, None, None
+        context = session.resume_context(system_prompt, self.session_max_context) if session else None
+        if context is not None:
+            return vec, ids, None, self.build_prompt(text, contexts, continued=True, session=session), context
+        history = list(session.turns) if session else None
+        return vec, ids, None, self.build_prompt(text, contexts, system_prompt, history, session=session), None
+
+    @staticmethod
+    def _next_context(context: Optional[list[int]], meta: dict) -> Optional[list[int]]:
+        # 续接时上游实际算的 token 比传过去的 context 还多，说明它的 KV 缓存里已经没有这个会话
+        # （并行槽被别的对话占了），整段 context 重算了一遍；下一轮改从文本重建，比带着越来越长的 context 重算便宜
+        if context and meta.get("prompt_eval_count", 0) > len(context):
+            return None
+        return meta.get("context")
+
+    def _session_lock(self, session: Optional[Session]):
+        # 同一会话的轮次排队执行（下一轮要用上一轮的 context）
+        return session.lock if session is not None else contextlib.nullcontext()
+
+    def reply(self, text: str, system_prompt: Optional[str] = None, exhibit: Optional[str] = None,
+              session_id: Optional[str] = None) -> str:
+        session = self.sessions.get(session_id) if session_id else None
+        vec, ids, cached, prompt, context = self._prepare(text, system_prompt, exhibit, session)
+        if cached is not None:
+            if session is not None:
+                session.record(text, cached, None, system_prompt)
+            return cached
+        meta: dict = {}
+        answer = self.call_ollama(prompt, context=context, meta=meta)
+        self.cache.store_answer(vec, ids, system_prompt, answer)
+        if session is not None:
+            session.record(text, answer, self._next_context(context, meta), system_prompt)
+        return answer
+
+    async def reply_async(self, text: str, system_prompt: Optional[str] = None,
+                          exhibit: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        session = self.sessions.get(session_id) if session_id else None
+        async with self._session_lock(session):
+            # 检索（向量化）在线程里做，等 Ollama 的过程不占线程
+            vec, ids, cached, prompt, context = await asyncio.to_thread(
+                self._prepare, text, system_prompt, exhibit, session)
+            if cached is not None:
+                if session is not None:
+                    session.record(text, cached, None, system_prompt)
+                return cached
+            meta: dict = {}
+            answer = await self.ollama.generate(self._ollama_payload(prompt, stream=False, context=context), meta)
+            self.cache.store_answer(vec, ids, system_prompt, answer)
+            if session is not None:
+                session.record(text, answer, self._next_context(context, meta), system_prompt)
+            return answer
+
+    async def stream_reply(self, text: str, system_prompt: Optional[str] = None,
+                           exhibit: Optional[str] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        session = self.sessions.get(session_id) if session_id else None
+        async with self._session_lock(session):
+            vec, ids, cached, prompt, context = await asyncio.to_thread(
+                self._prepare, text, system_prompt, exhibit, session)
+            if cached is not None:
+                if session is not None:
+                    session.record(text, cached, None, system_prompt)
+                yield cached
+                return
+            parts: list[str] = []
+            meta: dict = {}
+            try:
+                async for piece in self.ollama.stream(self._ollama_payload(prompt, stream=True, context=context), meta):
+                    parts.append(piece)
+                    yield piece
+            finally:
+                if session is not None:
+                    # 被打断时上游没返回 context，记下已说出的部分，下一轮从文本重建
+                    session.record(text, "".join(parts).strip(), self._next_context(context, meta), system_prompt)
+            # 只缓存完整生成的答案
+            self.cache.store_answer(vec, ids, system_prompt, "".join(parts).strip())
+
+    async def end_session(self, session_id: str) -> bool:
+        return self.sessions.drop(session_id)
+
+    async def aclose(self) -> None:
+        await self.ollama.aclose()
+        self._session.close()
@@ -0,0 +1,139 @@
+# server/rag_packer.py
+from __future__ import annotations
+
+import math
+import os
+from collections import Counter
+from typing import Callable, Optional
+
+from rag_bm25 import tokenize
+from rag_chunker import count_tokens, split_sentences
+
+# 整个 prompt（含模板、system、问题）的 token 预算
+PROMPT_TOKENS = int(os.getenv("RAG_PROMPT_TOKENS", "1536"))
+# MMR 里相关性的权重，越小越偏向多样性
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+# 和已选 chunk 的词袋余弦相似度超过这个值视为近重复，直接丢掉
+DUP_SIM = float(os.getenv("RAG_DUP_SIM", "0.85"))
+# 超过这个长度的 chunk 才裁剪到相关句子
+TRIM_MIN_TOKENS = int(os.getenv("RAG_TRIM_MIN_TOKENS", "60"))
+# idf 低于这个值的查询词（大部分 chunk 都有，如 "Guanyin"）不用来判断句子是否相关
+KEY_TERM_IDF = 1.0
+
+Context = tuple[str, dict, float]
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    if not a or not b:
+        return 0.0
+    if len(a) > len(b):
+        a, b = b, a
+    dot = sum(v * b.get(k, 0) for k, v in a.items())
+    na = math.sqrt(sum(v * v for v in a.values()))
+    nb = math.sqrt(sum(v * v for v in b.values()))
+    return dot / (na * nb) if na and nb else 0.0
+
+
+class ContextPacker:
+    """
+    把检索结果装进固定的 token 预算：
+    1. MMR 选 chunk：相关性按检索名次，多样性按词袋余弦，近重复直接丢
+    2. 长 chunk 只留含查询词的句子及其前后各一句（一句都不含就整段保留）
+    3. 按选中顺序装箱，装不下的 chunk 按查询词权重挑句子填满剩余预算
+    idf 用来给查询词加权（传 BM25 索引的 idf），不传则等权。
+    """
+
+    def __init__(self, budget_tokens: int = PROMPT_TOKENS, mmr_lambda: float = MMR_LAMBDA,
+                 dup_sim: float = DUP_SIM, trim_min_tokens: int = TRIM_MIN_TOKENS,
+                 idf: Optional[Callable[[str], float]] = None):
+        self.budget_tokens = budget_tokens
+        self.mmr_lambda = mmr_lambda
+        self.dup_sim = dup_sim
+        self.trim_min_tokens = trim_min_tokens
+        self.idf = idf
+
+    def _select(self, contexts: list[Context]) -> list[int]:
+        bags = [Counter(tokenize(c[0])) for c in contexts]
+        n = len(contexts)
+        # 检索结果已按相关性排好，名次越前相关性越高
+        rel = [1.0 - i / n for i in range(n)]
+        remaining = list(range(n))
+        chosen: list[int] = []
+        while remaining:
+            best, best_score = None, -math.inf
+            for i in list(remaining):
+                sim = max((_cosine(bags[i], bags[j]) for j in chosen), default=0.0)
+                if sim >= self.dup_sim:
+                    remaining.remove(i)
+                    continue
+                score = self.mmr_lambda * rel[i] - (1.0 - self.mmr_lambda) * sim
+                if score > best_score:
+                    best, best_score = i, score
+            if best is None:
+                break
+            chosen.append(best)
+            remaining.remove(best)
+        return chosen
+
+    def _key_terms(self, query: str) -> set[str]:
+        terms = set(tokenize(query))
+        if self.idf is None:
+            return terms
+        key = {t for t in terms if self.idf(t) >= KEY_TERM_IDF}
+        return key or terms
+
+    def _trim(self, query_terms: set[str], text: str) -> list[str]:
+        sents = split_sentences(text)
+        if len(sents) <= 2 or count_tokens(text) <= self.trim_min_tokens:
+            return sents
+        keep: set[int] = set()
+        for i, s in enumerate(sents):
+            if query_terms & set(tokenize(s)):
+                keep.update((i - 1, i, i + 1))
+        if not keep:
+            return sents
+        return [s for i, s in enumerate(sents) if i in keep]
+
+    def _sentence_order(self, query_terms: set[str], sents: list[str]) -> list[int]:
+        # 截断时优先保留查询词权重高的句子（返回下标，权重降序）
+        def weight(s: str) -> float:
+            terms = query_terms & set(tokenize(s))
+            return sum(self.idf(t) if self.idf else 1.0 for t in terms)
+        return sorted(range(len(sents)), key=lambda i: (-weight(sents[i]), i))
+
+    def pack(self, query: str, contexts: list[Context], budget: int,
+             per_chunk_overhead: int = 0) -> list[Context]:
+        """budget 为留给所有 chunk 正文的 token 数；per_chunk_overhead 为每条的编号、来源行开销"""
+        if not contexts:
+            return []
+        query_terms = self._key_terms(query)
+        packed: list[Context] = []
+        used = 0
+        for i in self._select(contexts):
+            text, meta, dist = contexts[i]
+            sents = self._trim(query_terms, text)
+            cost = count_tokens(" ".join(sents)) + per_chunk_overhead
+            if used + cost > budget:
+                # 放不下整段：按权重挑句子，直到填满剩余预算
+                room = budget - used - per_chunk_overhead
+                order = self._sentence_order(query_terms, sents)
+                picked: set[int] = set()
+                size = 0
+                for j in order:
+                    n = count_tokens(sents[j])
+                    if size + n <= room:
+                        picked.add(j)
+                        size += n
+                if not picked:
+                    if packed or not order:
+                        # 已经有资料，或者这段根本没有句子（空文本）：跳过，让后面的 chunk 来兜底
+                        continue
+                    # 第一条至少留最相关的一句，否则模型没有任何依据
+                    picked = {order[0]}
+                sents = [s for j, s in enumerate(sents) if j in picked]
+                cost = count_tokens(" ".join(sents)) + per_chunk_overhead
+            packed.append((" ".join(sents), meta, dist))
+            used += cost
+            if used >= budget:
+                break
+        return packed
@@ -0,0 +1,393 @@
+# server/rag_store.py
+"""
+向量库后端（RAG_STORE）：
+- chroma：chromadb.PersistentClient（原来的方式）
+- numpy：几千条 chunk 的规模下直接精确检索一个小矩阵，启动快、内存小、单次查询开销低。
+  向量归一化后存成 .npy（float32，或 RAG_STORE_DTYPE=float16 再省一半），只读内存映射；
+  id / 正文 / 元数据存在旁边的 json 里。
+
+距离语义和 Chroma 默认（l2 空间）一致：返回平方欧氏距离，向量归一化后等于 2 - 2·cos，
+所以 RAG_MAX_DISTANCE 在两种后端下含义相同（默认的 all-MiniLM-L6-v2 本身输出就是归一化的）。
+"""
+from __future__ import annotations
+
+import abc
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Optional, Sequence
+
+import numpy as np
+
+RAG_STORE = os.getenv("RAG_STORE", "chroma")
+RAG_STORE_DTYPE = os.getenv("RAG_STORE_DTYPE", "float32")
+
+STORE_VERSION = 1
+# float16 查询时分块转成 float32 再乘，避免一次复制整个矩阵
+_F16_BLOCK = 8192
+
+# (id, 正文, 元数据, 距离)
+Hit = tuple[str, str, dict, float]
+
+
+class VectorStore(abc.ABC):
+    # 入库（Ingestor）和检索（RagOllamaAdapter）只通过这些方法访问向量库
+
+    name = ""
+
+    @property
+    def signature(self) -> str:
+        # 写进入库清单：换后端要全量重建
+        return self.name
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def ids(self) -> set[str]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get(self, ids: Sequence[str]) -> list[tuple[str, str, dict]]:
+        # 按 id 取 (id, 正文, 元数据)，不存在的跳过
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def upsert(self, ids: Sequence[str], documents: Sequence[str], metadatas: Sequence[dict],
+               embeddings: Sequence[Sequence[float]]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_metadatas(self, ids: Sequence[str], metadatas: Sequence[dict]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, ids: Sequence[str]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def query(self, vec: Sequence[float], n: int, exhibits: Optional[Sequence[str]] = None) -> list[Hit]:
+        # 最近的 n 条，按距离升序；exhibits 给出时只在这些分区（元数据 exhibit）里找
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        # 可选：把改动落盘（一次入库结束时调用）
+        return None
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "chunks": self.count()}
+
+
+def open_collection(db_path: Path, name: str, embedding_function=None):
+    import chromadb
+    client = chromadb.PersistentClient(path=str(db_path))
+    return client.get_or_create_collection(name=name, embedding_function=embedding_function)
+
+
+class ChromaStore(VectorStore):
+    name = "chroma"
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    @classmethod
+    def open(cls, db_path: Path, collection_name: str) -> "ChromaStore":
+        # 向量都由调用方算好传入，集合上不挂 embedding_function
+        return cls(open_collection(db_path, collection_name))
+
+    def count(self) -> int:
+        return self.collection.count()
+
+    def ids(self) -> set[str]:
+        return set(self.collection.get(include=[]).get("ids", []))
+
+    def get(self, ids: Sequence[str]) -> list[tuple[str, str, dict]]:
+        out: list[tuple[str, str, dict]] = []
+        for off in range(0, len(ids), 1000):
+            res = self.collection.get(ids=list(ids[off:off + 1000]), include=["documents", "metadatas"])
+            out.extend(zip(res.get("ids", []), res.get("documents", []), res.get("metadatas", [])))
+        return out
+
+    def upsert(self, ids, documents, metadatas, embeddings) -> None:
+        self.collection.upsert(ids=list(ids), documents=list(documents), metadatas=list(metadatas),
+                               embeddings=[list(map(float, e)) for e in embeddings])
+
+    def update_metadatas(self, ids, metadatas) -> None:
+        for off in range(0, len(ids), 1000):
+            self.collection.update(ids=list(ids[off:off + 1000]), metadatas=list(metadatas[off:off + 1000]))
+
+    def delete(self, ids) -> None:
+        for off in range(0, len(ids), 1000):
+            self.collection.delete(ids=list(ids[off:off + 1000]))
+
+    def query(self, vec, n, exhibits=None) -> list[Hit]:
+        if n <= 0 or (exhibits is not None and not exhibits):
+            return []
+        where = None
+        if exhibits is not None:
+            keys = list(exhibits)
+            where = {"exhibit": keys[0]} if len(keys) == 1 else {"exhibit": {"$in": keys}}
+        res = self.collection.query(
+            query_embeddings=[list(map(float, vec))],
+            n_results=n,
+            where=where,
+            include=["documents", "metadatas", "distances"],
+        )
+        return [
+            (cid, doc, meta, float(dist))
+            for cid, doc, meta, dist in zip(
+                res.get("ids", [[]])[0], res.get("documents", [[]])[0],
+                res.get("metadatas", [[]])[0], res.get("distances", [[]])[0],
+            )
+            if dist is not None
+        ]
+
+
+class _Snapshot:
+    # 不可变：改动时整体替换，查询线程拿到的快照不会被改到一半
+    __slots__ = ("matrix", "ids", "documents", "metadatas", "rows", "parts")
+
+    def __init__(self, matrix: np.ndarray, ids: list[str], documents: list[str], metadatas: list[dict]):
+        self.matrix = matrix
+        self.ids = ids
+        self.documents = documents
+        self.metadatas = metadatas
+        self.rows = {cid: i for i, cid in enumerate(ids)}
+        # 分区 -> 行：落盘时按分区排好序，所以通常是连续的一段（切片不复制，只读到这段的页）
+        parts: dict[str, list[int]] = {}
+        for i, meta in enumerate(metadatas):
+            parts.setdefault(_exhibit(meta), []).append(i)
+        self.parts: dict[str, "slice | np.ndarray"] = {
+            k: slice(v[0], v[-1] + 1) if v[-1] - v[0] + 1 == len(v) else np.asarray(v)
+            for k, v in parts.items()
+        }
+
+
+def _exhibit(meta: Optional[dict]) -> str:
+    return (meta or {}).get("exhibit", "")
+
+
+class NumpyStore(VectorStore):
+    """
+    精确 top-k：一次矩阵乘得到全部余弦，argpartition 取前 n。
+    落盘文件（都在 db_path 下）：
+    - <集合名>.numpy.json：id、正文、元数据（按行顺序）和当前向量文件名
+    - <集合名>.vectors.<代数>.npy：向量矩阵，以只读内存映射打开
+    每次 flush 写新一代向量文件再替换 json，旧文件尽量删掉（Windows 上还被映射的删不掉，下次再删）。
+    """
+
+    name = "numpy"
+
+    def __init__(self, db_path: Path, collection_name: str, dtype: str = RAG_STORE_DTYPE):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"unsupported RAG_STORE_DTYPE: {dtype} (float32 | float16)")
+        self.db_path = Path(db_path)
+        self.collection_name = collection_name
+        self.dtype = np.dtype(dtype)
+        self.meta_path = self.db_path / f"{collection_name}.numpy.json"
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._dirty = False
+        self._snap = self._load()
+
+    @property
+    def signature(self) -> str:
+        return f"numpy-{self.dtype.name}"
+
+    # 持久化
+
+    def _empty(self, dim: int = 0) -> _Snapshot:
+        return _Snapshot(np.zeros((0, dim), dtype=self.dtype), [], [], [])
+
+    def _load(self) -> _Snapshot:
+        try:
+            data = json.loads(self.meta_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return self._empty()
+        if data.get("version") != STORE_VERSION:
+            return self._empty()
+        self._generation = int(data.get("generation", 0))
+        ids = data.get("ids", [])
+        if not ids:
+            return self._empty(int(data.get("dim", 0)))
+        matrix = np.load(self.db_path / data["vectors"], mmap_mode="r")
+        if matrix.shape[0] != len(ids):
+            raise RuntimeError(f"{self.meta_path} does not match {data['vectors']} "
+                               f"(rows {matrix.shape[0]} vs {len(ids)}); run: python rag_ingest.py --full")
+        if matrix.dtype != self.dtype:
+            # 改了 RAG_STORE_DTYPE：先转成内存副本，清单签名变了下次入库会全量重建
+            matrix = matrix.astype(self.dtype)
+        return _Snapshot(matrix, ids, data.get("documents", []), data.get("metadatas", []))
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            snap = self._partition_order(self._snap)
+            self.db_path.mkdir(parents=True, exist_ok=True)
+            self._generation += 1
+            vec_name = f"{self.collection_name}.vectors.{self._generation}.npy"
+            np.save(self.db_path / vec_name, np.ascontiguousarray(snap.matrix, dtype=self.dtype))
+            data = {
+                "version": STORE_VERSION,
+                "generation": self._generation,
+                "dtype": self.dtype.name,
+                "dim": int(snap.matrix.shape[1]),
+                "vectors": vec_name,
+                "ids": snap.ids,
+                "documents": snap.documents,
+                "metadatas": snap.metadatas,
+            }
+            tmp = self.meta_path.with_name(self.meta_path.name + ".tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.meta_path)
+            # 换成新文件的映射，内存里的副本可以释放
+            self._snap = _Snapshot(np.load(self.db_path / vec_name, mmap_mode="r"),
+                                   snap.ids, snap.documents, snap.metadatas)
+            self._dirty = False
+            self._remove_old_generations(vec_name)
+
+    @staticmethod
+    def _partition_order(snap: _Snapshot) -> _Snapshot:
+        # 同一分区的行排在一起，只查一个分区时只碰这一段内存
+        order = sorted(range(len(snap.ids)), key=lambda i: _exhibit(snap.metadatas[i]))
+        if order == list(range(len(order))):
+            return snap
+        return _Snapshot(np.asarray(snap.matrix[order]), [snap.ids[i] for i in order],
+                         [snap.documents[i] for i in order], [snap.metadatas[i] for i in order])
+
+    def _remove_old_generations(self, keep: str) -> None:
+        for fp in self.db_path.glob(f"{self.collection_name}.vectors.*.npy"):
+            if fp.name != keep:
+                try:
+                    fp.unlink()
+                except OSError:
+                    pass
+
+    # 读
+
+    def count(self) -> int:
+        return len(self._snap.ids)
+
+    def ids(self) -> set[str]:
+        return set(self._snap.ids)
+
+    def get(self, ids: Sequence[str]) -> list[tuple[str, str, dict]]:
+        snap = self._snap
+        rows = [snap.rows[cid] for cid in ids if cid in snap.rows]
+        return [(snap.ids[i], snap.documents[i], snap.metadatas[i]) for i in rows]
+
+    def _scores(self, matrix: np.ndarray, q: np.ndarray) -> np.ndarray:
+        if matrix.dtype == np.float32:
+            return matrix @ q
+        out = np.empty(matrix.shape[0], dtype=np.float32)
+        for off in range(0, matrix.shape[0], _F16_BLOCK):
+            out[off:off + _F16_BLOCK] = matrix[off:off + _F16_BLOCK].astype(np.float32) @ q
+        return out
+
+    def query(self, vec, n, exhibits=None) -> list[Hit]:
+        snap = self._snap
+        if n <= 0 or not snap.ids:
+            return []
+        q = _unit(np.asarray(vec, dtype=np.float32))
+        if exhibits is None:
+            rows = None
+            scores = self._scores(snap.matrix, q)
+        else:
+            segs = [snap.parts[k] for k in exhibits if k in snap.parts]
+            if not segs:
+                return []
+            rows = np.concatenate([np.arange(s.start, s.stop) if isinstance(s, slice) else s for s in segs])
+            scores = np.concatenate([self._scores(snap.matrix[s], q) for s in segs])
+        total = len(scores)
+        n = min(n, total)
+        top = np.argpartition(-scores, n - 1)[:n] if n < total else np.arange(total)
+        top = top[np.argsort(-scores[top], kind="stable")]
+        # 单位向量的平方欧氏距离，和 Chroma l2 空间一致
+        dists = np.clip(2.0 - 2.0 * scores[top], 0.0, None)
+        if rows is not None:
+            top = rows[top]
+        return [(snap.ids[i], snap.documents[i], snap.metadatas[i], float(d)) for i, d in zip(top, dists)]
+
+    # 写：复制一份改完再整体替换
+
+    def upsert(self, ids, documents, metadatas, embeddings) -> None:
+        if not len(ids):
+            return
+        vecs = _unit(np.asarray(embeddings, dtype=np.float32)).astype(self.dtype)
+        with self._lock:
+            snap = self._snap
+            if snap.ids and vecs.shape[1] != snap.matrix.shape[1]:
+                raise ValueError(f"embedding dim {vecs.shape[1]} != store dim {snap.matrix.shape[1]}")
+            new_ids, new_docs, new_metas = list(snap.ids), list(snap.documents), list(snap.metadatas)
+            rows = dict(snap.rows)
+            replace: list[tuple[int, int]] = []
+            append: list[int] = []
+            for j, cid in enumerate(ids):
+                i = rows.get(cid)
+                if i is None:
+                    rows[cid] = len(new_ids)
+                    new_ids.append(cid)
+                    new_docs.append(documents[j])
+                    new_metas.append(metadatas[j])
+                    append.append(j)
+                else:
+                    new_docs[i] = documents[j]
+                    new_metas[i] = metadatas[j]
+                    replace.append((i, j))
+            base = snap.matrix if snap.ids else np.zeros((0, vecs.shape[1]), dtype=self.dtype)
+            matrix = np.concatenate([base, vecs[append]]) if append else np.array(base)
+            for i, j in replace:
+                matrix[i] = vecs[j]
+            self._snap = _Snapshot(matrix, new_ids, new_docs, new_metas)
+            self._dirty = True
+
+    def update_metadatas(self, ids, metadatas) -> None:
+        with self._lock:
+            snap = self._snap
+            new_metas = list(snap.metadatas)
+            for cid, meta in zip(ids, metadatas):
+                i = snap.rows.get(cid)
+                if i is not None:
+                    new_metas[i] = meta
+            self._snap = _Snapshot(snap.matrix, snap.ids, snap.documents, new_metas)
+            self._dirty = True
+
+    def delete(self, ids) -> None:
+        with self._lock:
+            snap = self._snap
+            gone = {snap.rows[cid] for cid in ids if cid in snap.rows}
+            if not gone:
+                return
+            keep = [i for i in range(len(snap.ids)) if i not in gone]
+            self._snap = _Snapshot(
+                np.asarray(snap.matrix[keep]),
+                [snap.ids[i] for i in keep],
+                [snap.documents[i] for i in keep],
+                [snap.metadatas[i] for i in keep],
+            )
+            self._dirty = True
+
+    def stats(self) -> dict:
+        snap = self._snap
+        return {"backend": self.name, "chunks": len(snap.ids), "dtype": self.dtype.name,
+                "partitions": len(snap.parts), "matrix_mb": round(snap.matrix.nbytes / 2 ** 20, 2)}
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(x, axis=-1, keepdims=True)
+    return x / np.clip(norm, 1e-12, None)
+
+
+STORES = ("chroma", "numpy")
+
+
+def open_store(db_path: Path, collection_name: str, backend: Optional[str] = None) -> VectorStore:
+    backend = (backend or RAG_STORE).strip().lower()
+    if backend == "chroma":
+        return ChromaStore.open(db_path, collection_name)
+    if backend == "numpy":
+        return NumpyStore(db_path, collection_name)
+    raise ValueError(f"unknown RAG_STORE: {backend} (choose from {', '.join(STORES)})")
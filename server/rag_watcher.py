@@ -0,0 +1,160 @@
+# server/rag_watcher.py
+from __future__ import annotations
+
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from rag_ingest import DOC_PATTERNS
+
+# 文件事件静默这么久之后才开始重建（编辑器保存常常连着触发好几次）
+WATCH_DEBOUNCE_S = float(os.getenv("RAG_WATCH_DEBOUNCE_MS", "1500")) / 1000.0
+# 没装 watchfiles 时的轮询间隔
+WATCH_POLL_S = float(os.getenv("RAG_WATCH_POLL_S", "2"))
+
+_SUFFIXES = {p.lstrip("*") for p in DOC_PATTERNS}
+
+
+class DocWatcher:
+    """
+    监听 RAG_DOC_DIR，去抖后把变动文件的相对路径批量交给 reindex 回调（在后台线程里执行，不占请求路径）。
+    优先用 watchfiles（uvicorn[standard] 自带），没有就退化为按 size/mtime 轮询。
+    """
+
+    def __init__(self, doc_dir: Path, reindex: Callable[[set[str]], dict],
+                 debounce_s: float = WATCH_DEBOUNCE_S, poll_s: float = WATCH_POLL_S):
+        self.doc_dir = Path(doc_dir)
+        self.reindex = reindex
+        self.debounce_s = debounce_s
+        self.poll_s = poll_s
+        self._pending: set[str] = set()
+        self._last_event = 0.0
+        self._busy = 0
+        self._cv = threading.Condition()
+        self._stop = threading.Event()
+        self.mode = "stopped"
+        self.reindex_count = 0
+        self.last_reindex_s: Optional[float] = None
+        self.last_report: Optional[dict] = None
+        self.last_error: Optional[str] = None
+
+    def start(self) -> "DocWatcher":
+        threading.Thread(target=self._watch_loop, name="rag-watch", daemon=True).start()
+        threading.Thread(target=self._work_loop, name="rag-reindex", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cv:
+            self._cv.notify_all()
+
+    def _rel(self, path: str | Path) -> Optional[str]:
+        p = Path(path)
+        if p.suffix.lower() not in _SUFFIXES:
+            return None
+        try:
+            return p.resolve().relative_to(self.doc_dir.resolve()).as_posix()
+        except ValueError:
+            return None
+
+    def enqueue(self, paths: Iterable[str | Path]) -> None:
+        rels = {r for r in (self._rel(p) for p in paths) if r}
+        if not rels:
+            return
+        with self._cv:
+            self._pending |= rels
+            self._last_event = time.monotonic()
+            self._cv.notify_all()
+
+    # 事件来源
+
+    def _watch_loop(self) -> None:
+        self.doc_dir.mkdir(parents=True, exist_ok=True)
+        try:
+            from watchfiles import watch
+        except ImportError:
+            self._poll_loop()
+            return
+        self.mode = "watchfiles"
+        print(f"[RAG-WATCH] watching {self.doc_dir} (watchfiles)")
+        try:
+            for changes in watch(self.doc_dir, stop_event=self._stop, recursive=True):
+                self.enqueue(path for _, path in changes)
+        except Exception as e:
+            print(f"[RAG-WATCH] watchfiles failed ({e!r}), falling back to polling")
+            self._poll_loop()
+
+    def _snapshot(self) -> dict[str, tuple[int, int]]:
+        snap: dict[str, tuple[int, int]] = {}
+        for pattern in DOC_PATTERNS:
+            for fp in self.doc_dir.rglob(pattern):
+                try:
+                    st = fp.stat()
+                except OSError:
+                    continue
+                snap[str(fp)] = (st.st_size, st.st_mtime_ns)
+        return snap
+
+    def _poll_loop(self) -> None:
+        self.mode = "polling"
+        print(f"[RAG-WATCH] watching {self.doc_dir} (polling every {self.poll_s}s)")
+        snap = self._snapshot()
+        while not self._stop.wait(self.poll_s):
+            cur = self._snapshot()
+            changed = [k for k in cur.keys() | snap.keys() if cur.get(k) != snap.get(k)]
+            snap = cur
+            if changed:
+                self.enqueue(changed)
+
+    # 重建
+
+    def _work_loop(self) -> None:
+        while not self._stop.is_set():
+            with self._cv:
+                while not self._pending and not self._stop.is_set():
+                    self._cv.wait()
+                # 去抖：等到最后一次事件之后安静 debounce_s
+                while not self._stop.is_set():
+                    quiet = time.monotonic() - self._last_event
+                    if quiet >= self.debounce_s:
+                        break
+                    self._cv.wait(self.debounce_s - quiet)
+                if self._stop.is_set():
+                    return
+                batch, self._pending = self._pending, set()
+                self._busy = len(batch)
+
+            t0 = time.perf_counter()
+            try:
+                report = self.reindex(batch)
+                self.last_report = {k: v for k, v in report.items() if not isinstance(v, list)}
+                self.last_error = None
+            except Exception as e:
+                self.last_error = repr(e)
+                print(f"[RAG-WATCH] reindex failed: {e!r}")
+                # 失败的文件放回队列，稍后重试
+                with self._cv:
+                    self._pending |= batch
+                    self._last_event = time.monotonic() + 5.0
+            finally:
+                self.last_reindex_s = round(time.perf_counter() - t0, 3)
+                self.reindex_count += 1
+                self._busy = 0
+            print(f"[RAG-WATCH] reindexed {len(batch)} file(s) in {self.last_reindex_s}s, "
+                  f"queue={self.queue_depth()}")
+
+    def queue_depth(self) -> int:
+        with self._cv:
+            return len(self._pending) + self._busy
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "queue_depth": self.queue_depth(),
+            "reindex_count": self.reindex_count,
+            "last_reindex_s": self.last_reindex_s,
+            "last_report": self.last_report,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,127 @@
+# server/readiness.py
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Callable, Optional
+
+# 各组件状态
+PENDING = "pending"     # 还没开始加载
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+LAZY = "lazy"           # 不预加载，第一次用时再加载（视为可用）
+
+
+class NotReady(Exception):
+    """组件还在加载或加载失败，对外返回 503 + Retry-After"""
+
+    def __init__(self, component: str, state: str, retry_after: int):
+        super().__init__(f"{component} is not ready ({state})")
+        self.component = component
+        self.state = state
+        self.retry_after = retry_after
+
+
+class Component:
+    def __init__(self, name: str, required: bool = True):
+        self.name = name
+        self.required = required
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def usable(self) -> bool:
+        return self.state in (READY, LAZY)
+
+
+class Readiness:
+    """
+    启动时重活都放到后台任务里做（建 Agent、加载向量模型、预热 Piper / Vosk），端口先监听起来；
+    每个组件记录加载状态和耗时，/ready 汇总，请求用 require() 检查依赖的组件。
+    """
+
+    def __init__(self):
+        self.boot_t0 = time.monotonic()
+        self.listen_s: Optional[float] = None
+        self.components: dict[str, Component] = {}
+
+    def add(self, name: str, required: bool = True, state: str = PENDING) -> Component:
+        c = self.components.get(name)
+        if c is None:
+            c = self.components[name] = Component(name, required)
+        c.required = required
+        c.state = state
+        return c
+
+    def mirror(self, stats: dict) -> list[str]:
+        """多进程模式：组件都在共享 host 里加载，worker 照抄 host 的 stats()；返回照抄的组件名"""
+        names = []
+        for name, s in (stats.get("components") or {}).items():
+            c = self.add(name, s.get("required", True), s.get("state", PENDING))
+            c.error = s.get("error")
+            names.append(name)
+        return names
+
+    def mark_listening(self) -> float:
+        self.listen_s = time.monotonic() - self.boot_t0
+        return self.listen_s
+
+    async def run(self, name: str, fn: Callable, required: bool = True) -> bool:
+        """加载一个组件：协程函数直接 await，普通函数放到线程里跑；失败只记录，不抛出"""
+        c = self.add(name, required, LOADING)
+        c.started_at = time.monotonic()
+        try:
+            if asyncio.iscoroutinefunction(fn):
+                await fn()
+            else:
+                await asyncio.to_thread(fn)
+            c.state = READY
+            c.error = None
+        except Exception as e:
+            c.state = FAILED
+            c.error = f"{e.__class__.__name__}: {e}"
+            print(f"[BOOT] {name} failed: {c.error}")
+        finally:
+            c.finished_at = time.monotonic()
+        if c.state == READY:
+            print(f"[BOOT] {name} ready in {c.finished_at - c.started_at:.2f}s")
+        return c.state == READY
+
+    def require(self, *names: str) -> None:
+        for name in names:
+            c = self.components.get(name)
+            if c is None or not c.usable:
+                state = c.state if c is not None else PENDING
+                # 还在加载的过几秒再试；加载失败的要等人处理，让客户端晚点再试
+                raise NotReady(name, state, 30 if state == FAILED else 5)
+
+    @property
+    def ready(self) -> bool:
+        return all(c.usable for c in self.components.values() if c.required)
+
+    def stats(self) -> dict:
+        def since_boot(t: Optional[float]) -> Optional[float]:
+            return round(t - self.boot_t0, 3) if t is not None else None
+
+        return {
+            "ready": self.ready,
+            "listen_s": round(self.listen_s, 3) if self.listen_s is not None else None,
+            "uptime_s": round(time.monotonic() - self.boot_t0, 1),
+            "components": {
+                c.name: {
+                    "state": c.state,
+                    "required": c.required,
+                    "error": c.error,
+                    "load_s": round(c.finished_at - c.started_at, 3)
+                    if c.started_at is not None and c.finished_at is not None else None,
+                    "ready_at_s": since_boot(c.finished_at) if c.state == READY else None,
+                }
+                for c in self.components.values()
+            },
+        }
+
+
+readiness = Readiness()
@@ -0,0 +1,195 @@
+# server/remote.py
+"""
+多进程模式的 worker 侧：Agent / Piper / Vosk 的代理，都调用共享 host（host.py）。
+接口和进程内的对象一致，main.py 不用区分；host 端的 NotReady / Overloaded 还原成本地异常（照常 503），
+连不上 host 视为 "host" 组件未就绪。音频编码（mu-law / ADPCM、切 20ms 块）在 worker 里做，host 只发 PCM。
+"""
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+from typing import AsyncIterator, Optional
+
+import metrics
+from admission import Overloaded
+from agent_base import AgentInterface
+from audio_codec import AudioCodec, encode_stream
+from ipc import HostUnavailable, RemoteError, RpcClient
+from readiness import PENDING, READY, NotReady, Readiness
+
+
+class HostClient(RpcClient):
+    def _error(self, e: Exception) -> Exception:
+        if isinstance(e, HostUnavailable):
+            return NotReady("host", PENDING, 5)
+        if isinstance(e, RemoteError):
+            x = e.extra
+            if e.type == "NotReady":
+                return NotReady(x.get("component", "host"), x.get("state", PENDING), int(x.get("retry_after", 5)))
+            if e.type == "Overloaded":
+                return Overloaded(x.get("stage", "host"), int(x.get("retry_after", 1)))
+            if e.type == "FileNotFoundError":
+                return FileNotFoundError(e.message)
+        return e
+
+
+class _RemoteStats:
+    # /tts/pool、/tts/cache 之类只读统计：stats() 返回协程
+    def __init__(self, host: HostClient, method: str):
+        self.host = host
+        self.method = method
+
+    def stats(self):
+        return self.host.call(self.method)
+
+
+class RemoteAgent(AgentInterface):
+    def __init__(self, host: HostClient):
+        self.host = host
+        self.sessions = _RemoteStats(host, "agent.sessions")
+
+    def reply(self, text: str, system_prompt: Optional[str] = None, exhibit: Optional[str] = None,
+              session_id: Optional[str] = None) -> str:
+        raise RuntimeError("RemoteAgent is async only, use reply_async")
+
+    async def reply_async(self, text: str, system_prompt: Optional[str] = None,
+                          exhibit: Optional[str] = None, session_id: Optional[str] = None) -> str:
+        return await self.host.call("agent.reply", text, system_prompt, exhibit, session_id)
+
+    async def stream_reply(self, text: str, system_prompt: Optional[str] = None,
+                           exhibit: Optional[str] = None, session_id: Optional[str] = None) -> AsyncIterator[str]:
+        gen = await self.host.open_stream("agent.stream", text, system_prompt, exhibit, session_id)
+        try:
+            async for chunk in gen:
+                yield chunk
+        finally:
+            await gen.aclose()
+
+    async def end_session(self, session_id: str) -> bool:
+        return await self.host.call("agent.end_session", session_id)
+
+    async def index_status(self) -> Optional[dict]:
+        # host 的 Agent 没有知识库时为 None
+        return await self.host.call("agent.index_status")
+
+
+class RemotePiper:
+    def __init__(self, host: HostClient):
+        self.host = host
+        self.pool = _RemoteStats(host, "tts.pool")
+        self.cache = _RemoteStats(host, "tts.cache")
+        self._rates: dict[Optional[str], int] = {}
+
+    async def synth(self, text: str, model_path: str | Path | None = None) -> bytes:
+        return await self.host.call("tts.synth", text, str(model_path) if model_path else None)
+
+    async def sample_rate(self, model_path: str | Path | None = None) -> int:
+        # 模型的采样率不会变，每个语音只问 host 一次
+        voice = str(model_path) if model_path else None
+        if voice not in self._rates:
+            self._rates[voice] = await self.host.call("tts.rate", voice)
+        return self._rates[voice]
+
+    async def stream_s16le(self, text: str, model_path: str | Path | None = None,
+                           sample_rate: Optional[int] = None, chunk_ms: int = 20, codec: Optional[AudioCodec] = None):
+        if codec is None:
+            codec = AudioCodec(sample_rate or await self.sample_rate(model_path), chunk_ms)
+        pcm = await self.host.open_stream("tts.stream", text, str(model_path) if model_path else None)
+        return encode_stream(pcm, codec)
+
+    async def close(self) -> None:
+        return None
+
+
+class RemoteAsrSession:
+    """识别会话在 host 的解码线程上，这里只转发音频帧；同一会话的调用按顺序 await，host 端天然有序"""
+
+    def __init__(self, host: HostClient, sample_rate: int):
+        self.host = host
+        self.sample_rate = sample_rate
+        self.sid: Optional[int] = None
+        self._closed = False
+
+    async def start(self) -> None:
+        if self.sid is None:
+            self.sid = await self.host.call("asr.open", self.sample_rate)
+        else:
+            await self.host.call("asr.start", self.sid)
+
+    async def feed(self, chunk: bytes) -> Optional[tuple[str, str]]:
+        if self.sid is None:
+            return None
+        res = await self.host.call("asr.feed", self.sid, data=chunk)
+        return tuple(res) if res else None
+
+    async def finish(self) -> str:
+        if self.sid is None:
+            return ""
+        return await self.host.call("asr.finish", self.sid)
+
+    def close(self) -> None:
+        if not self._closed and self.sid is not None:
+            self._closed = True
+            self.host.notify("asr.close", self.sid)
+
+
+class RemoteAsrPool:
+    def __init__(self, host: HostClient):
+        self.host = host
+
+    def session(self, sample_rate: int = 16000) -> RemoteAsrSession:
+        return RemoteAsrSession(self.host, sample_rate)
+
+    def stats(self):
+        return self.host.call("asr.stats")
+
+    def shutdown(self) -> None:
+        return None
+
+
+async def push_metrics(host: HostClient) -> None:
+    # 本进程的指标（HTTP 耗时等）增量推给 host 汇总；推不过去就放回来，下次再推
+    deltas = metrics.drain()
+    if not deltas:
+        return
+    try:
+        await host.call("metrics.merge", deltas)
+    except Exception:
+        metrics.merge(deltas)
+
+
+async def render_metrics(host: HostClient) -> str:
+    # /metrics：所有 worker 和 host 的汇总（host 不可用时只有本进程的）
+    await push_metrics(host)
+    try:
+        return await host.call("metrics.render")
+    except Exception:
+        return metrics.render()
+
+
+async def follow_host(host: HostClient, readiness: Readiness, interval_s: float = 5.0) -> None:
+    """
+    worker 的后台任务：照抄 host 的组件状态到本进程的 readiness（/ready、require 照常用），顺带推送指标。
+    host 还在加载时每 0.5 秒看一次；断开时组件回到 pending，重连上后继续（host 重启期间返回 503）。
+    """
+    mirrored: list[str] = []
+    while True:
+        try:
+            stats = await host.call("readiness")
+            readiness.add("host", state=READY).error = None
+            mirrored = readiness.mirror(stats)
+            wait_s = interval_s if stats.get("ready") else 0.5
+        except Exception as e:
+            readiness.add("host", state=PENDING).error = f"{e.__class__.__name__}: {e}"
+            for name in mirrored:
+                readiness.add(name, readiness.components[name].required, PENDING)
+            wait_s = 0.5
+        await push_metrics(host)
+        if not host.connected:
+            await asyncio.sleep(wait_s)
+            continue
+        try:
+            # 连接一断立刻醒来刷新状态
+            await asyncio.wait_for(host.lost.wait(), wait_s)
+        except asyncio.TimeoutError:
+            pass
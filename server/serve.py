@@ -0,0 +1,106 @@
+# server/serve.py
+"""
+启动服务（在 server/ 目录下运行）：
+  python serve.py                      # 单进程，同 uvicorn main:app --host 127.0.0.1 --port 8080
+  python serve.py --workers 4          # 多进程：先起共享 host（host.py），再起 4 个 uvicorn worker
+
+多进程模式下向量模型、向量库、Piper、Vosk 都只在 host 里加载一份（内存不随 worker 数翻倍），入库也只在 host 里做；
+worker 通过本机 IPC（默认 Unix 域套接字，Windows 上为 127.0.0.1 的 TCP）调用，地址经 MUSEUM_HOST 传给 worker。
+host 意外退出会被重启，期间 worker 的 /ready 为 503。
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import uvicorn
+
+from ipc import default_addr, probe
+
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", "1"))
+HOST_START_TIMEOUT_S = float(os.getenv("MUSEUM_HOST_START_TIMEOUT_S", "60"))
+
+
+class HostProcess:
+    """共享 host 子进程：起来后等它开始监听（模型在它的后台加载）；意外退出时重启"""
+
+    def __init__(self, addr: str):
+        self.addr = addr
+        self.proc: subprocess.Popen | None = None
+        self.restarts = 0
+        self._stopping = threading.Event()
+
+    def _spawn(self) -> None:
+        self.proc = subprocess.Popen([sys.executable, str(Path(__file__).resolve().parent / "host.py"),
+                                      "--addr", self.addr])
+        deadline = time.monotonic() + HOST_START_TIMEOUT_S
+        while not probe(self.addr):
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"host exited with code {self.proc.returncode}")
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"host did not listen on {self.addr} within {HOST_START_TIMEOUT_S:.0f}s")
+            time.sleep(0.05)
+
+    def start(self) -> None:
+        self._spawn()
+        threading.Thread(target=self._watch, name="host-watch", daemon=True).start()
+
+    def _watch(self) -> None:
+        while not self._stopping.is_set():
+            code = self.proc.wait()
+            if self._stopping.is_set():
+                return
+            self.restarts += 1
+            print(f"[SERVE] host exited with code {code}, restarting (#{self.restarts})")
+            time.sleep(min(5.0, 0.5 * self.restarts))
+            try:
+                self._spawn()
+            except RuntimeError as e:
+                print(f"[SERVE] host restart failed: {e}")
+
+    def stop(self) -> None:
+        self._stopping.set()
+        if self.proc is not None and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description="museum guide server")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8080)
+    ap.add_argument("--workers", type=int, default=SERVER_WORKERS, help="uvicorn worker processes")
+    ap.add_argument("--shared", action="store_true",
+                    help="use the shared host even with one worker (default: only when --workers > 1)")
+    ap.add_argument("--host-addr", default=os.getenv("MUSEUM_HOST_ADDR") or None,
+                    help="IPC address of the shared host: unix:/path.sock or tcp:127.0.0.1:PORT")
+    ap.add_argument("--log-level", default="info")
+    args = ap.parse_args()
+
+    if args.workers <= 1 and not args.shared:
+        uvicorn.run("main:app", host=args.host, port=args.port, log_level=args.log_level)
+        return 0
+
+    host = HostProcess(args.host_addr or default_addr(args.port))
+    host.start()
+    print(f"[SERVE] shared host at {host.addr}, starting {args.workers} worker(s)")
+    # worker 是 spawn 出来的新进程，靠环境变量拿到地址
+    os.environ["MUSEUM_HOST"] = host.addr
+    try:
+        uvicorn.run("main:app", host=args.host, port=args.port, workers=max(1, args.workers),
+                    log_level=args.log_level)
+    finally:
+        host.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
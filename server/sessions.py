@@ -0,0 +1,147 @@
+# server/sessions.py
+"""
+多轮对话会话：按客户端给的 session id 记住最近几轮问答，以及上游模型的续接状态
+（Ollama /api/generate 返回的 context，即已经算过 KV 的 token 序列）。
+下一轮带上 context 只发新的一轮，模型不用重新处理前面的说明和资料。
+
+内存有上限：会话数（超出淘汰最久没用的）、空闲时间、每个会话保留的轮数、context 的 token 数。
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from typing import Optional, Sequence
+
+SESSION_MAX = int(os.getenv("SESSION_MAX", "256"))
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "600"))
+# 每个会话保留的问答轮数（context 失效后用它重建 prompt）
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", "6"))
+
+_ID_RE = re.compile(r"^[A-Za-z0-9_.:-]{1,128}$")
+
+
+def normalize_session_id(raw: Optional[str]) -> Optional[str]:
+    # 空串为无会话（每轮独立）；只接受短的 token 形式，非法时抛 ValueError
+    sid = (raw or "").strip()
+    if not sid:
+        return None
+    if not _ID_RE.match(sid):
+        raise ValueError("session_id must be 1-128 chars of [A-Za-z0-9_.:-]")
+    return sid
+
+
+class Session:
+    """一个会话：最近几轮问答 + 续接状态；lock 保证同一会话的轮次按顺序执行"""
+
+    __slots__ = ("id", "turns", "context", "system", "sent", "pending", "lock", "last_used")
+
+    def __init__(self, sid: str, max_turns: int = SESSION_MAX_TURNS):
+        self.id = sid
+        self.turns: deque[tuple[str, str]] = deque(maxlen=max(1, max_turns))
+        # 上游返回的 token 序列（int32 紧凑存储）；None 表示下一轮要从 turns 重建完整 prompt
+        self.context: Optional[array] = None
+        # context 是在哪个 system prompt 下建立的，换了就不能续接
+        self.system: Optional[str] = None
+        # context 里已经有的资料原文（来源#段 -> 文本），追问时不再重复发；pending 是本轮正要发的
+        self.sent: dict[str, str] = {}
+        self.pending: dict[str, str] = {}
+        self.lock = asyncio.Lock()
+        self.last_used = time.monotonic()
+
+    @property
+    def context_tokens(self) -> int:
+        return len(self.context) if self.context is not None else 0
+
+    def resume_context(self, system_prompt: Optional[str], max_tokens: int) -> Optional[list[int]]:
+        # 能续接时返回 context；system 变了或 context 太长（再加一轮会超 num_ctx）就丢掉，下一轮重建
+        if self.context is None:
+            return None
+        if self.system != system_prompt or len(self.context) > max_tokens:
+            self.context = None
+            self.sent = {}
+            return None
+        return self.context.tolist()
+
+    def record(self, question: str, answer: str, context: Optional[Sequence[int]],
+               system_prompt: Optional[str]) -> None:
+        # 一轮结束：记下问答；context 为 None（缓存命中、被打断、上游不返回）时下一轮从文本重建
+        if answer:
+            self.turns.append((question, answer))
+        self.context = array("i", context) if context else None
+        if self.context is None:
+            self.sent = {}
+        else:
+            for key, text in self.pending.items():
+                self.sent[key] = self.sent.get(key, "") + "\n" + text
+        self.pending = {}
+        self.system = system_prompt
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    """LRU + 空闲超时；get 可能在线程里调用（同步 reply），内部加锁"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX, ttl_s: float = SESSION_TTL_S,
+                 max_turns: int = SESSION_MAX_TURNS):
+        self.max_sessions = max(1, max_sessions)
+        self.ttl_s = ttl_s
+        self.max_turns = max_turns
+        self._items: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.evicted = 0
+        self.expired = 0
+
+    def _expire(self, now: float) -> None:
+        while self._items:
+            sid, s = next(iter(self._items.items()))
+            if now - s.last_used <= self.ttl_s:
+                break
+            del self._items[sid]
+            self.expired += 1
+
+    def get(self, sid: str) -> Session:
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            s = self._items.get(sid)
+            if s is None:
+                s = Session(sid, self.max_turns)
+                self._items[sid] = s
+                self.created += 1
+                while len(self._items) > self.max_sessions:
+                    self._items.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self._items.move_to_end(sid)
+            s.last_used = now
+            return s
+
+    def drop(self, sid: str) -> bool:
+        with self._lock:
+            return self._items.pop(sid, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._expire(time.monotonic())
+            items = list(self._items.values())
+        return {
+            "sessions": len(items),
+            "max_sessions": self.max_sessions,
+            "ttl_s": self.ttl_s,
+            "max_turns": self.max_turns,
+            "turns": sum(len(s.turns) for s in items),
+            "context_tokens": sum(s.context_tokens for s in items),
+            "context_bytes": sum(s.context_tokens * 4 for s in items),
+            "created": self.created,
+            "evicted": self.evicted,
+            "expired": self.expired,
+        }
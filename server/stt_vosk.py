@@ -1,6 +1,8 @@
 # server/stt_vosk.py
 from __future__ import annotations
 import os
+import threading
+import time
 from pathlib import Path
 from typing import Optional, Tuple
 from vosk import Model, KaldiRecognizer
@@ -13,21 +15,33 @@ DEFAULT_MODEL_DIR = BASE_DIR / "models" / "vosk-model-small-en-us-0.15"
 # 允许通过环境变量覆盖
 MODEL_DIR = Path(os.getenv("VOSK_MODEL_DIR", str(DEFAULT_MODEL_DIR)))
 
+# 启动时预加载模型并预建识别器
+VOSK_PRELOAD = os.getenv("VOSK_PRELOAD", "1").lower() in ("1", "true", "yes", "on")
+# 预建识别器的采样率（逗号分隔）和每个采样率预建的个数
+VOSK_PRELOAD_RATES = [int(x) for x in os.getenv("VOSK_PRELOAD_RATES", "16000").split(",") if x.strip()]
+VOSK_POOL_MIN = int(os.getenv("VOSK_POOL_MIN", "2"))
+# 每个采样率最多缓存多少个空闲识别器
+VOSK_POOL_MAX = int(os.getenv("VOSK_POOL_MAX", "8"))
+
 # 全局模型加载
 _model: Optional[Model] = None
+_model_lock = threading.Lock()
 
 def ensure_model() -> Model:
     global _model
     if _model is None:
-        if not MODEL_DIR.exists():
-            raise RuntimeError(
-                f"Vosk model directory not found: {MODEL_DIR}\n"
-                f"Download and extract a model, e.g.:\n"
-                f"  https://alphacephei.com/vosk/models\n"
-                f"and set VOSK_MODEL_DIR or place it under {DEFAULT_MODEL_DIR}"
-            )
-        _model = Model(str(MODEL_DIR))
-        print(f"[VOSK] model loaded: {MODEL_DIR}")
+        # 启动预加载和第一个会话可能同时进来，只加载一次
+        with _model_lock:
+            if _model is None:
+                if not MODEL_DIR.exists():
+                    raise RuntimeError(
+                        f"Vosk model directory not found: {MODEL_DIR}\n"
+                        f"Download and extract a model, e.g.:\n"
+                        f"  https://alphacephei.com/vosk/models\n"
+                        f"and set VOSK_MODEL_DIR or place it under {DEFAULT_MODEL_DIR}"
+                    )
+                _model = Model(str(MODEL_DIR))
+                print(f"[VOSK] model loaded: {MODEL_DIR}")
     return _model
 
 def create_recognizer(sample_rate: int = 16000) -> KaldiRecognizer:
@@ -38,3 +52,62 @@ def create_recognizer(sample_rate: int = 16000) -> KaldiRecognizer:
     model = ensure_model()
     rec = KaldiRecognizer(model, sample_rate)
     return rec
+
+
+class RecognizerPool:
+    """
+    按采样率缓存空闲识别器：stop / 断开后 Reset 放回，下次 start 直接取，不用重新构建。
+    每个采样率最多留 max_idle 个。线程安全（在 ASR 工作线程里取还）。
+    """
+
+    def __init__(self, max_idle: int = VOSK_POOL_MAX):
+        self.max_idle = max(0, max_idle)
+        self._idle: dict[int, list[KaldiRecognizer]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def acquire(self, sample_rate: int) -> KaldiRecognizer:
+        with self._lock:
+            idle = self._idle.get(sample_rate)
+            if idle:
+                self.hits += 1
+                return idle.pop()
+            self.misses += 1
+        return create_recognizer(sample_rate)
+
+    def release(self, rec: KaldiRecognizer, sample_rate: int) -> None:
+        try:
+            rec.Reset()
+        except Exception:
+            return
+        with self._lock:
+            idle = self._idle.setdefault(sample_rate, [])
+            if len(idle) < self.max_idle:
+                idle.append(rec)
+
+    def warm(self, sample_rate: int, n: int) -> None:
+        # 预建 n 个识别器，第一个先解一段静音，把解码图、缓存等都走一遍
+        recs = [create_recognizer(sample_rate) for _ in range(max(0, n))]
+        if recs:
+            recs[0].AcceptWaveform(b"\0\0" * (sample_rate // 2))
+            recs[0].FinalResult()
+        for rec in recs:
+            self.release(rec, sample_rate)
+
+    def stats(self) -> dict:
+        with self._lock:
+            idle = {str(sr): len(v) for sr, v in self._idle.items()}
+        return {"idle": idle, "max_idle": self.max_idle, "hits": self.hits, "misses": self.misses}
+
+
+recognizer_pool = RecognizerPool()
+
+
+def preload() -> None:
+    """启动时调用：加载模型并预建识别器，第一位访客不用等"""
+    t0 = time.perf_counter()
+    ensure_model()
+    for sr in VOSK_PRELOAD_RATES:
+        recognizer_pool.warm(sr, min(VOSK_POOL_MIN, recognizer_pool.max_idle))
+    print(f"[VOSK] preloaded in {time.perf_counter() - t0:.2f}s, pool {recognizer_pool.stats()['idle']}")
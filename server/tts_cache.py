@@ -0,0 +1,212 @@
+# server/tts_cache.py
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE", "1").lower() not in ("0", "false", "no", "off")
+# 内存层字节预算
+TTS_CACHE_MEM_BYTES = int(float(os.getenv("TTS_CACHE_MEM_MB", "64")) * 1024 * 1024)
+# 磁盘层字节预算，0 表示不落盘
+TTS_CACHE_DISK_BYTES = int(float(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024)
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", str(BASE_DIR / "tts_cache")))
+
+
+def normalize_text(text: str) -> str:
+    # Unicode 归一 + 折叠空白，大小写保留（会影响朗读）
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def cache_key(text: str, model: Path, length_scale: float, sample_rate: int, fmt: str) -> str:
+    """
+    内容寻址：规范化文本 + 语音模型（路径、大小、修改时间）+ 语速 + 采样率 + 输出格式
+    模型文件被替换后旧条目自然失效。
+    """
+    try:
+        st = model.stat()
+        model_id = f"{model.resolve()}|{st.st_size}|{st.st_mtime_ns}"
+    except OSError:
+        model_id = str(model)
+    raw = "\x1f".join([normalize_text(text), model_id, f"{length_scale:g}", str(sample_rate), fmt])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class _MemoryTier:
+    # 按字节预算的 LRU
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.items: OrderedDict[str, bytes] = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        data = self.items.get(key)
+        if data is not None:
+            self.items.move_to_end(key)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self.items[key] = data
+        self.bytes += len(data)
+        while self.bytes > self.max_bytes and self.items:
+            _, dropped = self.items.popitem(last=False)
+            self.bytes -= len(dropped)
+            self.evictions += 1
+
+
+class _DiskTier:
+    """
+    磁盘层：每条一个文件 <dir>/<前两位>/<key>.bin，写临时文件后原子替换。
+    超出预算按最近访问时间淘汰（索引在内存里，启动时扫一遍目录重建）。
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.bytes = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.bin"
+
+    def _load(self) -> None:
+        # 首次访问时建立索引，旧文件按 mtime 排序当作 LRU 顺序
+        if self._loaded:
+            return
+        self._loaded = True
+        if not self.root.exists():
+            return
+        entries = []
+        for fp in self.root.glob("*/*.bin"):
+            try:
+                st = fp.stat()
+            except OSError:
+                continue
+            entries.append((st.st_mtime, fp.stem, st.st_size))
+        for _, key, size in sorted(entries):
+            self.index[key] = size
+            self.bytes += size
+        self._evict()
+
+    def _evict(self) -> None:
+        while self.bytes > self.max_bytes and self.index:
+            key, size = self.index.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            self._load()
+            if key not in self.index:
+                return None
+            self.index.move_to_end(key)
+        try:
+            return self._path(key).read_bytes()
+        except OSError:
+            with self._lock:
+                size = self.index.pop(key, 0)
+                self.bytes -= size
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        fp = self._path(key)
+        try:
+            fp.parent.mkdir(parents=True, exist_ok=True)
+            tmp = fp.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, fp)
+        except OSError as e:
+            print(f"[TTS-CACHE] disk write failed: {e}")
+            return
+        with self._lock:
+            self._load()
+            old = self.index.pop(key, None)
+            if old is not None:
+                self.bytes -= old
+            self.index[key] = len(data)
+            self.bytes += len(data)
+            self._evict()
+
+
+class TTSCache:
+    """两级缓存：内存 LRU 在前，磁盘在后；磁盘命中会提升到内存"""
+
+    def __init__(self, mem_bytes: int = TTS_CACHE_MEM_BYTES, disk_bytes: int = TTS_CACHE_DISK_BYTES,
+                 disk_dir: Path = TTS_CACHE_DIR, enabled: bool = TTS_CACHE_ENABLED):
+        self.enabled = enabled
+        self.mem = _MemoryTier(mem_bytes)
+        self.disk = _DiskTier(disk_dir, disk_bytes) if disk_bytes > 0 else None
+        self.hits_mem = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        data = self.mem.get(key)
+        if data is not None:
+            self.hits_mem += 1
+            return data
+        if self.disk is not None:
+            data = await asyncio.to_thread(self.disk.get, key)
+            if data is not None:
+                self.hits_disk += 1
+                self.mem.put(key, data)
+                return data
+        self.misses += 1
+        return None
+
+    async def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or not data:
+            return
+        self.stores += 1
+        self.mem.put(key, data)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, data)
+
+    def stats(self) -> dict:
+        lookups = self.hits_mem + self.hits_disk + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits_mem": self.hits_mem,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits_mem + self.hits_disk) / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "mem": {
+                "entries": len(self.mem.items),
+                "bytes": self.mem.bytes,
+                "max_bytes": self.mem.max_bytes,
+                "evictions": self.mem.evictions,
+            },
+            "disk": None if self.disk is None else {
+                "entries": len(self.disk.index),
+                "bytes": self.disk.bytes,
+                "max_bytes": self.disk.max_bytes,
+                "evictions": self.disk.evictions,
+                "dir": str(self.disk.root),
+            },
+        }
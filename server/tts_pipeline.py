@@ -0,0 +1,187 @@
+# server/tts_pipeline.py
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+from typing import AsyncIterator, Optional
+
+from audio_codec import AudioCodec, FrameEncoder
+
+# 同时在合成的句子数 = 正在播放的 1 句 + 预合成 lookahead 句
+PIPELINE_LOOKAHEAD = int(os.getenv("TTS_PIPELINE_LOOKAHEAD", "1"))
+# 太短的句子并到下一句，避免 "Yes." 这种碎片单独起一次合成
+SENTENCE_MIN_CHARS = int(os.getenv("TTS_SENTENCE_MIN_CHARS", "24"))
+# 迟迟没有句号时，超过这个长度就在逗号/空格处强制断开
+SENTENCE_MAX_CHARS = int(os.getenv("TTS_SENTENCE_MAX_CHARS", "240"))
+
+# 西文句末标点后要跟空白才算断句（避免 3.5、e.g. 被切开）；中文句末标点直接断
+_LATIN_END = re.compile(r"[.!?;:]+[\"')\]]*\s")
+_CJK_END = re.compile(r"[。！？；]+[”’）」]*")
+_SOFT_BREAK = re.compile(r"[,，、]\s*|\s")
+_ABBREV = {"mr.", "mrs.", "ms.", "dr.", "st.", "no.", "vs.", "e.g.", "i.e.", "etc.", "ca.", "c.", "jr.", "sr."}
+
+
+class SentenceSplitter:
+    """增量断句：不断喂入 token，吐出已经完整的句子"""
+
+    def __init__(self, min_chars: int = SENTENCE_MIN_CHARS, max_chars: int = SENTENCE_MAX_CHARS):
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.buf = ""
+
+    def _next_boundary(self, start: int) -> int:
+        # 返回 buf 中从 start 起第一个句末位置（句子结束的下标），找不到返回 -1
+        pos = start
+        while True:
+            m1 = _LATIN_END.search(self.buf, pos)
+            m2 = _CJK_END.search(self.buf, pos)
+            cands = [m for m in (m1, m2) if m]
+            if not cands:
+                return -1
+            m = min(cands, key=lambda x: x.start())
+            if m is m1:
+                word = self.buf[:m.start() + 1].rsplit(None, 1)[-1].lower()
+                if word in _ABBREV:
+                    pos = m.end()
+                    continue
+            return m.end()
+
+    def feed(self, text: str) -> list[str]:
+        self.buf += text
+        out: list[str] = []
+        start = 0
+        while True:
+            end = self._next_boundary(start)
+            if end < 0:
+                break
+            if end < self.min_chars:
+                # 太短，继续往后找下一个句末一起输出
+                start = end
+                continue
+            out.append(self.buf[:end].strip())
+            self.buf = self.buf[end:]
+            start = 0
+
+        if len(self.buf) > self.max_chars:
+            cut = -1
+            for m in _SOFT_BREAK.finditer(self.buf, 0, self.max_chars):
+                cut = m.end()
+            if cut > self.min_chars:
+                out.append(self.buf[:cut].strip())
+                self.buf = self.buf[cut:]
+        return [s for s in out if s]
+
+    def flush(self) -> list[str]:
+        rest = self.buf.strip()
+        self.buf = ""
+        return [rest] if rest else []
+
+
+async def split_sentences(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    splitter = SentenceSplitter()
+    async for tok in tokens:
+        for s in splitter.feed(tok):
+            yield s
+    for s in splitter.flush():
+        yield s
+
+
+_DONE = object()
+
+
+async def pipeline_pcm(sentences: AsyncIterator[str], tts, model_path: Optional[str] = None,
+                       sample_rate: Optional[int] = None, chunk_ms: int = 20,
+                       lookahead: int = PIPELINE_LOOKAHEAD, codec: Optional[AudioCodec] = None) -> AsyncIterator[bytes]:
+    """
+    句子流 -> PCM 流：第 N 句在播放（输出）时，第 N+1 句已经在合成、LLM 还在继续生成。
+    输出严格按句子顺序，跨句重新切成 chunk_ms 的定长块，句子之间不留空档；给了 codec 就输出编码后的定长块。
+    采样率是语音模型的原始采样率（sample_rate 不填时向 tts 查）。
+    """
+    if codec is None:
+        codec = AudioCodec(sample_rate or await tts.sample_rate(model_path), chunk_ms)
+    frames = FrameEncoder(codec)
+    order: asyncio.Queue = asyncio.Queue()
+    # 同时在合成的句子数上限：先占名额再起合成任务，输出完一句才归还（否则排队等 order 的那句也已经在合成）
+    slots = asyncio.Semaphore(max(0, lookahead) + 1)
+    tasks: list[asyncio.Task] = []
+
+    async def _synth_one(text: str, out: asyncio.Queue) -> None:
+        try:
+            gen = await tts.stream_s16le(text=text, model_path=model_path,
+                                         sample_rate=codec.sample_rate, chunk_ms=codec.chunk_ms)
+            async for c in gen:
+                out.put_nowait(c)
+        except Exception as e:
+            out.put_nowait(e)
+        finally:
+            out.put_nowait(_DONE)
+
+    async def _produce() -> None:
+        try:
+            async for s in sentences:
+                await slots.acquire()
+                out: asyncio.Queue = asyncio.Queue()
+                tasks.append(asyncio.create_task(_synth_one(s, out)))
+                await order.put(out)
+        except Exception as e:
+            err: asyncio.Queue = asyncio.Queue()
+            err.put_nowait(e)
+            await order.put(err)
+        finally:
+            await order.put(None)
+
+    producer = asyncio.create_task(_produce())
+    try:
+        while True:
+            out = await order.get()
+            if out is None:
+                break
+            done = False
+            while not done:
+                # 合成比播放快时队列里会攒下好几块，一起取出来一次编码
+                items = [await out.get()]
+                while not out.empty():
+                    items.append(out.get_nowait())
+                pcm = bytearray()
+                err: Optional[Exception] = None
+                for item in items:
+                    if item is _DONE:
+                        done = True
+                        break
+                    if isinstance(item, Exception):
+                        err = item
+                        break
+                    pcm += item
+                for c in frames.feed(pcm):
+                    yield c
+                if err is not None:
+                    raise err
+            slots.release()
+        for c in frames.flush():
+            yield c
+    finally:
+        producer.cancel()
+        for t in tasks:
+            t.cancel()
+
+
+async def prime_stream(gen: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    先拿到第一块再返回：上游（LLM/TTS）在出声前就失败时，调用方还能返回 HTTP 错误
+    """
+    try:
+        first = await gen.__anext__()
+    except StopAsyncIteration:
+        raise RuntimeError("empty agent reply")
+
+    async def _rest():
+        try:
+            yield first
+            async for c in gen:
+                yield c
+        finally:
+            # 客户端断开时及时关掉上游（释放名额、停止合成）
+            await gen.aclose()
+
+    return _rest()
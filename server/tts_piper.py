@@ -1,49 +1,86 @@
 # server/tts_piper.py
 from __future__ import annotations
-import subprocess
-import tempfile
+import io
+import json
 import os
+import wave
+from functools import lru_cache
 from pathlib import Path
+from typing import Optional
 
-import asyncio, shlex
-import os, subprocess, asyncio
-from pathlib import Path
+from audio_codec import AudioCodec, encode_stream
+from piper_pool import PiperPool
+from tts_cache import TTSCache, cache_key
 
 
 # 模型
 DEFAULT_VOICE = "en_US-amy-medium.onnx"
 
-PIPER_DIR = Path(__file__).resolve().parent.parent / "models" / "piper_win64"
-PIPER_EXE = PIPER_DIR / "piper.exe"
+# Piper 目录（放 piper 可执行文件和语音模型）、可执行文件、语音模型目录，可用环境变量覆盖
+_MODELS_DIR = Path(__file__).resolve().parent.parent / "models"
+PIPER_DIR = Path(os.getenv("PIPER_DIR") or _MODELS_DIR / ("piper_win64" if os.name == "nt" else "piper"))
+PIPER_VOICES_DIR = Path(os.getenv("PIPER_VOICES_DIR") or PIPER_DIR)
+
+# 只认 Piper 的 C++ 可执行文件：进程池靠它在 stderr 打印的 "Real-time factor" 判断一句合成完
+PIPER_EXE = Path(os.getenv("PIPER_EXE") or PIPER_DIR / ("piper.exe" if os.name == "nt" else "piper"))
 
 # 语速：Piper 的 length_scale，<1 加快，>1 变慢，默认 1.0
 DEFAULT_LENGTH_SCALE = float(os.getenv("TTS_LENGTH_SCALE", "0.9"))
+# 句间静音（秒）
+SENTENCE_SILENCE = os.getenv("TTS_SENTENCE_SILENCE", "0.25")
+
+
+@lru_cache(maxsize=32)
+def _model_sample_rate(model: str) -> int:
+    # 从 .onnx.json 读语音的真实采样率，读不到按 22050
+    try:
+        cfg = json.loads(Path(model + ".json").read_text(encoding="utf-8"))
+        return int(cfg["audio"]["sample_rate"])
+    except Exception:
+        return 22050
+
 
 class PiperTTS:
     def __init__(self, piper_exe: Path = PIPER_EXE, default_voice: str = DEFAULT_VOICE,
-                 length_scale: float = DEFAULT_LENGTH_SCALE):
+                 length_scale: float = DEFAULT_LENGTH_SCALE, voices_dir: Path = PIPER_VOICES_DIR):
         self.piper_exe = Path(piper_exe)
-        if not self.piper_exe.exists():
-            raise FileNotFoundError(f"piper.exe not found: {self.piper_exe}")
-
+        # 进程的工作目录：可执行文件旁边的动态库、espeak-ng-data 按这个找
         self.workdir = self.piper_exe.parent
+        self.voices_dir = Path(voices_dir)
         # 默认模型文件
-        self.default_model = self.workdir / default_voice
-        if not self.default_model.exists():
-            raise FileNotFoundError(f"piper model not found: {self.default_model}")
+        self.default_model = self.voices_dir / default_voice
         self.length_scale = length_scale
 
+        env = os.environ.copy()
+        env["PATH"] = str(self.workdir) + os.pathsep + env.get("PATH", "")
+        if os.name != "nt":
+            # Linux 发行包里的 libpiper_phonemize / libonnxruntime 和可执行文件放在一起
+            env["LD_LIBRARY_PATH"] = str(self.workdir) + os.pathsep + env.get("LD_LIBRARY_PATH", "")
+        # 常驻进程池：每个语音的模型只加载一次
+        self.pool = PiperPool(self._worker_args, cwd=str(self.workdir), env=env)
+        # 合成结果缓存（内存 + 磁盘）
+        self.cache = TTSCache()
+
+    def _worker_args(self, model: Path) -> list[str]:
+        return [
+            str(self.piper_exe),
+            "-m", str(model),
+            "--output-raw",
+            "--sentence_silence", SENTENCE_SILENCE,
+            "--length_scale", str(self.length_scale),
+        ]
+
     def _resolve_model(self, model_path: str | Path | None) -> Path:
         """
         解析路径：
         - 传入绝对/相对路径则按给定路径
-        - 只传文件名，在 piper.exe 同目录下找
+        - 只传文件名，在语音模型目录（PIPER_VOICES_DIR）下找
         - 没传，则用默认模型
         """
         if model_path:
             p = Path(model_path)
             if not p.is_absolute():
-                p = self.workdir / p.name
+                p = self.voices_dir / p.name
         else:
             p = self.default_model
 
@@ -51,118 +88,78 @@ class PiperTTS:
             raise FileNotFoundError(f"voice model not found: {p}")
         return p
 
-    def synth(self, text: str, model_path: str | Path | None = None) -> bytes:
+    def check(self) -> None:
+        # 缺文件时在启动预热里报错（/ready 显示），不在 import 时让整个服务起不来
+        if not self.piper_exe.exists():
+            raise FileNotFoundError(f"piper executable not found: {self.piper_exe}")
+        if not self.default_model.exists():
+            raise FileNotFoundError(f"piper model not found: {self.default_model}")
+
+    async def start(self) -> None:
+        # 启动巡检并预热默认语音
+        self.check()
+        self.pool.start()
+        if not await self.pool.warm(self.default_model):
+            raise RuntimeError(f"piper warm-up failed for {self.default_model.name}")
+
+    async def close(self) -> None:
+        await self.pool.close()
+
+    async def _pcm_stream(self, model: Path, text: str):
+        """
+        产出整句 PCM：缓存命中直接返回整块，未命中走进程池并在完整合成后写回缓存
+        """
+        key = cache_key(text, model, self.length_scale, _model_sample_rate(str(model)), "s16le")
+        cached = await self.cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+
+        pcm = bytearray()
+        async for chunk in self.pool.stream(model, text):
+            pcm += chunk
+            yield chunk
+        await self.cache.put(key, bytes(pcm))
+
+    async def synth(self, text: str, model_path: str | Path | None = None) -> bytes:
         """
-        调用Piper把text合成到WAV临时文件，返回WAV
+        用常驻 Piper 进程合成整段 PCM（优先读缓存），在内存里封装成 WAV 返回
         """
         model = self._resolve_model(model_path)
+        pcm = bytearray()
+        async for chunk in self._pcm_stream(model, text):
+            pcm += chunk
+
+        buf = io.BytesIO()
+        with wave.open(buf, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(_model_sample_rate(str(model)))
+            wf.writeframes(bytes(pcm))
+        return buf.getvalue()
+
+    async def stream_pcm(self, text: str, model_path: str | Path | None = None):
+        """
+        整句 s16le PCM 流（模型原始采样率，不切块）。模型在这里先解析，找不到直接抛错，调用方还能返回 HTTP 错误。
+        """
+        model = self._resolve_model(model_path)
+        return self._pcm_stream(model, text)
 
-        # 创建临时WAV文件
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-            tmp_name = tmp.name
-
-        try:
-            cmd = [
-                str(self.piper_exe),
-                "-m", str(model),   # 模型
-                "-f", tmp_name,     # 输出WAV文件
-                "--length_scale", str(self.length_scale),
-            ]
-
-            proc = subprocess.run(
-                cmd,
-                input=text,
-                text=True,
-                cwd=str(self.workdir),
-                capture_output=True,   
-                check=True,
-            )
-
-            with open(tmp_name, "rb") as f:
-                wav_bytes = f.read()
-            return wav_bytes
-
-        except subprocess.CalledProcessError as e:
-            raise RuntimeError(
-                f"Piper failed (exit {e.returncode}).\nstdout:\n{e.stdout}\nstderr:\n{e.stderr}"
-            ) from e
-        finally:
-            try:
-                os.remove(tmp_name)
-            except Exception:
-                pass
+    async def sample_rate(self, model_path: str | Path | None = None) -> int:
+        """语音模型的输出采样率（流式编码按这个建 codec）；模型找不到抛 FileNotFoundError"""
+        return _model_sample_rate(str(self._resolve_model(model_path)))
 
     async def stream_s16le(self, text: str, model_path: str | Path | None = None,
-                           sample_rate: int = 16000, chunk_ms: int = 20):
+                           sample_rate: Optional[int] = None, chunk_ms: int = 20, codec: Optional[AudioCodec] = None):
         """
-        以裸PCM(s16le, mono)流式输出 Piper 音频。
-        在Windows下用 subprocess.Popen + 线程执行阻塞 IO，避免 asyncio.create_subprocess_exec 的 NotImplementedError
+        以裸PCM(s16le, mono)流式输出 Piper 音频，按 chunk_ms 切成定长块；给了 codec 就输出编码后的定长块。
+        采样率是模型的原始采样率（sample_rate 不填时按模型算帧长）。
+        缓存命中和现场合成走同一套切块，客户端收到的都是定长块（缓存命中整句一次编码）。
         """
-
-
-        model = Path(self._resolve_model(model_path))
-        chunk_bytes = int(sample_rate * (chunk_ms / 1000.0) * 2)
-
-        piper_exe = Path(self.piper_exe)
-        piper_dir = str(piper_exe.parent)
-
-        if not piper_exe.exists():
-            raise RuntimeError(f"piper.exe not found: {piper_exe}")
-        if not model.exists():
-            raise RuntimeError(f"voice model not found: {model}")
-
-        args = [
-            str(piper_exe),
-            "-m", str(model),
-            "-f", str(sample_rate),
-            "--output-raw",
-            "--sentence_silence", "0.25",
-            "--length_scale", str(self.length_scale),
-        ]
-        env = os.environ.copy()
-        env["PATH"] = piper_dir + os.pathsep + env.get("PATH", "")
-
-        # Popen阻塞，配合线程池做读写 
-        proc = subprocess.Popen(
-            args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            cwd=piper_dir,
-            env=env,
-        )
-
-        loop = asyncio.get_running_loop()
-
-        async def _gen():
-            try:
-                # 写入文本并关闭stdin,在线程里执行阻塞写
-                def _write_and_close():
-                    proc.stdin.write(text.encode("utf-8"))
-                    proc.stdin.flush()
-                    proc.stdin.close()
-                await asyncio.to_thread(_write_and_close)
-
-                # 持续读取stdout每次阻塞 read，用线程搬运到异步
-                while True:
-                    chunk = await loop.run_in_executor(None, proc.stdout.read, chunk_bytes)
-                    if not chunk:
-                        break
-                    yield chunk
-
-                # 等待进程结束并检查返回码
-                rc = await loop.run_in_executor(None, proc.wait)
-                if rc != 0:
-                    err = await asyncio.to_thread(proc.stderr.read)
-                    raise RuntimeError(f"Piper failed (exit {rc}): {err.decode('utf-8','ignore').strip()[:800]}")
-            finally:
-                try:
-                    if proc and proc.poll() is None:
-                        proc.kill()
-                except Exception:
-                    pass
-
-        return _gen()
+        pcm = await self.stream_pcm(text, model_path)
+        if codec is None:
+            codec = AudioCodec(sample_rate or await self.sample_rate(model_path), chunk_ms)
+        return encode_stream(pcm, codec)
 
 
 # 单例，后端直接import